@@ -0,0 +1,167 @@
+import os
+import abc
+import struct
+import logging
+import ctypes
+import ctypes.util
+
+# inotify constants from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len
+
+
+class ChangeSource(abc.ABC):
+    """Tells ImageCache which folders below picture_dir need to be rescanned.
+
+    get_changed_folders() returns a tuple (folders, full_walk). If full_walk is True
+    the list holds every folder found on disk and the caller should compare folder
+    modification times with the db. Otherwise the list only holds folders in which
+    something happened since the previous call, so their files should be checked directly.
+    """
+
+    def __init__(self, picture_dir, follow_links):
+        self._picture_dir = picture_dir
+        self._follow_links = follow_links
+        self._full_walk_requested = True
+
+    def request_full_walk(self):
+        self._full_walk_requested = True
+
+    @abc.abstractmethod
+    def get_changed_folders(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _walk(self, top):
+        return [d[0] for d in os.walk(top, followlinks=self._follow_links)]
+
+
+class PollingChangeSource(ChangeSource):
+    """Walks the whole picture_dir tree every time it's asked. This is the original behaviour
+    and works everywhere, including network shares that don't deliver inotify events.
+    """
+
+    def get_changed_folders(self):
+        self._full_walk_requested = False
+        return self._walk(self._picture_dir), True
+
+
+class InotifyChangeSource(ChangeSource):
+    """Uses a (non-blocking) inotify watch on every folder, so after the first walk only
+    the folders in which files were created, deleted, moved or written are returned.
+    """
+
+    def __init__(self, picture_dir, follow_links):
+        super().__init__(picture_dir, follow_links)
+        self.__logger = logging.getLogger("change_source.InotifyChangeSource")
+        self.__libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.__fd = self.__libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.__watches = {} # wd -> folder name
+        self.__changed = set()
+
+    def get_changed_folders(self):
+        if self.__fd < 0: # watching failed earlier so behave like PollingChangeSource
+            return self._walk(self._picture_dir), True
+        if self._full_walk_requested:
+            self._full_walk_requested = False
+            self.__read_events() # anything already queued is covered by the walk
+            self.__changed.clear()
+            try:
+                return self.__add_watches(self._picture_dir), True
+            except OSError as e:
+                self.__logger.warning("inotify watches failed, falling back to polling %s -> %s",
+                                      self._picture_dir, e)
+                self.close()
+                return self._walk(self._picture_dir), True
+        self.__read_events()
+        if self._full_walk_requested: # queue overflowed while reading, events have been lost
+            return self.get_changed_folders()
+        changed = [d for d in self.__changed if os.path.isdir(d)]
+        self.__changed.clear()
+        return changed, False
+
+    def close(self):
+        if self.__fd >= 0:
+            os.close(self.__fd)
+            self.__fd = -1
+
+    def __add_watches(self, top):
+        folders = self._walk(top)
+        for folder in folders:
+            wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(folder), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                # ENOSPC means fs.inotify.max_user_watches has been reached
+                raise OSError(err, "inotify_add_watch failed for {}: {}".format(folder, os.strerror(err)))
+            self.__watches[wd] = folder
+        return folders
+
+    def __read_events(self):
+        while True:
+            try:
+                buf = os.read(self.__fd, 65536)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _cookie, length = EVENT_HEADER.unpack_from(buf, offset)
+                offset += EVENT_HEADER.size
+                name = buf[offset:offset + length].rstrip(b'\0')
+                offset += length
+                self.__handle_event(wd, mask, os.fsdecode(name))
+
+    def __handle_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self.__logger.warning("inotify queue overflowed, will walk %s again", self._picture_dir)
+            self._full_walk_requested = True
+            return
+        folder = self.__watches.get(wd)
+        if folder is None:
+            return
+        if mask & IN_IGNORED: # watch removed because folder deleted or unmounted
+            del self.__watches[wd]
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            self.__changed.add(os.path.dirname(folder))
+            return
+        self.__changed.add(folder)
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            # new folder (possibly a whole tree moved in) so watch it and scan all of it
+            try:
+                self.__changed.update(self.__add_watches(os.path.join(folder, name)))
+            except OSError as e:
+                self.__logger.warning("Can't watch new folder %s -> %s", name, e)
+                self._full_walk_requested = True
+
+
+def get_change_source(picture_dir, follow_links, kind='auto'):
+    """kind can be 'inotify', 'poll' or 'auto' which will try inotify and fall back to polling"""
+    logger = logging.getLogger("change_source.get_change_source")
+    if kind not in ('auto', 'inotify', 'poll'):
+        raise ValueError("change_source must be 'auto', 'inotify' or 'poll', not '{}'".format(kind))
+    if kind in ('auto', 'inotify'):
+        try:
+            return InotifyChangeSource(picture_dir, follow_links)
+        except (OSError, AttributeError, TypeError) as e: # no libc or no inotify on this platform
+            logger.warning("inotify not available, falling back to polling %s -> %s", picture_dir, e)
+    return PollingChangeSource(picture_dir, follow_links)
@@ -69,6 +69,7 @@ class Controller:
         self.__location_filter = ''
         self.__tags_filter = ''
         self.__shutdown_complete = False
+        self.__prefetch_due = True
 
     @staticmethod
     def noop_publish_state(x, y):
@@ -276,21 +277,25 @@ class Controller:
         tokens = ("(", ")", "AND", "OR", "NOT") # now copes with NOT
         val_split = val.replace("(", " ( ").replace(")", " ) ").split() # so brackets not joined to words
         filter = []
+        phrase = [] # words not separated by a token are matched as one phrase
         last_token = ""
         for s in val_split:
             s_upper = s.upper()
             if s_upper in tokens:
+                if phrase:
+                    # full text index lookup for each phrase, the tokens stay as SQL so NOT works on its own
+                    filter.append(self.__model.get_text_where_clause(field, " ".join(phrase)))
+                    phrase = []
                 if s_upper in ("AND", "OR"):
                     if last_token in ("AND", "OR"):
                         return None # must have a non-token between
                     last_token = s_upper
                 filter.append(s)
             else:
-                if last_token is not None:
-                    filter.append("{} LIKE '%{}%'".format(field, s))
-                else:
-                    filter[-1] = filter[-1].replace("%'", " {}%'".format(s))
+                phrase.append(s)
                 last_token = None
+        if phrase:
+            filter.append(self.__model.get_text_where_clause(field, " ".join(phrase)))
         return "({})".format(" ".join(filter)) # if OR outside brackets will modify the logic of rest of where clauses
 
     def text_is_on(self, txt_key):
@@ -353,6 +358,12 @@ class Controller:
                 break
             if skip_image:
                 self.__next_tm = 0
+            if pics is not None:
+                self.__prefetch_due = True
+            if self.__prefetch_due and not self.__viewer.is_in_transition():
+                # prepare the following images while this one is showing rather than during a fade
+                self.__viewer.prefetch(self.__model.peek_next_files(self.__viewer.prefetch_count))
+                self.__prefetch_due = False
         self.__shutdown_complete = True
 
     def start(self):
@@ -362,6 +373,7 @@ class Controller:
         self.__keep_looping = False
         while not self.__shutdown_complete:
             time.sleep(0.05) # block until main loop has stopped
+        self.__model.stop() # save the playlist position
         self.__viewer.slideshow_stop() # do this last
 
     def __signal_handler(self, sig, frame):
@@ -0,0 +1,114 @@
+import glob
+import logging
+import subprocess
+import time
+
+DRM_CONNECTORS = '/sys/class/drm/card*-*'
+
+
+class DisplayPower:
+    """Keeps track of whether the display is switched on.
+
+    Reading the state used to fork vcgencmd and/or xset on every call. Now the method that
+    works on this platform is found once, reads are cached for refresh_tm seconds and
+    the cache is updated straight away when the state is set. Where the kernel exposes the
+    DRM connectors in sysfs the state is read from there without starting a process. They
+    can't be written so switching still uses vcgencmd or xset.
+    """
+
+    def __init__(self, refresh_tm=10.0):
+        self.__logger = logging.getLogger("display_power.DisplayPower")
+        self.__refresh_tm = refresh_tm
+        self.__mode = None # how the display is switched, one of "pi", "x_dpms", "unsupported" once detected
+        self.__read_drm_state = False # read from the drm connectors rather than asking __mode
+        self.__is_on = True
+        self.__next_tm = 0.0
+
+    @property
+    def is_on(self):
+        tm = time.time()
+        if tm >= self.__next_tm:
+            self.__is_on = self.__read_state()
+            self.__next_tm = tm + self.__refresh_tm
+        return self.__is_on
+
+    @is_on.setter
+    def is_on(self, on_off):
+        if self.__write_state(on_off):
+            self.__is_on = on_off
+            # allow the hardware time to change before reading it back
+            self.__next_tm = time.time() + self.__refresh_tm
+
+    def __get_mode(self):
+        if self.__mode is None:
+            self.__read_drm_state = self.__detect_drm()
+            self.__mode = self.__detect_mode()
+            self.__logger.info("Display ON/OFF uses: %s%s", self.__mode,
+                               ", state read from drm sysfs" if self.__read_drm_state else "")
+        return self.__mode
+
+    def __read_state(self):
+        self.__get_mode()
+        try:
+            if self.__read_drm_state:
+                return self.__read_drm()
+            elif self.__mode == "pi":
+                state = str(subprocess.check_output(["vcgencmd", "display_power"]))
+                return state.find("display_power=1") != -1
+            elif self.__mode == "x_dpms":
+                output = subprocess.check_output(["xset" , "-display", ":0", "-q"])
+                return output.find(b'Monitor is On') != -1
+        except Exception as e:
+            self.__logger.debug("Display ON/OFF using %s, but an error occurred", self.__mode)
+            self.__logger.debug("Cause: %s", e)
+        return True
+
+    def __detect_drm(self):
+        try:
+            return self.__read_drm() is not None
+        except Exception as e:
+            self.__logger.debug("Display ON/OFF using drm sysfs not available: %s", e)
+        return False
+
+    def __detect_mode(self):
+        try: # vcgencmd only applies to raspberry pi
+            state = str(subprocess.check_output(["vcgencmd", "display_power"]))
+            if state.find("display_power=") != -1:
+                return "pi"
+        except Exception as e:
+            self.__logger.debug("Display ON/OFF is vcgencmd, but an error occurred")
+            self.__logger.debug("Cause: %s", e)
+        try: # try xset on linux, DPMS has to be enabled
+            output = subprocess.check_output(["xset" , "-display", ":0", "-q"], stderr=subprocess.DEVNULL)
+            if output.find(b'Monitor is') != -1:
+                return "x_dpms"
+        except Exception as e:
+            self.__logger.debug("Display ON/OFF is X with dpms enabled, but an error occurred")
+            self.__logger.debug("Cause: %s", e)
+        self.__logger.warning("Display ON/OFF is not supported for this platform.")
+        return "unsupported"
+
+    def __read_drm(self):
+        # True if any connected output is on, None if there are no connected outputs
+        state = None
+        for connector in glob.glob(DRM_CONNECTORS):
+            with open(connector + '/status') as f:
+                if f.read().strip() != 'connected':
+                    continue
+            with open(connector + '/dpms') as f:
+                state = bool(state) or f.read().strip() == 'On'
+        return state
+
+    def __write_state(self, on_off):
+        # True if the display was switched
+        mode = self.__get_mode()
+        try:
+            if mode == "pi":
+                subprocess.check_call(["vcgencmd", "display_power", "1" if on_off else "0"], stdout=subprocess.DEVNULL)
+                return True
+            elif mode == "x_dpms":
+                subprocess.check_call(["xset" , "-display", ":0", "dpms", "force", "on" if on_off else "off"])
+                return True
+        except Exception as e:
+            self.__logger.warning("Display ON/OFF using %s, but an error occurred: %s", mode, e)
+        return False
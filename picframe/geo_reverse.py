@@ -1,14 +1,36 @@
 import os
 import json
-import urllib.request
 import locale
 import logging
+import math
 import time
+import heapq
+import threading
+from collections import deque
 
 URL = "https://nominatim.openstreetmap.org/reverse?format=geojson&lat={}&lon={}&zoom={}&email={}&accept-language={}"
+MIN_INTERVAL = 1.0 # seconds between requests, nominatim usage policy is an absolute maximum of 1 per second
+RETRY_TM = 2.0 # seconds before the first retry after an error, doubled each time
+MAX_RETRIES = 5
+FAILED_TM = 3600.0 # seconds before a location that failed MAX_RETRIES times can be asked for again
+MAX_RESULTS = 10000 # addresses and cells kept for get_addresses() and get_new_cells(), the oldest are dropped after this
+
+def _format_address(adr, key_list):
+    # some experimentation might be needed to get a good set of alternatives in key_list
+    adr_list = []
+    if key_list is not None:
+        for part in key_list:
+            for option in part:
+                if option in adr:
+                    adr_list.append(adr[option])
+                    break # add just the first one from the options
+    else:
+        adr_list = adr.values()
+    return ", ".join(adr_list)
+
 
 class GeoReverse:
-    def __init__(self, geo_key, zoom=18, key_list=None):
+    def __init__(self, geo_key, zoom=18, key_list=None, cell_size=None):
         self.__logger = logging.getLogger("geo_reverse.GeoReverse")
         self.__geo_key = geo_key
         self.__zoom = zoom
@@ -23,24 +45,275 @@ class GeoReverse:
         #            (name, var) = line.partition('=')[::2]
         #            self.__geo_locations[name] = var.rstrip('\n')
         self.__language = locale.getlocale()[0][:2]
+        # background lookups. request_address() queues, the worker thread works through the queue
+        # no faster than MIN_INTERVAL and get_addresses() hands back what it has found
+        self.__condition = threading.Condition()
+        self.__pending = [] # heap of (due time, lat, lon, attempt)
+        self.__background = deque() # (lat, lon, cell) only looked up when nothing in __pending is due
+        self.__background_cells = set() # cells in __background not yet started or moved to __pending
+        self.__requested = {} # cell -> None if queued or found, time it can be retried if failed
+        self.__results = deque(maxlen=MAX_RESULTS)
+        # addresses are cached for a grid of cells, one lookup serves all pictures in a cell. The default
+        # size is that of a map tile at zoom, so roughly the area that shares an address at that detail
+        self.__cell_size = cell_size if cell_size else 360.0 / 2 ** zoom
+        self.__cells = {} # cell -> address
+        self.__new_cells = deque(maxlen=MAX_RESULTS) # (cell lat, cell lon, address) not yet handed to get_new_cells()
+        self.__waiting = {} # cell -> set of (lat, lon) to give the address to once found
+        self.__next_request_tm = 0.0
+        self.__worker = None
 
     def get_address(self, lat, lon):
         try:
-            with urllib.request.urlopen(URL.format(lat, lon, self.__zoom, self.__geo_key, self.__language),
-                                        timeout=3.0) as req:
-                    data = json.loads(req.read().decode())
-            adr = data['features'][0]['properties']['address']
-            # some experimentation might be needed to get a good set of alternatives in key_list
-            adr_list = []
-            if self.__key_list is not None:
-                for part in self.__key_list:
-                    for option in part:
-                        if option in adr:
-                            adr_list.append(adr[option])
-                            break # add just the first one from the options
-            else:
-                adr_list = adr.values()
-            return ", ".join(adr_list)
-        except Exception as e: #TODO return different thing for different exceptions
+            return self.lookup(lat, lon)
+        except Exception as e:
             self.__logger.error("lat=%f, lon=%f -> %s", lat, lon, e)
             return ""
+
+    def lookup(self, lat, lon):
+        # raises on network or server errors, returns "" if there is no address for the place (i.e. at sea)
+        import urllib.request # imported here as it's slow to load and not needed at all offline
+        with urllib.request.urlopen(URL.format(lat, lon, self.__zoom, self.__geo_key, self.__language),
+                                    timeout=3.0) as req:
+                data = json.loads(req.read().decode())
+        if 'error' in data or len(data.get('features', [])) == 0:
+            return ""
+        adr = data['features'][0]['properties'].get('address', {})
+        return _format_address(adr, self.__key_list)
+
+    def request_address(self, lat, lon, background=False):
+        """Queue a lookup without waiting for it. Locations already queued, found, or
+        recently given up on are ignored so this can be called every time a picture is shown.
+        If another location in the same cell has been looked up its address is used straight away.
+        background requests, i.e. filling in the whole library, wait until nothing else is queued"""
+        cell = self.__cell(lat, lon)
+        with self.__condition:
+            if cell in self.__cells:
+                self.__results.append((lat, lon, self.__cells[cell]))
+                return
+            if cell in self.__requested:
+                retry_tm = self.__requested[cell]
+                if retry_tm is None:
+                    self.__waiting[cell].add((lat, lon))
+                    if not background and cell in self.__background_cells: # jump the queue
+                        self.__background_cells.discard(cell)
+                        heapq.heappush(self.__pending, (time.time(), lat, lon, 0))
+                        self.__condition.notify()
+                    return
+                elif time.time() < retry_tm:
+                    return
+            self.__requested[cell] = None
+            self.__waiting[cell] = {(lat, lon)}
+            if background:
+                self.__background.append((lat, lon, cell))
+                self.__background_cells.add(cell)
+            else:
+                heapq.heappush(self.__pending, (time.time(), lat, lon, 0))
+            if self.__worker is None:
+                self.__worker = threading.Thread(target=self.__run, daemon=True)
+                self.__worker.start()
+            self.__condition.notify()
+
+    @property
+    def queued_count(self):
+        with self.__condition:
+            return len(self.__pending) + len(self.__background_cells)
+
+    def get_addresses(self):
+        """Returns and clears the list of (lat, lon, address) found since the last call.
+        address is "" where the lookup worked but there is no address for the place"""
+        with self.__condition:
+            results, self.__results = list(self.__results), deque(maxlen=MAX_RESULTS)
+        return results
+
+    @property
+    def cell_size(self):
+        return self.__cell_size
+
+    def set_cells(self, cells):
+        """Fill the cell cache from a previous run with (cell lat, cell lon, address)"""
+        with self.__condition:
+            for cell_lat, cell_lon, address in cells:
+                self.__cells[(cell_lat, cell_lon)] = address
+
+    def get_new_cells(self):
+        """Returns and clears the list of (cell lat, cell lon, address) found since the last call"""
+        with self.__condition:
+            cells, self.__new_cells = list(self.__new_cells), deque(maxlen=MAX_RESULTS)
+        return cells
+
+    def __cell(self, lat, lon):
+        return (math.floor(lat / self.__cell_size), math.floor(lon / self.__cell_size))
+
+    def __next_request(self):
+        # called with __condition held, waits for something to look up
+        while True:
+            if self.__pending and self.__pending[0][0] <= time.time():
+                _, lat, lon, attempt = heapq.heappop(self.__pending)
+                return lat, lon, attempt
+            while self.__background:
+                lat, lon, cell = self.__background.popleft()
+                if cell in self.__background_cells: # otherwise it has already been moved to __pending
+                    self.__background_cells.discard(cell)
+                    return lat, lon, 0
+            self.__condition.wait(self.__pending[0][0] - time.time() if self.__pending else None)
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                lat, lon, attempt = self.__next_request()
+            wait_tm = self.__next_request_tm - time.time()
+            if wait_tm > 0:
+                time.sleep(wait_tm)
+            self.__next_request_tm = time.time() + MIN_INTERVAL
+            try:
+                address = self.lookup(lat, lon)
+            except Exception as e:
+                with self.__condition:
+                    if attempt < MAX_RETRIES:
+                        self.__logger.info("lat=%f, lon=%f -> %s, retry %d", lat, lon, e, attempt + 1)
+                        heapq.heappush(self.__pending, (time.time() + RETRY_TM * 2 ** attempt, lat, lon, attempt + 1))
+                    else:
+                        self.__logger.error("lat=%f, lon=%f -> %s, giving up for now", lat, lon, e)
+                        cell = self.__cell(lat, lon)
+                        self.__requested[cell] = time.time() + FAILED_TM
+                        self.__waiting.pop(cell, None)
+                continue
+            with self.__condition:
+                cell = self.__cell(lat, lon)
+                self.__cells[cell] = address
+                self.__new_cells.append((cell[0], cell[1], address))
+                self.__results.extend((waiting_lat, waiting_lon, address)
+                                      for waiting_lat, waiting_lon in self.__waiting.pop(cell, ()))
+
+
+GRID_SIZE = 0.1 # degrees, cell size of the offline index
+MAX_DISTANCE = 100.0 # km, further than this from any place counts as no address
+KM_PER_DEGREE = 111.2
+MAX_RINGS = 60 # rings of cells searched at most, enough for MAX_DISTANCE up to about 80 degrees latitude
+
+
+class OfflineGeoReverse:
+    """Looks up the nearest place in a local GeoNames file (i.e. cities1000.txt from
+    download.geonames.org/export/dump) so no internet connection is needed. If
+    admin1CodesASCII.txt and countryInfo.txt are in the same folder they are used for
+    the state and country names, otherwise the codes are used.
+
+    The places are held in a grid of GRID_SIZE cells so a lookup only checks the few
+    cells around the point. The address has the same keys as nominatim so key_list works
+    unchanged: suburb, city, state and country.
+    """
+
+    def __init__(self, data_file, key_list=None):
+        self.__logger = logging.getLogger("geo_reverse.OfflineGeoReverse")
+        self.__key_list = key_list
+        self.__grid = {} # (lat cell, lon cell) -> list of (lat, lon, address)
+        self.__results = deque(maxlen=MAX_RESULTS)
+        self.__lock = threading.Lock()
+        data_file = os.path.expanduser(data_file)
+        try:
+            self.__load(data_file)
+        except OSError as e:
+            self.__logger.error("Can't load places from %s -> %s", data_file, e)
+
+    def __load(self, data_file):
+        folder = os.path.dirname(data_file)
+        admin1_names = self.__read_names(os.path.join(folder, 'admin1CodesASCII.txt'), 0, 1)
+        country_names = self.__read_names(os.path.join(folder, 'countryInfo.txt'), 0, 4)
+        count = 0
+        with open(data_file, encoding='utf-8') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) < 11 or fields[6] != 'P': # only populated places
+                    continue
+                lat, lon = float(fields[4]), float(fields[5])
+                country = fields[8]
+                address = {'suburb' if fields[7] == 'PPLX' else 'city': fields[1],
+                           'state': admin1_names.get(country + '.' + fields[10], fields[10]),
+                           'country': country_names.get(country, country)}
+                self.__grid.setdefault(self.__cell(lat, lon), []).append((lat, lon, address))
+                count += 1
+        self.__logger.info("Loaded %d places from %s", count, data_file)
+
+    @staticmethod
+    def __read_names(file_name, code_col, name_col):
+        names = {}
+        if os.path.isfile(file_name):
+            with open(file_name, encoding='utf-8') as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    if line[0] != '#' and len(fields) > name_col:
+                        names[fields[code_col]] = fields[name_col]
+        return names
+
+    @staticmethod
+    def __cell(lat, lon):
+        return (math.floor(lat / GRID_SIZE), math.floor(lon / GRID_SIZE) % int(360 / GRID_SIZE))
+
+    def __nearest(self, lat, lon):
+        lat_cell, lon_cell = self.__cell(lat, lon)
+        lon_cells = int(360 / GRID_SIZE)
+        best, best_dist = None, MAX_DISTANCE
+        # nothing further out than this many rings can be within MAX_DISTANCE, i.e. at sea
+        cos_lat = math.cos(math.radians(min(abs(lat) + MAX_DISTANCE / KM_PER_DEGREE, 89.0)))
+        max_ring = min(math.ceil(MAX_DISTANCE / (GRID_SIZE * KM_PER_DEGREE * cos_lat)), MAX_RINGS)
+        ring = 0
+        while True:
+            for i, j in self.__ring_offsets(ring):
+                for place in self.__grid.get((lat_cell + i, (lon_cell + j) % lon_cells), ()):
+                    dist = self.__distance(lat, lon, place[0], place[1])
+                    if dist <= best_dist:
+                        best, best_dist = place, dist
+            # cells on the next ring are at least ring cells away, less towards the poles in longitude
+            cos_lat = math.cos(math.radians(min(abs(lat) + (ring + 1) * GRID_SIZE, 89.0)))
+            if best_dist <= ring * GRID_SIZE * KM_PER_DEGREE * cos_lat or ring >= max_ring:
+                return best
+            ring += 1
+
+    @staticmethod
+    def __ring_offsets(ring):
+        # (lat, lon) cell offsets of the square ring of cells ring away from the centre
+        if ring == 0:
+            return [(0, 0)]
+        offsets = []
+        for k in range(-ring, ring + 1):
+            offsets.extend(((-ring, k), (ring, k)))
+        for k in range(-ring + 1, ring):
+            offsets.extend(((k, -ring), (k, ring)))
+        return offsets
+
+    @staticmethod
+    def __distance(lat1, lon1, lat2, lon2):
+        # equirectangular approximation in km, plenty accurate over a few cells
+        d_lon = (lon2 - lon1 + 180.0) % 360.0 - 180.0
+        x = d_lon * math.cos(math.radians((lat1 + lat2) / 2.0))
+        return math.hypot(x, lat2 - lat1) * KM_PER_DEGREE
+
+    def lookup(self, lat, lon):
+        place = self.__nearest(lat, lon)
+        if place is None:
+            return ""
+        return _format_address(place[2], self.__key_list)
+
+    def get_address(self, lat, lon):
+        return self.lookup(lat, lon)
+
+    def request_address(self, lat, lon, background=False):
+        # fast enough to answer straight away, the result is still collected through get_addresses()
+        address = self.lookup(lat, lon)
+        with self.__lock:
+            self.__results.append((lat, lon, address))
+
+    def get_addresses(self):
+        with self.__lock:
+            results, self.__results = list(self.__results), deque(maxlen=MAX_RESULTS)
+        return results
+
+    # lookups are fast enough not to need the cell cache or queue GeoReverse has
+    cell_size = None
+    queued_count = 0
+
+    def set_cells(self, cells):
+        pass
+
+    def get_new_cells(self):
+        return []
@@ -1,51 +1,224 @@
-import exifread
 import logging
 import os
+import struct
 from PIL import Image
 
+HEAD_SIZE = 128 * 1024 # exif, iptc and the size info are normally all found in this much of the file
+
+_iptc_info = False # iptcinfo3.IPTCInfo or None if it isn't installed, False until the first file is read
+
+
+def _get_iptc_info():
+    # imported with the first file read rather than at startup, then kept so it's only looked up once
+    global _iptc_info
+    if _iptc_info is False:
+        try:
+            from iptcinfo3 import IPTCInfo
+            logging.getLogger('iptcinfo').setLevel(logging.ERROR) # turn off useless log infos
+            _iptc_info = IPTCInfo
+        except ImportError:
+            logging.getLogger("get_image_meta.GetImageMeta").warning(
+                "IPTC loading has failed - if you want to use this you will need to install iptcinfo3")
+            _iptc_info = None
+    return _iptc_info
+
+
+class _HeadBuffer:
+    """Read-only file like object. The first head_size bytes of the file are read once
+    and all reads within them are served from memory, anything after goes to the file.
+    close() does nothing so it can be handed to readers that close their input."""
+
+    def __init__(self, fh, head_size=HEAD_SIZE):
+        self.__fh = fh
+        self.__head = fh.read(head_size)
+        self.__pos = 0
+        self.__length = None
+
+    def read(self, size=-1):
+        if size is not None and 0 <= size and self.__pos + size <= len(self.__head):
+            data = self.__head[self.__pos:self.__pos + size]
+        else:
+            self.__fh.seek(self.__pos)
+            data = self.__fh.read(size)
+        self.__pos += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.__pos
+        elif whence == os.SEEK_END:
+            offset += self.__get_length()
+        self.__pos = max(0, offset)
+        return self.__pos
+
+    def tell(self):
+        return self.__pos
+
+    def __get_length(self):
+        if self.__length is None:
+            self.__length = self.__fh.seek(0, os.SEEK_END)
+        return self.__length
+
+    def peek(self, size):
+        return self.__head[:size]
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _iter_boxes(fh, end):
+    # yields (type, payload_start, payload_end) for each ISO base media box between fh.tell() and end
+    pos = fh.tell()
+    while pos + 8 <= end:
+        fh.seek(pos)
+        size, box_type = struct.unpack('>I4s', fh.read(8))
+        header = 8
+        if size == 1: # 64 bit largesize follows the type
+            size = struct.unpack('>Q', fh.read(8))[0]
+            header = 16
+        elif size == 0: # box extends to the end
+            size = end - pos
+        if size < header:
+            return
+        yield box_type, pos + header, pos + size
+        pos += size
+
+
+def _read_heif_size(fh):
+    """Reads width and height of the primary item of a HEIF file from the ispe and irot
+    properties in the meta box, without decoding any image data.
+    Returns None if the boxes can't be found"""
+    fh.seek(0, os.SEEK_END)
+    file_end = fh.tell()
+    fh.seek(0)
+    for box_type, start, end in _iter_boxes(fh, file_end):
+        if box_type == b'meta':
+            break
+    else:
+        return None
+    fh.seek(start + 4) # meta is a FullBox
+    primary_id = None
+    properties = []
+    associations = {}
+    for box_type, start, end in _iter_boxes(fh, end):
+        fh.seek(start)
+        if box_type == b'pitm':
+            version = fh.read(4)[0]
+            primary_id = struct.unpack('>H' if version == 0 else '>I', fh.read(2 if version == 0 else 4))[0]
+        elif box_type == b'iprp':
+            for iprp_type, iprp_start, iprp_end in _iter_boxes(fh, end):
+                fh.seek(iprp_start)
+                if iprp_type == b'ipco':
+                    for prop_type, prop_start, prop_end in _iter_boxes(fh, iprp_end):
+                        fh.seek(prop_start)
+                        properties.append((prop_type, fh.read(min(prop_end - prop_start, 12))))
+                elif iprp_type == b'ipma':
+                    version, flags = struct.unpack('>B3s', fh.read(4))
+                    flags = int.from_bytes(flags, 'big')
+                    for _ in range(struct.unpack('>I', fh.read(4))[0]):
+                        item_id = struct.unpack('>H' if version < 1 else '>I', fh.read(2 if version < 1 else 4))[0]
+                        indices = []
+                        for _ in range(fh.read(1)[0]):
+                            if flags & 1:
+                                indices.append(struct.unpack('>H', fh.read(2))[0] & 0x7fff)
+                            else:
+                                indices.append(fh.read(1)[0] & 0x7f)
+                        associations[item_id] = indices
+                fh.seek(iprp_end)
+        fh.seek(end)
+    size = None
+    rotation = 0
+    for index in associations.get(primary_id, []):
+        if 0 < index <= len(properties): # property indices are 1 based, 0 means none
+            prop_type, data = properties[index - 1]
+            if prop_type == b'ispe':
+                size = struct.unpack('>II', data[4:12])
+            elif prop_type == b'irot':
+                rotation = data[0] & 0x03 # anti-clockwise in units of 90 degrees
+    if size is not None and rotation in (1, 3):
+        size = (size[1], size[0])
+    return size
+
+
+def _reduce_image(image, size):
+    # integer box reduction keeping the image at least as big as size in both dimensions
+    if size is None:
+        return image
+    factor = min(image.width // max(size[0], 1), image.height // max(size[1], 1))
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image
+
+
 class GetImageMeta:
 
     def __init__(self, filename):
         self.__logger = logging.getLogger("get_image_meta.GetImageMeta")
         self.__tags = {}
+        self.__size = (0, 0)
         self.__filename = filename # in case no exif data in which case needed for size
+        # The file is opened once and exif, iptc and size are all parsed from the same buffered head
         try:
             with open(filename, 'rb') as fh:
-                self.__tags = exifread.process_file(fh, details=False)
+                head = _HeadBuffer(fh)
+                self.__do_exif(head)
+                head.seek(0)
+                self.__do_iptc_keywords(head)
+                head.seek(0)
+                self.__do_size(head)
         except OSError as e:
             self.__logger.warning("Can't open file: \"%s\"", filename)
             self.__logger.warning("Cause: %s", e)
             #raise # the system should be able to withstand files being moved etc without crashing
+
+    def __do_exif(self, fh):
+        import exifread # imported here, and iptcinfo3 by _get_iptc_info(), so they load with the first file read not at startup
+        try:
+            self.__tags = exifread.process_file(fh, details=False)
         except Exception as e:
             self.__logger.warning("exifread doesn't manage well and gives AttributeError for heif files %s -> %s",
-                                  filename, e)
-        self.__do_iptc_keywords()
+                                  self.__filename, e)
 
-    def __do_iptc_keywords(self):
+    def __do_iptc_keywords(self, fh):
+        IPTCInfo = _get_iptc_info()
+        if IPTCInfo is None:
+            return
+        if fh.peek(2) != b'\xff\xd8':
+            return # iptc is only stored in jpegs, don't let iptcinfo3 blind scan through other files
         try:
-            from iptcinfo3 import IPTCInfo
-            iptcinfo_logger = logging.getLogger('iptcinfo') # turn off useless log infos
-            iptcinfo_logger.setLevel(logging.ERROR)
-            with open(self.__filename, 'rb') as fh:
-                iptc = IPTCInfo(fh, force=True, out_charset='utf-8') # TODO put IPTC read in separate function
-                # tags
-                val = iptc['keywords']
-                if val is not None and len(val) > 0:
-                    keywords = ''
-                    for key in iptc['keywords']:
-                        keywords += key.decode('utf-8')  + ','  # decode binary strings
-                    self.__tags['IPTC Keywords'] = keywords
-                # caption
-                val = iptc['caption/abstract']
-                if val is not None and len(val) > 0:
-                    self.__tags['IPTC Caption/Abstract'] = iptc['caption/abstract'].decode('utf8')
-                # title
-                val = iptc['object name']
-                if val is not None and len(val) > 0:
-                    self.__tags['IPTC Object Name'] = iptc['object name'].decode('utf-8')
+            iptc = IPTCInfo(fh, force=True, out_charset='utf-8')
+            # tags
+            val = iptc['keywords']
+            if val is not None and len(val) > 0:
+                keywords = ''
+                for key in iptc['keywords']:
+                    keywords += key.decode('utf-8')  + ','  # decode binary strings
+                self.__tags['IPTC Keywords'] = keywords
+            # caption
+            val = iptc['caption/abstract']
+            if val is not None and len(val) > 0:
+                self.__tags['IPTC Caption/Abstract'] = iptc['caption/abstract'].decode('utf8')
+            # title
+            val = iptc['object name']
+            if val is not None and len(val) > 0:
+                self.__tags['IPTC Object Name'] = iptc['object name'].decode('utf-8')
         except Exception as e:
-            self.__logger.warning("IPTC loading has failed - if you want to use this you will need to install iptcinfo3 %s -> %s",
-                                  self.__filename, e)
+            self.__logger.warning("IPTC loading has failed %s -> %s", self.__filename, e)
+
+    def __do_size(self, fh):
+        try: # corrupt image file might crash app
+            self.__size = GetImageMeta._probe_size(fh, self.__filename)
+        except Exception as e:
+            self.__logger.warning("get_size failed on %s -> %s", self.__filename, e)
 
     def has_exif(self):
         if self.__tags == {}:
@@ -133,14 +306,32 @@ class GetImageMeta:
             return None
 
     def get_size(self):
-        try: # corrupt image file might crash app
-            return GetImageMeta.get_image_object(self.__filename).size
-        except Exception as e:
-            self.__logger.warning("get_size failed on %s -> %s", self.__filename, e)
-            return (0, 0)
+        return self.__size
+
+    @staticmethod
+    def get_image_size(fname):
+        # only reads as much of the file as needed to find the dimensions, pixels are never decoded.
+        # heif sizes have rotation applied to match the image returned by get_image_object
+        with open(fname, 'rb') as fh:
+            return GetImageMeta._probe_size(fh, fname)
+
+    @staticmethod
+    def _probe_size(fh, fname):
+        ext = os.path.splitext(fname)[1].lower()
+        if ext in ('.heif','.heic'):
+            size = _read_heif_size(fh)
+            if size is not None:
+                return size
+            import pyheif
+            return pyheif.open(fname).size # still doesn't decode
+        image = Image.open(fh) # lazy, just parses the header (jpeg SOF, png IHDR etc)
+        return image.size
 
     @staticmethod
-    def get_image_object(fname):
+    def get_image_object(fname, size=None):
+            # size is the smallest (width, height) the caller needs, i.e. the display. If given, jpegs
+            # are decoded at a reduced scale (libjpeg DCT scaling through draft) and other formats are
+            # reduced straight after decoding so later processing works on a smaller image
             ext = os.path.splitext(fname)[1].lower()
             if ext in ('.heif','.heic'):
                 try:
@@ -151,15 +342,18 @@ class GetImageMeta:
                                             "raw", heif_file.mode, heif_file.stride)
                     if image.mode not in ("RGB", "RGBA"):
                         image = image.convert("RGB")
-                    return image
+                    return _reduce_image(image, size)
                 except:
                     logger = logging.getLogger("get_image_meta.GetImageMeta")
                     logger.warning("Failed attempt to convert %s \n** Have you installed pyheif? **", fname)
             else:
                 try:
                     image = Image.open(fname)
+                    if size is not None and image.format == 'JPEG':
+                        image.draft('RGB', size) # result will still be at least size
                     if image.mode not in ("RGB", "RGBA"): # mat system needs RGB or more
                         image = image.convert("RGB")
+                    image = _reduce_image(image, size)
                 except: # for whatever reason
                     image = None
                 return image
\ No newline at end of file
@@ -5,36 +5,73 @@ import os
 import time
 import logging
 import threading
-from picframe import get_image_meta
+import multiprocessing
+import concurrent.futures
+from collections import deque
+from picframe import get_image_meta, change_source
 
 
 
 class ImageCache:
 
     EXTENSIONS = ['.png','.jpg','.jpeg','.heif','.heic']
+    INSERT_BATCH_SIZE = 100 # commit this many inserted files at a time so the viewer sees progress
+    STOP_TIMEOUT = 10.0 # seconds stop() waits for the loop thread, well inside systemd's 90s before SIGKILL
+    CHANGE_FEED_SIZE = 100000 # file ids kept in the change feed, further behind than this has to query again
+    # WAL lets the other threads read while the loop thread writes. synchronous NORMAL is safe with WAL (a power
+    # cut can lose the last commits but not corrupt the db). cache_size is per connection, negative is KiB
+    DB_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -8000, 'mmap_size': 64 * 1024 * 1024}
 
     def __init__(self, picture_dir, follow_links, db_file, geo_reverse, portrait_pairs=False, 
-        continuous_update: bool = True):
+        continuous_update: bool = True, change_source_type='auto', reconcile_interval=86400.0,
+        index_workers=1, index_pool='thread', geo_backfill_interval=3600.0, db_pragmas=None):
         # TODO these class methods will crash if Model attempts to instantiate this using a
         # different version from the latest one - should this argument be taken out?
         self.__modified_folders = []
         self.__modified_files = []
+        self.__purge_candidates = set() # folders that have changed since the last purge, so may have lost files or subfolders
+        self.__walked_folders = None # every folder on disk if the last check was a full walk
         self.__cached_file_stats = [] # collection shared between threads
         self.__cached_file_stats_lock = threading.Lock() # lock to manage shared collection
+        self.__cached_settings = {} # settings waiting to be written by the loop thread, also uses the lock above
         self.__logger = logging.getLogger("image_cache.ImageCache")
         self.__logger.debug('Creating an instance of ImageCache')
         self.__picture_dir = picture_dir
         self.__follow_links = follow_links
         self.__db_file = db_file
         self.__geo_reverse = geo_reverse
+        self.__geo_backfill_interval = geo_backfill_interval # seconds between queueing all unresolved lat/lon, 0 is off
+        self.__next_backfill_tm = 0.0 # first time the loop has caught up with the files on disk
+        self.__geo_backfill = {'last_run': None, 'queued': 0, 'resolved': 0}
         self.__portrait_pairs = portrait_pairs #TODO have a function to turn this on and off?
-        self.__db = self.__create_open_db(self.__db_file)
+        self.__change_source = change_source.get_change_source(picture_dir, follow_links, change_source_type)
+        self.__reconcile_interval = reconcile_interval # seconds between full walks of picture_dir
+        self.__next_reconcile_tm = time.time() + reconcile_interval
+        # meta data is read by a pool of workers, the results are written to the db by the loop thread only
+        self.__index_workers = index_workers
+        self.__index_pool = index_pool
+        self.__executor = None # made by each run of the loop thread as it's shut down when the loop ends
+        self.__pending = set() # futures for files currently being read by the workers
+        self.__change_count = 0
+        self.__change_feed = deque() # (change_count after, inserted file ids, deleted file ids) see get_changes()
+        self.__change_feed_ids = 0 # number of ids in __change_feed
+        self.__change_feed_lock = threading.Lock()
+        self.__pass_count = 0
+        self.__db_pragmas = {**ImageCache.DB_PRAGMAS, **(db_pragmas or {})}
+        self.__has_text_index = False # set by __create_open_db if sqlite has fts5 with the trigram tokenizer
+        self.__db = self.__create_open_db(self.__db_file) # only written to by the loop thread
+        self.__readers = {} # the other threads each read through their own connection, {thread: connection}
+        self.__readers_lock = threading.Lock()
         # NB this is where the required schema is set
-        self.__update_schema(3)
+        self.__update_schema(5)
+        if self.__geo_reverse is not None and self.__geo_reverse.cell_size:
+            sql = "SELECT cell_lat, cell_lon, description FROM location_cell WHERE cell_size = ?"
+            self.__geo_reverse.set_cells(self.__db.execute(sql, (self.__geo_reverse.cell_size,)).fetchall())
 
         self.__keep_looping = True
         self.__pause_looping = False
         self._continuous_update = continuous_update
+        self.__scan_requested = True # look at the disk on the next pass, always True with continuous_update
         self.__purge_files = False
 
         # Start the loop thread
@@ -47,28 +84,54 @@ class ImageCache:
         # Block until the loop thread finishes
         while self._loop_thread and self._loop_thread.is_alive():
             time.sleep(0.1)
+        self.__change_source.close()
+        with self.__readers_lock:
+            for db in self.__readers.values():
+                db.close()
         self.__db.close()
         self.__logger.debug('ImageCache instance destroyed')
 
     def __loop(self):
         self.__logger.info('Entering the cache update loop')
+        self.__executor = self.__create_executor(self.__index_workers, self.__index_pool)
         while self.__keep_looping:
             if not self.__pause_looping:
-                self.update_cache()
+                if self.__scan_requested:
+                    self.__scan_requested = self._continuous_update # otherwise until start() is called again
+                    self.update_cache()
+                else:
+                    self.__store_queued()
                 time.sleep(2.0)
-            # If no continuous update, stop looping
-            self.__keep_looping = self._continuous_update
+            # If no continuous update, stop looping. Unless addresses are being looked up, they are
+            # found in the background and need storing whether the disk is being checked or not
+            if not self._continuous_update and self.__geo_reverse is None:
+                self.__keep_looping = False
             time.sleep(0.01)
-        self.__update_file_stats() # write any unsaved file stats before closing
-        self.__db.commit() # close after update_cache finished for last time
+        self.__store_queued() # write any unsaved file stats, settings and locations before closing
+        if self.__executor is not None: # unwritten files will be picked up again on the next start
+            for future in self.__pending:
+                future.cancel()
+            self.__pending = set()
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
         self.__logger.info('Exiting the cache update loop')
 
     def pause_looping(self, value):
         self.__pause_looping = value
 
+    def stop(self):
+        # end the loop thread, which writes anything queued for the db on the way out
+        self._continuous_update = False # or the loop sets __keep_looping again
+        self.__keep_looping = False
+        if self._loop_thread is not None:
+            self._loop_thread.join(timeout=ImageCache.STOP_TIMEOUT)
+            if self._loop_thread.is_alive():
+                self.__logger.warning('Cache update loop still running after %.0fs, not waiting for it', ImageCache.STOP_TIMEOUT)
+
     def start(self):
         self.__logger.info('Starting the cache update loop')
         self.__keep_looping = True
+        self.__scan_requested = True
         # Start the loop thread only if it's not already running
         if self._loop_thread is None or not self._loop_thread.is_alive():
             self._loop_thread = threading.Thread(target=self.__loop)
@@ -85,23 +148,20 @@ class ImageCache:
 
         # Update any cached file stats. This should be really light-weight
         # so just process any new stats in every pass...
-        self.__update_file_stats()
+        self.__store_queued()
 
         # If the current collection of updated files is empty, check for disk-based changes
-        if not self.__modified_files:
+        if not self.__modified_files and not self.__pending:
             self.__logger.debug('No unprocessed files in memory, checking disk')
             self.__modified_folders = self.__get_modified_folders()
             self.__modified_files = self.__get_modified_files(self.__modified_folders)
             self.__logger.debug('Found %d new files on disk', len(self.__modified_files))
 
         # While we have files to process and looping isn't paused
-        while self.__modified_files and not self.__pause_looping:
-            file = self.__modified_files.pop(0)
-            self.__logger.debug('Inserting: %s', file)
-            self.__insert_file(file)
+        self.__insert_modified_files()
 
         # If we've process all files in the current collection, update the cached folder info
-        if not self.__modified_files:
+        if not self.__modified_files and not self.__pending:
             self.__update_folder_info(self.__modified_folders)
             self.__modified_folders.clear()
 
@@ -109,12 +169,97 @@ class ImageCache:
         if not self.__pause_looping:
             self.__purge_missing_files_and_folders()
 
+        # When there are no new files left to read, periodically look up locations for the whole library
+        if not self.__pause_looping and not self.__modified_files and not self.__pending:
+            self.__backfill_locations()
+
         # Commit the current set of changes
         self.__db.commit()
+        if not self.__pause_looping and not self.__modified_files and not self.__pending:
+            self.__pass_count += 1
+
+
+    def __create_executor(self, index_workers, index_pool):
+        if index_workers <= 1:
+            return None # read meta data on the loop thread as before
+        if index_pool == 'process':
+            # spawn rather than fork as the parent process may already hold a GL context
+            return concurrent.futures.ProcessPoolExecutor(max_workers=index_workers,
+                                                          mp_context=multiprocessing.get_context('spawn'))
+        return concurrent.futures.ThreadPoolExecutor(max_workers=index_workers)
+
+    def __insert_modified_files(self):
+        batch = []
+        if self.__executor is None:
+            while self.__modified_files and not self.__pause_looping and self.__keep_looping:
+                file = self.__modified_files.pop(0)
+                try:
+                    batch.append(read_file_meta(file))
+                except Exception as e: # i.e. file removed before it could be read
+                    self.__logger.warning("Can't read file meta -> %s", e)
+                if len(batch) >= ImageCache.INSERT_BATCH_SIZE:
+                    self.__insert_files(batch)
+                    batch = []
+            self.__insert_files(batch)
+            return
+
+        # Results that complete while looping is paused are kept in __pending and
+        # only written once looping resumes. When stopping, whatever has been read is written
+        # and the rest cancelled, the files are found again on the next start
+        while not self.__pause_looping and self.__keep_looping:
+            # keep the workers busy but don't read too far ahead of the writer
+            while self.__modified_files and len(self.__pending) < 2 * self.__index_workers:
+                file = self.__modified_files.pop(0)
+                self.__pending.add(self.__executor.submit(read_file_meta, file))
+            if not self.__pending:
+                break
+            done, self.__pending = concurrent.futures.wait(self.__pending, timeout=0.5,
+                                                           return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                try:
+                    batch.append(future.result())
+                except Exception as e: # i.e. file removed before it could be read
+                    self.__logger.warning("Can't read file meta -> %s", e)
+            if len(batch) >= ImageCache.INSERT_BATCH_SIZE:
+                self.__insert_files(batch)
+                batch = []
+        if not self.__keep_looping:
+            for future in self.__pending:
+                future.cancel()
+            self.__pending = set()
+        self.__insert_files(batch)
+
+    def __read_db(self):
+        # the connection for reading on this thread. The loop thread reads through the writer so it
+        # sees what it has written but not committed yet
+        thread = threading.current_thread()
+        if thread is self._loop_thread:
+            return self.__db
+        db = self.__readers.get(thread)
+        if db is None:
+            # not check_same_thread so it can be closed by another thread once this one has finished
+            db = sqlite3.connect(self.__db_file, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            self.__set_pragmas(db, reader=True)
+            with self.__readers_lock:
+                for old_thread in [t for t in self.__readers if not t.is_alive()]:
+                    self.__readers.pop(old_thread).close()
+                self.__readers[thread] = db
+        return db
 
+    def __set_pragmas(self, db, reader=False):
+        for name, value in self.__db_pragmas.items():
+            if reader and name == 'journal_mode':
+                continue # a property of the db file, set by the writer
+            if not name.isidentifier() or not str(value).lstrip('-').isalnum():
+                self.__logger.warning("Ignoring db pragma %s = %s", name, value)
+                continue
+            db.execute("PRAGMA {} = {}".format(name, value))
+        if reader:
+            db.execute("PRAGMA query_only = 1")
 
     def query_cache(self, where_clause, sort_clause = 'fname ASC'):
-        cursor = self.__db.cursor()
+        cursor = self.__read_db().cursor()
         cursor.row_factory = None # we don't want the "sqlite3.Row" setting from the db here...
         try:
             if not self.__portrait_pairs: # TODO SQL insertion? Does it matter in this app?
@@ -122,53 +267,160 @@ class ImageCache:
                     """.format(where_clause, sort_clause)
                 self.__logger.info(f"Executing query: {sql}")
                 return cursor.execute(sql).fetchall()
-            else: # make two SELECTS
-                sql = """SELECT
-                            CASE
-                                WHEN is_portrait = 0 THEN file_id
-                                ELSE -1
-                            END
-                            FROM all_data WHERE {0} ORDER BY {1}
-                                        """.format(where_clause, sort_clause)
-                full_list = cursor.execute(sql).fetchall()
-                sql = """SELECT file_id FROM all_data
-                            WHERE ({0}) AND is_portrait = 1 ORDER BY {1}
-                                        """.format(where_clause, sort_clause)
-                pair_list = cursor.execute(sql).fetchall()
-                newlist = []
-                skip_portrait_slot = False
-                for i in range(len(full_list)):
-                    if full_list[i][0] != -1:
-                        newlist.append(full_list[i])
-                    elif skip_portrait_slot:
-                        skip_portrait_slot = False
-                        continue
-                    elif pair_list:
-                        elem = pair_list.pop(0)
-                        if pair_list:
-                            elem += pair_list.pop(0)
-                            # Here, we just doubled-up a set of portrait images.
-                            # Skip the next available "portrait slot" as it's unneeded.
-                            skip_portrait_slot = True
-                        newlist.append(elem)
-                return newlist
+            else: # one SELECT then pair the portraits in a single pass
+                sql = """SELECT file_id, is_portrait FROM all_data WHERE {0} ORDER BY {1}
+                    """.format(where_clause, sort_clause)
+                self.__logger.info(f"Executing query: {sql}")
+                return pair_portraits(cursor.execute(sql).fetchall())
         except:
             return []
 
 
-    def get_file_info(self, file_id):
+    def query_sort_keys(self, file_ids, sort_clause):
+        """Returns {file_id: SortKey} for the files, so they can be put in order in python the same way
+        as ORDER BY sort_clause. Files not in all_data are left out"""
+        columns = []
+        for item in sort_clause.split(","):
+            words = item.split()
+            descending = len(words) > 1 and words[-1].upper() == "DESC"
+            if len(words) > 1 and words[-1].upper() in ("ASC", "DESC"):
+                words = words[:-1]
+            if words:
+                columns.append((" ".join(words), descending))
+        if not columns or not file_ids:
+            return {}
+        descending = [desc for _, desc in columns]
+        cursor = self.__read_db().cursor()
+        cursor.row_factory = None
+        sql = "SELECT file_id, {0} FROM all_data WHERE file_id IN ({1})".format(
+                    ", ".join(expr for expr, _ in columns), ",".join(str(int(file_id)) for file_id in file_ids))
+        try:
+            return {row[0]: SortKey(row[1:], descending) for row in cursor.execute(sql)}
+        except sqlite3.Error:
+            return {}
+
+    def query_ids(self, where_clause):
+        """For shuffling in memory. Returns (file_id, is_portrait, last_modified) for all the files
+        matching where_clause in no particular order, is_portrait is -1 if not known (no meta row)"""
+        cursor = self.__read_db().cursor()
+        cursor.row_factory = None
+        sql = """SELECT file_id, IFNULL(is_portrait, -1), last_modified FROM all_data WHERE {0}
+            """.format(where_clause)
+        self.__logger.info(f"Executing query: {sql}")
+        try:
+            return cursor.execute(sql).fetchall()
+        except:
+            return []
+
+    def query_display_stats(self, where_clause):
+        """For WeightedSampler. Returns (file_id, is_portrait, displayed_count, last_displayed, rating)
+        for all the files matching where_clause in no particular order"""
+        cursor = self.__read_db().cursor()
+        cursor.row_factory = None
+        # all_data doesn't have the display stats and its columns in where_clause would be ambiguous
+        # with file's if joined directly
+        sql = """SELECT file.file_id, selected.is_portrait, file.displayed_count, file.last_displayed, selected.rating
+                FROM (SELECT file_id, IFNULL(is_portrait, -1) AS is_portrait, CAST(rating AS REAL) AS rating FROM all_data WHERE {0}) AS selected
+                INNER JOIN file ON file.file_id = selected.file_id
+            """.format(where_clause)
+        self.__logger.info(f"Executing query: {sql}")
+        try:
+            return cursor.execute(sql).fetchall()
+        except:
+            return []
+
+    def get_changes(self, change_count):
+        """Returns (change_count, inserted, deleted), the current change_count and lists of the file
+        ids added to and removed from the db since it was the change_count passed. An id can be in
+        both if it was added then removed. Returns None if the feed doesn't go back that far"""
+        with self.__change_feed_lock:
+            if change_count == self.__change_count:
+                return change_count, [], []
+            if not self.__change_feed or self.__change_feed[0][0] > change_count + 1:
+                return None
+            inserted = []
+            deleted = []
+            first = len(self.__change_feed) - (self.__change_count - change_count) # one entry per change_count
+            for i in range(max(first, 0), len(self.__change_feed)):
+                _, inserted_ids, deleted_ids = self.__change_feed[i]
+                inserted.extend(inserted_ids)
+                deleted.extend(deleted_ids)
+            return self.__change_count, inserted, deleted
+
+    def __publish_changes(self, inserted=(), deleted=()):
+        # every change to the files in the db goes through here so each change_count is in the feed
+        with self.__change_feed_lock:
+            self.__change_count += 1
+            self.__change_feed.append((self.__change_count, list(inserted), list(deleted)))
+            self.__change_feed_ids += len(inserted) + len(deleted)
+            while self.__change_feed_ids > ImageCache.CHANGE_FEED_SIZE and len(self.__change_feed) > 1:
+                _, inserted_ids, deleted_ids = self.__change_feed.popleft()
+                self.__change_feed_ids -= len(inserted_ids) + len(deleted_ids)
+
+    @property
+    def change_count(self):
+        # goes up whenever files are added to or removed from the db, so a query result can be reused until it does
+        return self.__change_count
+
+    @property
+    def pass_count(self):
+        # number of times update_cache has got through all the changes found on disk, so once
+        # this is above 0 the db matches the files at least as they were when it started
+        return self.__pass_count
+
+    def get_file_info(self, file_id, displayed=True):
+        # displayed=False is for looking ahead, i.e. prefetching, so no location lookup or stats
         if not file_id: return None
         sql = "SELECT * FROM all_data where file_id = {0}".format(file_id)
-        row = self.__db.execute(sql).fetchone()
+        row = self.__read_db().execute(sql).fetchone()
+        if not displayed:
+            return row
         if row is not None and row['latitude'] is not None and row['longitude'] is not None and row['location'] is None:
-            if self.__get_geo_location(row['latitude'], row['longitude']):
-                row = self.__db.execute(sql).fetchone() # description inserted in table
+            if self.__geo_reverse is not None: # looked up in the background, the loop writes it to the location table
+                self.__geo_reverse.request_address(row['latitude'], row['longitude'])
         self.__add_file_to_stats_cache(file_id) # Add a record to the file stats cache collection
         return row # NB if select fails (i.e. moved file) will return None
 
+    @staticmethod
+    def get_folder_where_clause(folder):
+        # all files in folder and its subfolders as an index range on folder_name. '0' is the
+        # character after '/' so the range covers exactly the names starting with folder + '/'
+        folder = folder.replace("'", "''")
+        return "(folder_name = '{0}' OR (folder_name >= '{0}/' AND folder_name < '{0}0'))".format(folder)
+
+    @property
+    def has_text_index(self):
+        return self.__has_text_index
+
+    def get_text_where_clause(self, field, phrase):
+        # files with phrase anywhere in field (tags, title, caption or location), ignoring case. The
+        # trigram index only finds phrases of 3 or more characters, shorter ones have to read every row.
+        # file_id > 0 is always true for a file with meta but lets sqlite make the LEFT JOIN meta in
+        # all_data an inner join, then it starts from the matched file_ids rather than scanning file
+        use_index = self.__has_text_index and len(phrase) >= 3 # before escaping, "o'" is still too short
+        phrase = phrase.replace("'", "''")
+        if use_index:
+            return "(file_id IN (SELECT rowid FROM meta_fts WHERE meta_fts MATCH '{} : \"{}\"') AND file_id > 0)".format(
+                        field, phrase.replace('"', '""'))
+        return "{} LIKE '%{}%'".format(field, phrase)
+
+    @staticmethod
+    def get_calendar_where_clause(day, days):
+        # files taken within days of day (see calendar_day) in any year, wrapping round at the end of
+        # the year. A range on the day_of_year index rather than working out the date of every row
+        first, last = day - days, day + days
+        if last - first >= 365:
+            return "day_of_year IS NOT NULL"
+        if first < 1 or last > 366:
+            # an IN list as sqlite won't use the index for two ranges OR'd together. As in get_text_where_clause
+            # day_of_year > 0 lets the LEFT JOIN meta in all_data be an inner join starting from the index
+            return "(day_of_year IN ({}) AND day_of_year > 0)".format(
+                        ",".join(str((d - 1) % 366 + 1) for d in range(first, last + 1)))
+        return "day_of_year BETWEEN {} AND {}".format(first, last)
+
     def get_column_names(self):
         sql = "PRAGMA table_info(all_data)"
-        rows = self.__db.execute(sql).fetchall()
+        rows = self.__read_db().execute(sql).fetchall()
         return [row['name'] for row in rows]
 
     def __add_file_to_stats_cache(self, file_id):
@@ -188,15 +440,68 @@ class ImageCache:
                 self.__db.execute(sql, (timestamp, file_id))
             self.__cached_file_stats_lock.release()
 
-    def __get_geo_location(self, lat, lon): # TODO periodically check all lat/lon in meta with no location and try again
-        location = self.__geo_reverse.get_address(lat, lon)
-        if len(location) == 0:
-            return False #TODO this will continue to try even if there is some permanant cause
-        else:
-            sql = "INSERT OR REPLACE INTO location (latitude, longitude, description) VALUES (?, ?, ?)"
-            self.__db.execute(sql, (lat, lon, location))
-            return True
+    def get_setting(self, name, default=None):
+        with self.__cached_file_stats_lock:
+            if name in self.__cached_settings:
+                return self.__cached_settings[name]
+        row = self.__read_db().execute("SELECT value FROM setting WHERE name = ?", (name,)).fetchone()
+        return row['value'] if row is not None else default
+
+    def set_setting(self, name, value):
+        # written to the db by the loop thread
+        with self.__cached_file_stats_lock:
+            self.__cached_settings[name] = value
+
+    def __store_queued(self):
+        # write what other threads have queued for the db, without looking at the disk
+        self.__update_file_stats()
+        self.__update_settings()
+        self.__update_locations()
+        self.__db.commit()
 
+    def __update_settings(self):
+        if self.__cached_settings:
+            with self.__cached_file_stats_lock:
+                settings, self.__cached_settings = self.__cached_settings, {}
+            self.__db.executemany("INSERT OR REPLACE INTO setting (name, value) VALUES (?, ?)", settings.items())
+
+    def __update_locations(self):
+        # Store addresses found by the geo reverse worker. "" is stored where there is no address so it isn't asked for again
+        if self.__geo_reverse is not None:
+            locations = self.__geo_reverse.get_addresses()
+            if locations:
+                sql = "INSERT OR REPLACE INTO location (latitude, longitude, description) VALUES (?, ?, ?)"
+                self.__db.executemany(sql, locations)
+                self.__geo_backfill['resolved'] = min(self.__geo_backfill['resolved'] + len(locations),
+                                                      self.__geo_backfill['queued'])
+            cells = self.__geo_reverse.get_new_cells()
+            if cells:
+                sql = "INSERT OR REPLACE INTO location_cell (cell_size, cell_lat, cell_lon, description) VALUES (?, ?, ?, ?)"
+                self.__db.executemany(sql, [(self.__geo_reverse.cell_size,) + cell for cell in cells])
+
+
+    def __backfill_locations(self):
+        # Queue every distinct lat/lon in meta without a location, so location filters cover pictures
+        # that haven't been shown yet. They are looked up behind requests for pictures being shown
+        if self.__geo_reverse is None or not self.__geo_backfill_interval or time.time() < self.__next_backfill_tm:
+            return
+        self.__next_backfill_tm = time.time() + self.__geo_backfill_interval
+        sql = """
+            SELECT DISTINCT meta.latitude, meta.longitude FROM meta
+                LEFT JOIN location
+                    ON location.latitude = meta.latitude AND location.longitude = meta.longitude
+            WHERE meta.latitude IS NOT NULL AND meta.longitude IS NOT NULL AND location.id IS NULL"""
+        coords = self.__db.execute(sql).fetchall()
+        self.__logger.info('Backfilling locations for %d lat/lon', len(coords))
+        self.__geo_backfill = {'last_run': time.time(), 'queued': len(coords), 'resolved': 0}
+        for lat, lon in coords:
+            self.__geo_reverse.request_address(lat, lon, background=True)
+
+    def get_geo_backfill_progress(self):
+        """Returns a dict with the time of the last backfill, the number of distinct lat/lon it found
+        without a location, how many have been resolved since and how many are waiting for the geocoder"""
+        return {**self.__geo_backfill,
+                'waiting': self.__geo_reverse.queued_count if self.__geo_reverse is not None else 0}
 
     def __create_open_db(self, db_file):
         sql_folder_table = """
@@ -241,6 +546,10 @@ class ImageCache:
         sql_meta_index = """
             CREATE INDEX IF NOT EXISTS exif_datetime ON meta (exif_datetime)"""
 
+        # for the location triggers below to find the meta rows at a lat/lon
+        sql_meta_location_index = """
+            CREATE INDEX IF NOT EXISTS meta_location ON meta (latitude, longitude)"""
+
         sql_location_table = """
             CREATE TABLE IF NOT EXISTS location (
                 id INTEGER NOT NULL PRIMARY KEY,
@@ -250,6 +559,23 @@ class ImageCache:
                 UNIQUE (latitude, longitude)
             )"""
 
+        # addresses found by GeoReverse for grid cells of cell_size degrees, see GeoReverse.request_address
+        sql_location_cell_table = """
+            CREATE TABLE IF NOT EXISTS location_cell (
+                cell_size REAL NOT NULL,
+                cell_lat INTEGER NOT NULL,
+                cell_lon INTEGER NOT NULL,
+                description TEXT,
+                PRIMARY KEY (cell_size, cell_lat, cell_lon)
+            )"""
+
+        # values the app keeps between runs, i.e. the shuffle seed
+        sql_setting_table = """
+            CREATE TABLE IF NOT EXISTS setting (
+                name TEXT NOT NULL PRIMARY KEY,
+                value
+            )"""
+
         sql_db_info_table = """
             CREATE TABLE IF NOT EXISTS db_info (
                 schema_version INTEGER NOT NULL
@@ -294,14 +620,107 @@ class ImageCache:
                 DELETE FROM meta WHERE file_id = OLD.file_id;
             END"""
 
-        db = sqlite3.connect(db_file, check_same_thread=False) # writing only done in loop thread, reading in this so should be safe
+        db = sqlite3.connect(db_file, check_same_thread=False) # made here but only used by the loop thread after this
         db.row_factory = sqlite3.Row # make results accessible by field name
-        for item in (sql_folder_table, sql_file_table, sql_meta_table, sql_location_table, sql_meta_index,
-                    sql_all_data_view, sql_db_info_table, sql_clean_file_trigger, sql_clean_meta_trigger):
+        self.__set_pragmas(db)
+        for item in (sql_folder_table, sql_file_table, sql_meta_table, sql_location_table, sql_location_cell_table, sql_meta_index,
+                    sql_meta_location_index, sql_all_data_view, sql_db_info_table, sql_setting_table,
+                    sql_clean_file_trigger, sql_clean_meta_trigger):
             db.execute(item)
+        self.__create_text_index(db)
 
         return db
 
+    def __create_text_index(self, db):
+        # Full text index of the fields the tags and location filters search, rowid is the file_id. The trigram
+        # tokenizer matches any part of a word so it finds what LIKE '%...%' did without reading every row.
+        # Kept up to date by triggers on meta and location, and filled from the existing rows when the triggers
+        # aren't there, i.e. a new db, an older one or one last opened without fts5
+        sql_meta_fts_table = """
+            CREATE VIRTUAL TABLE meta_fts USING fts5(
+                tags, title, caption, location,
+                tokenize = 'trigram'
+            )"""
+
+        # INSERT OR REPLACE doesn't fire delete triggers for the row it replaces so clear it first
+        sql_meta_fts_insert_trigger = """
+            CREATE TRIGGER IF NOT EXISTS Meta_Fts_Insert_Trigger
+            AFTER INSERT ON meta
+            FOR EACH ROW
+            BEGIN
+                DELETE FROM meta_fts WHERE rowid = NEW.file_id;
+                INSERT INTO meta_fts(rowid, tags, title, caption, location)
+                    VALUES (NEW.file_id, NEW.tags, NEW.title, NEW.caption,
+                        (SELECT description FROM location WHERE latitude = NEW.latitude AND longitude = NEW.longitude));
+            END"""
+
+        sql_meta_fts_update_trigger = """
+            CREATE TRIGGER IF NOT EXISTS Meta_Fts_Update_Trigger
+            AFTER UPDATE OF tags, title, caption, latitude, longitude ON meta
+            FOR EACH ROW
+            BEGIN
+                UPDATE meta_fts SET tags = NEW.tags, title = NEW.title, caption = NEW.caption,
+                    location = (SELECT description FROM location WHERE latitude = NEW.latitude AND longitude = NEW.longitude)
+                    WHERE rowid = NEW.file_id;
+            END"""
+
+        sql_meta_fts_delete_trigger = """
+            CREATE TRIGGER IF NOT EXISTS Meta_Fts_Delete_Trigger
+            AFTER DELETE ON meta
+            FOR EACH ROW
+            BEGIN
+                DELETE FROM meta_fts WHERE rowid = OLD.file_id;
+            END"""
+
+        # locations are written with INSERT OR REPLACE as the geocoder finds them
+        sql_location_fts_insert_trigger = """
+            CREATE TRIGGER IF NOT EXISTS Location_Fts_Insert_Trigger
+            AFTER INSERT ON location
+            FOR EACH ROW
+            BEGIN
+                UPDATE meta_fts SET location = NEW.description WHERE rowid IN
+                    (SELECT file_id FROM meta WHERE latitude = NEW.latitude AND longitude = NEW.longitude);
+            END"""
+
+        sql_location_fts_update_trigger = """
+            CREATE TRIGGER IF NOT EXISTS Location_Fts_Update_Trigger
+            AFTER UPDATE ON location
+            FOR EACH ROW
+            BEGIN
+                UPDATE meta_fts SET location = NULL WHERE rowid IN
+                    (SELECT file_id FROM meta WHERE latitude = OLD.latitude AND longitude = OLD.longitude);
+                UPDATE meta_fts SET location = NEW.description WHERE rowid IN
+                    (SELECT file_id FROM meta WHERE latitude = NEW.latitude AND longitude = NEW.longitude);
+            END"""
+
+        sql_meta_fts_fill = """
+            INSERT INTO meta_fts(rowid, tags, title, caption, location)
+            SELECT meta.file_id, meta.tags, meta.title, meta.caption, location.description
+            FROM meta
+                LEFT JOIN location
+                    ON location.latitude = meta.latitude AND location.longitude = meta.longitude"""
+
+        triggers = ('Meta_Fts_Insert_Trigger', 'Meta_Fts_Update_Trigger', 'Meta_Fts_Delete_Trigger',
+                    'Location_Fts_Insert_Trigger', 'Location_Fts_Update_Trigger')
+        try:
+            if db.execute("SELECT 1 FROM sqlite_master WHERE name = 'Meta_Fts_Insert_Trigger'").fetchone() is None:
+                self.__logger.info('Creating the full text index for tags and locations')
+                db.execute("DROP TABLE IF EXISTS meta_fts")
+                db.execute(sql_meta_fts_table)
+                db.execute(sql_meta_fts_fill)
+            for item in (sql_meta_fts_insert_trigger, sql_meta_fts_update_trigger, sql_meta_fts_delete_trigger,
+                         sql_location_fts_insert_trigger, sql_location_fts_update_trigger):
+                db.execute(item)
+            db.commit()
+            self.__has_text_index = True
+        except sqlite3.OperationalError as e: # fts5 or the trigram tokenizer (sqlite 3.34) not available
+            db.rollback()
+            # without the triggers meta can still be written, the index is made again when it can be
+            for trigger in triggers:
+                db.execute("DROP TRIGGER IF EXISTS {}".format(trigger))
+            db.commit()
+            self.__logger.warning('No full text index, tags and location filters will read every row: %s', e)
+
 
     def __update_schema(self, required_db_schema_version):
         sql_select = "SELECT schema_version from db_info"
@@ -347,6 +766,48 @@ class ImageCache:
                 self.__db.execute("ALTER TABLE file ADD COLUMN displayed_count INTEGER default 0 NOT NULL")
                 self.__db.execute("ALTER TABLE file ADD COLUMN last_displayed REAL DEFAULT 0 NOT NULL")
 
+            if schema_version <= 3:
+                # Migrate to db schema v4
+                # Add the folder name to the all_data view. Filtering on it (rather than a LIKE on the
+                # computed fname) lets sqlite use the unique index on folder.name as a path hierarchy,
+                # i.e. a range scan for a folder and all its subfolders, then join only matching files.
+                self.__db.execute("DROP VIEW all_data")
+                self.__db.execute("""
+                    CREATE VIEW IF NOT EXISTS all_data
+                    AS
+                    SELECT
+                        folder.name || "/" || file.basename || "." || file.extension AS fname,
+                        file.last_modified,
+                        meta.*,
+                        meta.height > meta.width as is_portrait,
+                        location.description as location,
+                        folder.name as folder_name
+                    FROM file
+                        INNER JOIN folder
+                            ON folder.folder_id = file.folder_id
+                        LEFT JOIN meta
+                            ON file.file_id = meta.file_id
+                        LEFT JOIN location
+                            ON location.latitude = meta.latitude AND location.longitude = meta.longitude
+                    WHERE folder.missing = 0
+                    """)
+
+            if schema_version <= 4:
+                # Migrate to db schema v5
+                # Add the year, month and day of the year the picture was taken (local time) so the same
+                # month and on this day selections are index lookups rather than converting exif_datetime
+                # to a date for every row. day_of_year is counted as in a leap year, see calendar_day()
+                for column in ('year', 'month', 'day_of_year'):
+                    self.__db.execute("ALTER TABLE meta ADD COLUMN {} INTEGER".format(column))
+                self.__db.execute("""
+                    UPDATE meta SET
+                        year = CAST(STRFTIME('%Y', exif_datetime, 'unixepoch', 'localtime') AS INTEGER),
+                        month = CAST(STRFTIME('%m', exif_datetime, 'unixepoch', 'localtime') AS INTEGER),
+                        day_of_year = CAST(STRFTIME('%j', '2000-' || STRFTIME('%m-%d', exif_datetime, 'unixepoch', 'localtime')) AS INTEGER)
+                    """)
+                self.__db.execute("CREATE INDEX IF NOT EXISTS meta_month ON meta (month)")
+                self.__db.execute("CREATE INDEX IF NOT EXISTS meta_day_of_year ON meta (day_of_year)")
+
             # Finally, update the db's schema version stamp to the app's requested version
             self.__db.execute('DELETE FROM db_info')
             self.__db.execute('INSERT INTO db_info VALUES(?)', (required_db_schema_version,))
@@ -356,15 +817,30 @@ class ImageCache:
     #     - Found on disk, but not currently in the 'folder' table
     #     - Found on disk, but newer than the associated record in the 'folder' table
     #     - Found on disk, but flagged as 'missing' in the 'folder' table
+    #     - Reported as changed by the change source (i.e. inotify) since the last pass
     # --- Note that all folders returned currently exist on disk
     def __get_modified_folders(self):
+        if self.__reconcile_interval and time.time() > self.__next_reconcile_tm:
+            self.__logger.info('Starting periodic full walk of %s', self.__picture_dir)
+            self.__change_source.request_full_walk()
+            self.__next_reconcile_tm = time.time() + self.__reconcile_interval
+        folders, full_walk = self.__change_source.get_changed_folders()
         out_of_date_folders = []
         sql_select = "SELECT * FROM folder WHERE name = ?"
-        for dir in [d[0] for d in os.walk(self.__picture_dir, followlinks=self.__follow_links)]:
-            mod_tm = int(os.stat(dir).st_mtime)
-            found = self.__db.execute(sql_select, (dir,)).fetchone()
-            if not found or found['last_modified'] < mod_tm or found['missing'] == 1:
-                out_of_date_folders.append((dir, mod_tm))
+        for dir in folders:
+            try:
+                mod_tm = int(os.stat(dir).st_mtime)
+            except OSError: # removed since it was reported
+                continue
+            if full_walk:
+                found = self.__db.execute(sql_select, (dir,)).fetchone()
+                if found and found['last_modified'] >= mod_tm and found['missing'] == 0:
+                    continue
+            out_of_date_folders.append((dir, mod_tm))
+        # removing a file or folder changes the modification time of the folder it was in
+        self.__purge_candidates.update(dir for dir, _ in out_of_date_folders)
+        if full_walk:
+            self.__walked_folders = set(folders)
         return out_of_date_folders
 
 
@@ -394,27 +870,42 @@ class ImageCache:
         return out_of_date_files
 
 
-    def __insert_file(self, file):
-        file_insert = "INSERT OR REPLACE INTO file(folder_id, basename, extension, last_modified) VALUES((SELECT folder_id from folder where name = ?), ?, ?, ?)"
+    def __insert_files(self, batch):
+        # Insert a list of (file, mod_tm, meta) into the folder, file and meta tables as one transaction
+        if not batch:
+            return
+        file_insert = "INSERT OR REPLACE INTO file(folder_id, basename, extension, last_modified) VALUES(?, ?, ?, ?)"
         # Insert the new folder if it's not already in the table. Update the missing field separately.
         folder_insert = "INSERT OR IGNORE INTO folder(name) VALUES(?)"
         folder_update = "UPDATE folder SET missing = 0 where name = ?"
-
-        mod_tm =  os.path.getmtime(file)
-        dir, file_only = os.path.split(file)
-        base, extension = os.path.splitext(file_only)
-
-        # Get the file's meta info and build the INSERT statement dynamically
-        meta = self.__get_exif_info(file)
-        meta_insert = self.__get_meta_sql_from_dict(meta)
-        vals = list(meta.values())
-        vals.insert(0, file)
-
-        # Insert this file's info into the folder, file, and meta tables
-        self.__db.execute(folder_insert, (dir,))
-        self.__db.execute(folder_update, (dir,))
-        self.__db.execute(file_insert, (dir, base, extension.lstrip("."), mod_tm))
-        self.__db.execute(meta_insert, vals)
+        folder_select = "SELECT folder_id FROM folder WHERE name = ?"
+        # INSERT OR REPLACE gives a modified file a new file_id so the old one is found first for the change feed
+        file_select = "SELECT file_id FROM file WHERE folder_id = ? AND basename = ? AND extension = ?"
+
+        folder_ids = {}
+        meta_rows = {} # insert statement -> rows, normally there is just one statement
+        inserted = []
+        deleted = []
+        for file, mod_tm, meta in batch:
+            self.__logger.debug('Inserting: %s', file)
+            dir, file_only = os.path.split(file)
+            base, extension = os.path.splitext(file_only)
+            if dir not in folder_ids:
+                self.__db.execute(folder_insert, (dir,))
+                self.__db.execute(folder_update, (dir,))
+                folder_ids[dir] = self.__db.execute(folder_select, (dir,)).fetchone()[0]
+            replaced = self.__db.execute(file_select, (folder_ids[dir], base, extension.lstrip("."))).fetchone()
+            if replaced is not None:
+                deleted.append(replaced[0])
+            # the file_id for the meta row comes straight from the file insert
+            file_id = self.__db.execute(file_insert, (folder_ids[dir], base, extension.lstrip("."), mod_tm)).lastrowid
+            inserted.append(file_id)
+            meta_insert = self.__get_meta_sql_from_dict(meta)
+            meta_rows.setdefault(meta_insert, []).append([file_id] + list(meta.values()))
+        for meta_insert, rows in meta_rows.items():
+            self.__db.executemany(meta_insert, rows)
+        self.__db.commit()
+        self.__publish_changes(inserted, deleted)
 
 
     def __update_folder_info(self, folder_collection):
@@ -428,89 +919,215 @@ class ImageCache:
     def __get_meta_sql_from_dict(self, dict):
         columns = ', '.join(dict.keys())
         ques = ', '.join('?' * len(dict.keys()))
-        return 'INSERT OR REPLACE INTO meta(file_id, {0}) VALUES((SELECT file_id from all_data where fname = ?), {1})'.format(columns, ques)
+        return 'INSERT OR REPLACE INTO meta(file_id, {0}) VALUES(?, {1})'.format(columns, ques)
 
 
     def __purge_missing_files_and_folders(self):
-        # Find folders in the db that are no longer on disk
-        folder_id_list = []
-        for row in self.__db.execute('SELECT folder_id, name from folder'):
-            if not os.path.exists(row['name']):
-                folder_id_list.append([row['folder_id']])
+        # Folders and files that have gone are found by comparing names from the disk with the db as sets rather
+        # than checking each row exists, which over a network share is a round trip each. Nothing can have gone
+        # unless a folder has changed since the last time, or the picture_dir has, or a purge has been asked for
+        walked, self.__walked_folders = self.__walked_folders, None
+        candidates, self.__purge_candidates = self.__purge_candidates, set()
+        lost_top = walked is not None and self.__picture_dir not in walked
+        if not candidates and not lost_top and not self.__purge_files:
+            return
+
+        folder_rows = self.__db.execute('SELECT folder_id, name, missing FROM folder').fetchall()
+        gone = set()
+        if walked is not None and (candidates or lost_top):
+            # the walk found every folder on disk, only the few not in it are checked in case the walk had an error
+            top = os.path.join(self.__picture_dir, '')
+            gone.update(name for _, name, missing in folder_rows
+                        if not missing and name not in walked and (name + '/').startswith(top) and not os.path.isdir(name))
+        # subfolders and files of the changed folders, or of every folder if purging
+        if self.__purge_files:
+            to_list = [name for _, name, _ in folder_rows]
+        else:
+            to_list = candidates if walked is None else []
+        listings = {} # folder -> (set of subfolder names, set of file names)
+        for folder in to_list:
+            try:
+                listings[folder] = self.__list_folder(folder)
+            except (FileNotFoundError, NotADirectoryError):
+                gone.add(folder)
+            except OSError as e: # i.e. permissions or network, left as it is this time
+                self.__logger.warning('Could not list %s -> %s', folder, e)
+
+        def is_gone(name):
+            # gone if the nearest folder above it that was listed doesn't have the next folder down
+            child, parent = name, os.path.dirname(name)
+            while parent != child:
+                if parent in gone:
+                    return True
+                if parent in listings:
+                    return os.path.basename(child) not in listings[parent][0]
+                child, parent = parent, os.path.dirname(parent)
+            return False
 
         # Flag or delete any non-existent folders from the db. Note, deleting will automatically
         # remove orphaned records from the 'file' and 'meta' tables
+        folder_id_list = [[folder_id] for folder_id, name, missing in folder_rows
+                          if (not missing or self.__purge_files) and (name in gone or is_gone(name))]
         if len(folder_id_list):
             if self.__purge_files:
-                self.__db.executemany('DELETE FROM folder WHERE folder_id = ?', folder_id_list)
+                deleted = [row[0] for folder_id in folder_id_list
+                           for row in self.__db.execute('SELECT file_id FROM file WHERE folder_id = ?', folder_id)]
+                cursor = self.__db.executemany('DELETE FROM folder WHERE folder_id = ?', folder_id_list)
             else:
-                self.__db.executemany('UPDATE folder SET missing = 1 WHERE folder_id = ?', folder_id_list)
+                deleted = [] # the files stay in the db while the folder is missing
+                cursor = self.__db.executemany('UPDATE folder SET missing = 1 WHERE folder_id = ? AND missing = 0', folder_id_list)
+            if cursor.rowcount > 0:
+                self.__publish_changes(deleted=deleted)
 
-        # Find files in the db that are no longer on disk
+        # Find files in the db that are not in the listing of their folder
         if self.__purge_files:
-            file_id_list = []
-            for row in self.__db.execute('SELECT file_id, fname from all_data'):
-                if not os.path.exists(row['fname']):
-                    file_id_list.append([row['file_id']])
+            sql = """SELECT file.file_id, folder.name, file.basename, file.extension
+                FROM file
+                    INNER JOIN folder
+                        ON folder.folder_id = file.folder_id
+                WHERE folder.missing = 0"""
+            file_id_list = [[file_id] for file_id, folder, basename, extension in self.__db.execute(sql)
+                            if folder in listings and "{}.{}".format(basename, extension) not in listings[folder][1]]
 
             # Delete any non-existent files from the db. Note, this will automatically
             # remove matching records from the 'meta' table as well.
             if len(file_id_list):
                 self.__db.executemany('DELETE FROM file WHERE file_id = ?', file_id_list)
+                self.__publish_changes(deleted=[file_id for file_id, in file_id_list])
             self.__purge_files = False
 
-    def __get_exif_info(self, file_path_name):
-        exifs = get_image_meta.GetImageMeta(file_path_name)
-        # Dict to store interesting EXIF data
-        # Note, the 'key' must match a field in the 'meta' table
-        e = {}
-
-        e['orientation'] = exifs.get_orientation()
-
-        width, height = exifs.get_size()
-        ext = os.path.splitext(file_path_name)[1].lower()
-        if ext not in ('.heif','.heic') and e['orientation'] in (5, 6, 7, 8):
-            width, height = height, width # swap values
-        e['width'] = width
-        e['height'] = height
-
-
-        e['f_number'] = exifs.get_exif('EXIF FNumber')
-        e['make'] = exifs.get_exif('Image Make')
-        e['model'] = exifs.get_exif('Image Model')
-        e['exposure_time'] = exifs.get_exif('EXIF ExposureTime')
-        e['iso'] =  exifs.get_exif('EXIF ISOSpeedRatings')
-        e['focal_length'] =  exifs.get_exif('EXIF FocalLength')
-        e['rating'] = exifs.get_exif('Image Rating')
-        e['lens'] = exifs.get_exif('EXIF LensModel')
-        e['exif_datetime'] = None
-        val = exifs.get_exif('EXIF DateTimeOriginal')
-        if val != None:
-            # Remove any subsecond portion of the DateTimeOriginal value. According to the spec, it's
-            # not valid here anyway (should be in SubSecTimeOriginal), but it does exist sometimes.
-            val = val.split('.', 1)[0]
-            try:
-                e['exif_datetime'] = time.mktime(time.strptime(val, '%Y:%m:%d %H:%M:%S'))
-            except:
-                pass
-
-        # If we still don't have a date/time, just use the file's modificaiton time
-        if e['exif_datetime'] == None:
-            e['exif_datetime'] = os.path.getmtime(file_path_name)
-
-        gps = exifs.get_location()
-        lat = gps['latitude']
-        lon = gps['longitude']
-        e['latitude'] = round(lat, 4) if lat is not None else lat #TODO sqlite requires (None,) to insert NULL
-        e['longitude'] = round(lon, 4) if lon is not None else lon
-
-        #IPTC
-        e['tags'] = exifs.get_exif('IPTC Keywords')
-        e['title'] = exifs.get_exif('IPTC Object Name')
-        e['caption'] = exifs.get_exif('IPTC Caption/Abstract')
-
-
-        return e
+    def __list_folder(self, folder):
+        # names of the subfolders and files in folder from one directory read. Raises OSError if it can't be read
+        subfolders, files = set(), set()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=self.__follow_links)
+                except OSError: # i.e. a broken link
+                    is_dir = False
+                (subfolders if is_dir else files).add(entry.name)
+        return subfolders, files
+
+
+def get_exif_info(file_path_name):
+    exifs = get_image_meta.GetImageMeta(file_path_name)
+    # Dict to store interesting EXIF data
+    # Note, the 'key' must match a field in the 'meta' table
+    e = {}
+
+    e['orientation'] = exifs.get_orientation()
+
+    width, height = exifs.get_size()
+    ext = os.path.splitext(file_path_name)[1].lower()
+    if ext not in ('.heif','.heic') and e['orientation'] in (5, 6, 7, 8):
+        width, height = height, width # swap values
+    e['width'] = width
+    e['height'] = height
+
+
+    e['f_number'] = exifs.get_exif('EXIF FNumber')
+    e['make'] = exifs.get_exif('Image Make')
+    e['model'] = exifs.get_exif('Image Model')
+    e['exposure_time'] = exifs.get_exif('EXIF ExposureTime')
+    e['iso'] =  exifs.get_exif('EXIF ISOSpeedRatings')
+    e['focal_length'] =  exifs.get_exif('EXIF FocalLength')
+    e['rating'] = exifs.get_exif('Image Rating')
+    e['lens'] = exifs.get_exif('EXIF LensModel')
+    e['exif_datetime'] = None
+    val = exifs.get_exif('EXIF DateTimeOriginal')
+    if val != None:
+        # Remove any subsecond portion of the DateTimeOriginal value. According to the spec, it's
+        # not valid here anyway (should be in SubSecTimeOriginal), but it does exist sometimes.
+        val = val.split('.', 1)[0]
+        try:
+            e['exif_datetime'] = time.mktime(time.strptime(val, '%Y:%m:%d %H:%M:%S'))
+        except:
+            pass
+
+    # If we still don't have a date/time, just use the file's modificaiton time
+    if e['exif_datetime'] == None:
+        e['exif_datetime'] = os.path.getmtime(file_path_name)
+    taken = time.localtime(e['exif_datetime'])
+    e['year'] = taken.tm_year
+    e['month'] = taken.tm_mon
+    e['day_of_year'] = calendar_day(taken.tm_mon, taken.tm_mday)
+
+    gps = exifs.get_location()
+    lat = gps['latitude']
+    lon = gps['longitude']
+    e['latitude'] = round(lat, 4) if lat is not None else lat #TODO sqlite requires (None,) to insert NULL
+    e['longitude'] = round(lon, 4) if lon is not None else lon
+
+    #IPTC
+    e['tags'] = exifs.get_exif('IPTC Keywords')
+    e['title'] = exifs.get_exif('IPTC Object Name')
+    e['caption'] = exifs.get_exif('IPTC Caption/Abstract')
+
+
+    return e
+
+
+class SortKey:
+    """Orders rows of values as ORDER BY does, each column ascending or descending, with sqlite's
+    order of types: NULL, then numbers, then text (compared as utf-8 bytes, the same as by code point)
+    and then blobs"""
+    __slots__ = ('values', 'descending')
+
+    def __init__(self, values, descending):
+        self.values = tuple(SortKey.__typed(value) for value in values)
+        self.descending = descending
+
+    @staticmethod
+    def __typed(value):
+        if value is None:
+            return (0, 0)
+        if isinstance(value, (int, float)):
+            return (1, value)
+        return (2, value) if isinstance(value, str) else (3, value)
+
+    def __lt__(self, other):
+        for value, other_value, descending in zip(self.values, other.values, self.descending):
+            if value != other_value:
+                return value > other_value if descending else value < other_value
+        return False
+
+
+def calendar_day(month, day):
+    """Day of the year counted as if every year were a leap year, so a date has the same
+    number every year. 29 Feb is 60, 1 Mar 61 and 31 Dec 366"""
+    return (0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335)[month - 1] + day
+
+
+def pair_portraits(rows):
+    """rows of (file_id, is_portrait) in playlist order. Returns a list of (file_id,) and
+    (file_id1, file_id2) with each pair of portraits taking the place of the first of them.
+    Anything not known to be landscape (is_portrait 0) is a portrait slot"""
+    pair_list = [(file_id,) for file_id, is_portrait in rows if is_portrait == 1]
+    next_pair = 0 # index into pair_list rather than popping from the front, which is O(n) each time
+    newlist = []
+    skip_portrait_slot = False
+    for file_id, is_portrait in rows:
+        if is_portrait == 0:
+            newlist.append((file_id,))
+        elif skip_portrait_slot:
+            skip_portrait_slot = False
+            continue
+        elif next_pair < len(pair_list):
+            elem = pair_list[next_pair]
+            next_pair += 1
+            if next_pair < len(pair_list):
+                elem += pair_list[next_pair]
+                next_pair += 1
+                # Here, we just doubled-up a set of portrait images.
+                # Skip the next available "portrait slot" as it's unneeded.
+                skip_portrait_slot = True
+            newlist.append(elem)
+    return newlist
+
+
+def read_file_meta(file):
+    """Runs in the index worker pool so must not touch the db. Returns (file, mod_tm, meta)"""
+    return file, os.path.getmtime(file), get_exif_info(file)
 
 
 # If being executed (instead of imported), kick it off...
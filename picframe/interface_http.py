@@ -16,16 +16,11 @@ except ImportError:
 
 EXTENSIONS = [".jpg", ".jpeg", ".png", ".heif", ".heic"]
 
-def heif_to_jpg(fname):
+def heif_to_jpg(fname, size=None):
     try:
-        import pyheif
-        from PIL import Image
-
-        heif_file = pyheif.read(fname)
-        image = Image.frombytes(heif_file.mode, heif_file.size, heif_file.data,
-                                "raw", heif_file.mode, heif_file.stride)
-        if image.mode not in ("RGB", "RGBA"):
-            image = image.convert("RGB")
+        from picframe.get_image_meta import GetImageMeta
+
+        image = GetImageMeta.get_image_object(fname, size) # reduced to at least size if given
         image.save("/dev/shm/temp.jpg") # default 75% quality
         return "/dev/shm/temp.jpg"
     except:
@@ -52,7 +47,7 @@ class RequestHandler(BaseHTTPRequestHandler):
                     page = self.server._controller.get_current_path()
                     _, extension = os.path.splitext(page) # as current_image may be heic
                     if extension.lower() in ('.heic', '.heif'):
-                        page = heif_to_jpg(page)
+                        page = heif_to_jpg(page, self.server._image_size)
                 else:
                     page = os.path.join(self.server._html_path, html_page)
                     content_type = "text/html"
@@ -134,7 +129,7 @@ class RequestHandler(BaseHTTPRequestHandler):
 
 
 class InterfaceHttp(HTTPServer):
-    def __init__(self, controller, html_path, pic_dir, no_files_img, port=9000):
+    def __init__(self, controller, html_path, pic_dir, no_files_img, port=9000, image_size=None):
         super(InterfaceHttp, self).__init__(("0.0.0.0", port), RequestHandler)
         # NB name mangling throws a spanner in the works here!!!!!
         # *no* __dunders
@@ -144,6 +139,7 @@ class InterfaceHttp(HTTPServer):
         self._pic_dir = os.path.expanduser(pic_dir)
         self._no_files_img = os.path.expanduser(no_files_img)
         self._html_path = os.path.expanduser(html_path)
+        self._image_size = tuple(image_size) if image_size else None # (w, h) heif images are converted to
         # TODO check below works with all decorated methods.. seems to work
         controller_class = controller.__class__
         self._setters = [method for method in dir(controller_class)
@@ -283,7 +283,8 @@ class MatImage:
             width, height = size
 
         scale = min(width/image.width, height/image.height)
-        image = image.resize((int(image.width * scale), int(image.height * scale)), resample=Image.BICUBIC)
+        image = image.resize((int(image.width * scale), int(image.height * scale)), resample=Image.BICUBIC,
+                             reducing_gap=3.0) # box reduce first when shrinking a lot, much quicker
         return image
 
 
@@ -493,6 +494,13 @@ class Kmeans(object):
 
         return True"""
 
+def _thumbnail(image, size):
+    # like Image.thumbnail but returns a new image without copying the full size original first
+    scale = min(size[0] / image.width, size[1] / image.height, 1.0)
+    return image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                        resample=Image.BICUBIC, reducing_gap=2.0)
+
+
 class KmeansNp:
     def __init__(self, k=3, max_iterations=5, min_distance=5.0, size=200):
         self.k = k
@@ -501,8 +509,7 @@ class KmeansNp:
         self.size = (size, size)
 
     def run(self, image, start_clusters=None):
-        image = image.copy()
-        image.thumbnail(self.size)
+        image = _thumbnail(image, self.size)
         im = np.array(image, dtype=float)[:,:,:3]
         # following section can be used to give the clusters location as well as colour proximity
         #(ix0, ix1) = np.indices(im.shape[:2]) # vert,horiz pixel locations
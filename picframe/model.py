@@ -9,7 +9,9 @@ import logging.config
 import random
 import json
 import locale
-from picframe import geo_reverse, image_cache
+import threading
+import numpy as np
+from picframe import geo_reverse, image_cache, playlist, sampler
 
 DEFAULT_CONFIG = {
     'viewer': {
@@ -50,6 +52,10 @@ DEFAULT_CONFIG = {
         'clock_justify': "R",
         'clock_text_sz': 120,
         'clock_format': "%I:%M",
+        'prefetch_count': 2,
+        'render_cache_dir': '~/picframe_data/render_cache',
+        'render_cache_size': 0,
+        'display_power_refresh': 10.0,
     },
     'model': {
 
@@ -63,17 +69,33 @@ DEFAULT_CONFIG = {
         'fade_time': 10.0,
         'shuffle': True,
         'sort_cols': 'fname ASC',
+        'selection': 'default',
+        'weighted_stale_time': 604800.0,
+        'weighted_rating': 0.5,
+        'weighted_count': 0.5,
+        'on_this_day': -1,
         'image_attr': ['PICFRAME GPS'],                          # image attributes send by MQTT, Keys are taken from exifread library, 'PICFRAME GPS' is special to retrieve GPS lon/lat
         'load_geoloc': True,
         'locale': 'en_US.utf8',
         'key_list': [['tourism','amenity','isolated_dwelling'],['suburb','village'],['city','county'],['region','state','province'],['country']],
         'geo_key': 'this_needs_to@be_changed',  # use your email address
+        'geo_zoom': 18,
+        'geo_cell_size': None,
+        'geo_backend': 'nominatim',
+        'geo_backfill_interval': 3600.0,
+        'geo_data_file': '~/picframe_data/data/cities1000.txt',
         'db_file': '~/picframe_data/data/pictureframe.db3',
         'portrait_pairs': False,
         'deleted_pictures': '~/DeletedPictures',
         'log_level': 'WARNING',
         'log_file': '',
         'use_kbd': False,
+        'update_cache': True,
+        'change_source': 'auto',
+        'reconcile_interval': 86400.0,
+        'index_workers': 2,
+        'index_pool': 'thread',
+        'db_pragmas': {},
     },
     'mqtt': {
         'use_mqtt': False,                          # Set tue true, to enable mqtt
@@ -91,7 +113,8 @@ DEFAULT_CONFIG = {
         'port': 9000,
         'use_ssl': False,
         'keyfile': "/path/to/key.pem",
-        'certfile': "/path/to/fullchain.pem"
+        'certfile': "/path/to/fullchain.pem",
+        'image_size': None,
     }
 }
 
@@ -102,7 +125,7 @@ class Pic: #TODO could this be done more elegantly with namedtuple
                  f_number=0, exposure_time=None, iso=0, focal_length=None,
                  make=None, model=None, lens=None, rating=None, latitude=None,
                  longitude=None, width=0, height=0, is_portrait=0, location=None, title=None,
-                 caption=None, tags=None):
+                 caption=None, tags=None, year=None, month=None, day_of_year=None, folder_name=None):
         self.fname = fname
         self.last_modified = last_modified
         self.file_id = file_id
@@ -125,9 +148,14 @@ class Pic: #TODO could this be done more elegantly with namedtuple
         self.tags=tags
         self.caption=caption
         self.title=title
+        self.year=year
+        self.month=month
+        self.day_of_year=day_of_year
+        self.folder_name=folder_name
 
 
 class Model:
+    SPLICE_SAVE_INTERVAL = 300.0 # seconds, while files are being indexed the playlist is saved at most this often
 
     def __init__(self, same_month_photos: bool, configfile):
         self.__logger = logging.getLogger("model.Model")
@@ -161,11 +189,10 @@ class Model:
         #             root_logger.removeHandler(hdlr)
         #     root_logger.addHandler(filehandler)      # set the new handler
 
-        self.__file_list = [] # this is now a list of tuples i.e (file_id1,) or (file_id1, file_id2)
-        self.__number_of_files = 0 # this is shortcut for len(__file_list)
+        self.__playlist = playlist.Playlist() # slots of (file_id1,) or (file_id1, file_id2)
         self.same_month_photos = same_month_photos
         self.__reload_files = True
-        self.__file_index = 0 # pointer to next position in __file_list
+        self.__file_index = 0 # pointer to next position in __playlist
         self.__current_pics = (None, None) # this hold a tuple of (pic, None) or two pic objects if portrait pairs
         self.__num_run_through = 0
 
@@ -177,17 +204,42 @@ class Model:
         self.__pic_dir = os.path.expanduser(model_config['pic_dir'])
         self.__subdirectory = os.path.expanduser(model_config['subdirectory'])
         self.__load_geoloc = model_config['load_geoloc']
-        self.__geo_reverse = geo_reverse.GeoReverse(model_config['geo_key'], key_list=self.get_model_config()['key_list'])
+        if model_config['geo_backend'] == 'offline':
+            self.__geo_reverse = geo_reverse.OfflineGeoReverse(model_config['geo_data_file'], key_list=model_config['key_list'])
+        else:
+            self.__geo_reverse = geo_reverse.GeoReverse(model_config['geo_key'], zoom=model_config['geo_zoom'],
+                                                        key_list=model_config['key_list'],
+                                                        cell_size=model_config['geo_cell_size'])
         self.__image_cache = image_cache.ImageCache(self.__pic_dir,
                                                     model_config['follow_links'],
                                                     os.path.expanduser(model_config['db_file']),
-                                                    self.__geo_reverse,
+                                                    self.__geo_reverse if self.__load_geoloc else None,
                                                     model_config['portrait_pairs'],
-                                                    continuous_update=model_config["update_cache"])
+                                                    continuous_update=model_config["update_cache"],
+                                                    change_source_type=model_config['change_source'],
+                                                    reconcile_interval=model_config['reconcile_interval'],
+                                                    index_workers=model_config['index_workers'],
+                                                    index_pool=model_config['index_pool'],
+                                                    geo_backfill_interval=model_config['geo_backfill_interval'],
+                                                    db_pragmas=model_config['db_pragmas'])
         self.__deleted_pictures = model_config['deleted_pictures']
         self.__no_files_img = os.path.expanduser(model_config['no_files_img'])
         self.__sort_cols = model_config['sort_cols']
         self.__col_names = None
+        self.__id_array = None # query result kept for reshuffling, see playlist.make_id_array
+        self.__id_array_key = None # (where clause, image cache change count) it was made with
+        self.__sampler = None # for selection 'weighted', kept between playlists so the weights don't need querying again
+        self.__sampler_key = None # as __id_array_key
+        self.__sampled = False # __playlist was picked by __sampler
+        # the playlist is also saved next to the db so the next run can start showing it straight away
+        self.__playlist_file = os.path.splitext(os.path.expanduser(model_config['db_file']))[0] + '_playlist.npz'
+        self.__playlist_signature = None # FileSelector.get_signature() of the selection __playlist was made with
+        self.__playlist_generation = 0 # goes up each time __playlist is made again
+        self.__playlist_resume_checked = False
+        self.__reconciled_playlist = None # (generation, change count, kept playlist, new ids) from the reconcile thread
+        self.__next_splice_save_tm = 0.0
+        self.__change_count = None # ImageCache.change_count __playlist is up to date with, None if not kept up to date
+        self.__save_lock = threading.Lock()
         self.__where_clauses = {} # these will be modified by controller
         self.__logger.info("Completed initialization")
 
@@ -263,12 +315,18 @@ class Model:
     def get_where_clauses(self):
         return self.__where_clauses
 
+    def get_text_where_clause(self, field, phrase):
+        return self.__image_cache.get_text_where_clause(field, phrase)
+
     def pause_looping(self, val):
         self.__image_cache.pause_looping(val)
 
     def purge_files(self):
         self.__image_cache.purge_files()
 
+    def get_geo_backfill_progress(self):
+        return self.__image_cache.get_geo_backfill_progress()
+
     def get_directory_list(self):
         _, root = os.path.split(self.__pic_dir)
         actual_dir = root
@@ -285,8 +343,13 @@ class Model:
     def force_reload(self):
         self.__reload_files = True
 
+    def stop(self):
+        # save where the playlist has got to then let the image cache write anything it has queued
+        self.__save_playlist(background=False)
+        self.__image_cache.stop()
+
     def set_next_file_to_previous_file(self):
-        self.__file_index = (self.__file_index - 2) % self.__number_of_files # TODO deleting last image results in ZeroDivisionError
+        self.__file_index = self.__playlist.step_back(self.__file_index, 2)
 
     def get_next_file(self):
         missing_images = 0
@@ -296,19 +359,29 @@ class Model:
             pic1 = None
             pic2 = None
 
+            # Swap in the saved playlist once it has been brought up to date with the db
+            if self.__reconciled_playlist is not None:
+                self.__swap_reconciled_playlist()
+
+            # Add files indexed since the playlist was made and take out ones deleted from the db
+            if (not self.__reload_files and self.__change_count is not None
+                    and self.__change_count != self.__image_cache.change_count):
+                self.__splice_changes()
+
             # Reload the playlist if requested
             if self.__reload_files:
                 self.__image_cache.start()
-                for _ in range(5): # give image_cache chance on first load if a large directory
-                    self.__get_files()
-                    missing_images = 0
-                    if self.__number_of_files > 0:
-                        break
-                    time.sleep(0.5)
+                missing_images = 0
+                if not self.__resume_playlist():
+                    for _ in range(5): # give image_cache chance on first load if a large directory
+                        self.__get_files()
+                        if self.__playlist.slot_count > 0:
+                            break
+                        time.sleep(0.5)
 
             # If we don't have any files to show, prepare the "no images" image
             # Also, set the reload_files flag so we'll check for new files on the next pass...
-            if self.__number_of_files == 0 or missing_images >= self.__number_of_files:
+            if self.__playlist.slot_count == 0 or missing_images >= self.__playlist.slot_count:
                 pic1 = Pic(self.__no_files_img, 0, 0)
                 self.__reload_files = True
                 break
@@ -316,20 +389,26 @@ class Model:
             # If we've displayed all images...
             #   If it's time to shuffle, set a flag to do so
             #   Loop back, which will reload and shuffle if necessary
-            if self.__file_index == self.__number_of_files:
+            if self.__file_index >= len(self.__playlist):
                 self.__num_run_through += 1
-                if self.shuffle and self.__num_run_through >= self.get_model_config()['reshuffle_num']:
+                if self.__sampled or (self.shuffle and self.__num_run_through >= self.get_model_config()['reshuffle_num']):
                     self.__reload_files = True
                 self.__file_index = 0
                 continue
 
-            # Load the current image set
-            file_ids = self.__file_list[self.__file_index]
+            # Load the current image set, skipping any deleted since the playlist was loaded
+            file_ids = self.__playlist[self.__file_index]
+            if file_ids is None:
+                self.__file_index += 1
+                continue
             pic_row = self.__image_cache.get_file_info(file_ids[0])
             pic1 = Pic(**pic_row) if pic_row is not None else None
             if len(file_ids) == 2:
                 pic_row = self.__image_cache.get_file_info(file_ids[1])
                 pic2 = Pic(**pic_row) if pic_row is not None else None
+            if self.__sampled:
+                for file_id in file_ids:
+                    self.__sampler.displayed(file_id)
 
             # Verify the images in the selected image set actually exist on disk
             # Blank out missing references and swap positions if necessary to try and get
@@ -340,6 +419,7 @@ class Model:
 
             # Increment the image index for next time
             self.__file_index += 1
+            self.__image_cache.set_setting('playlist_index', self.__file_index)
 
             # If pic1 is valid here, everything is OK. Break out of the loop and return the set
             if pic1:
@@ -352,14 +432,32 @@ class Model:
         self.__current_pics = (pic1, pic2)
         return self.__current_pics
 
+    def peek_next_files(self, count):
+        # returns up to count of the pics tuples that get_next_file will return next, without
+        # moving on the index. Used by the viewer to prepare images in advance.
+        pics_list = []
+        if self.__reload_files:
+            return pics_list # the playlist is about to change
+        index = self.__file_index
+        while len(pics_list) < count and index < len(self.__playlist):
+            file_ids = self.__playlist[index]
+            index += 1
+            if file_ids is None:
+                continue
+            pics = [None, None]
+            for i, file_id in enumerate(file_ids):
+                pic_row = self.__image_cache.get_file_info(file_id, displayed=False)
+                pics[i] = Pic(**pic_row) if pic_row is not None else None
+            if pics[0] is None and pics[1] is not None: # as get_next_file does
+                pics.reverse()
+            if pics[0] is not None:
+                pics_list.append(tuple(pics))
+        return pics_list
+
     def get_number_of_files(self):
-        #return self.__number_of_files
-        #return sum(1 for pics in self.__file_list for pic in pics if pic is not None)
-        # or
-        return sum(
-                    sum(1 for pic in pics if pic is not None)
-                        for pics in self.__file_list
-                )
+        if self.__sampled:
+            return len(self.__sampler) # the playlist is only the next few picked
+        return self.__playlist.pic_count
 
     def get_current_pics(self):
         return self.__current_pics
@@ -375,12 +473,17 @@ class Model:
         if not os.path.exists(move_to_dir):
           os.system("mkdir {}".format(move_to_dir)) # problems with ownership using python func
         os.system("mv '{}' '{}'".format(f_to_delete, move_to_dir)) # and with SMB drives
-        # find and delete record from __file_list
-        for i, file_rec in enumerate(self.__file_list):
-            if file_rec[0] == pic.file_id: # database id TODO check that db tidies itself up
-                self.__file_list.pop(i)
-                self.__number_of_files -= 1
-                break
+        # remove from the playlist, database id TODO check that db tidies itself up
+        self.__playlist.remove(pic.file_id)
+        self.__save_playlist()
+
+    def get_column_names(self):
+        if self.__col_names is None:
+            self.__col_names = self.__image_cache.get_column_names() # do this once
+        return self.__col_names
+
+    def get_sort_cols(self):
+        return self.__sort_cols
 
     def get_picture_dir(self):
         if self.subdirectory != "":
@@ -395,36 +498,252 @@ class Model:
         self.__logger.info(f"Using file selector: {file_selector.__class__.__name__}")
 
         where_clause = file_selector.get_where_clause()
-        sort_clause = file_selector.get_sort_clause()
-        
-        self.__file_list = self.__image_cache.query_cache(where_clause, sort_clause)
-        self.__number_of_files = len(self.__file_list)
         self.__file_index = 0
+        change_count = self.__image_cache.change_count # before the query so no change is missed
+        self.__sampled = file_selector.sample_count > 0
+        if self.__sampled:
+            # the next few picked by weight, the sampler's weights are kept up to date as they're shown
+            sampler_key = (where_clause, self.__image_cache.change_count)
+            if self.__sampler is None or self.__sampler_key != sampler_key or len(self.__sampler) == 0:
+                model_config = self.get_model_config()
+                self.__sampler = sampler.WeightedSampler(self.__image_cache.query_display_stats(where_clause),
+                                                         stale_time=model_config['weighted_stale_time'],
+                                                         rating_weight=model_config['weighted_rating'],
+                                                         count_power=model_config['weighted_count'])
+                self.__sampler_key = sampler_key
+            self.__playlist = self.__make_playlist(*self.__sampler.sample(file_selector.sample_count))
+        elif self.shuffle:
+            # shuffled here rather than by ORDER BY RANDOM() which makes sqlite sort the whole all_data join
+            # only query again if the selection or the files in the db have changed
+            id_array_key = (where_clause, self.__image_cache.change_count)
+            if self.__id_array is None or self.__id_array_key != id_array_key or len(self.__id_array) == 0:
+                self.__id_array = playlist.make_id_array(self.__image_cache.query_ids(where_clause))
+                self.__id_array_key = id_array_key
+            # a new order each time, a restart carries on through the saved playlist instead (see __resume_playlist)
+            self.__playlist = self.__shuffled_playlist(self.__id_array, random.getrandbits(32), file_selector.get_recent_tm())
+        else:
+            sort_clause = file_selector.get_sort_clause()
+            self.__playlist = playlist.Playlist(self.__image_cache.query_cache(where_clause, sort_clause))
+        self.__num_run_through = 0
+        self.__reload_files = False
+        self.__playlist_signature = file_selector.get_signature()
+        self.__playlist_generation += 1
+        self.__change_count = None if self.__sampled else change_count # the sampler is made again instead
+        if self.__playlist.slot_count > 0:
+            self.__save_playlist()
+
+    def __splice_changes(self):
+        # put files added to the db into the playlist without starting it again. Shuffled, the ones
+        # modified in the last recent_n days go next and the others at random places still to come.
+        # Sorted, each goes in at its place in the order
+        changes = self.__image_cache.get_changes(self.__change_count)
+        if changes is None:
+            self.__reload_files = True # too far behind the change feed
+            return
+        self.__change_count, inserted, deleted = changes
+        for file_id in deleted:
+            self.__playlist.remove(file_id)
+        deleted = set(deleted)
+        inserted = [file_id for file_id in inserted if file_id not in deleted and self.__playlist.index_of(file_id) is None]
+        if inserted:
+            file_selector = FileSelectorFactory.get(self)
+            where_clause = "({}) AND file_id IN ({})".format(file_selector.get_where_clause(),
+                                                             ",".join(str(file_id) for file_id in inserted))
+            if self.shuffle:
+                id_array = playlist.make_id_array(self.__image_cache.query_ids(where_clause))
+                recent_tm = file_selector.get_recent_tm()
+                new_ids = self.__shuffled_playlist(id_array, random.getrandbits(32), recent_tm).get_ids()
+                # the slots with recent files are first, as shuffle_ids puts them first
+                recent_ids = id_array[id_array[:, 2] > recent_tm, 0] if recent_tm is not None else []
+                recent_count = int(np.count_nonzero(np.isin(new_ids, recent_ids).any(axis=1)))
+                positions = np.concatenate((np.full(recent_count, self.__file_index),
+                                            np.sort(np.random.randint(self.__file_index, len(self.__playlist) + 1,
+                                                                      len(new_ids) - recent_count))))
+                self.__playlist.insert(positions, new_ids)
+                self.__logger.info("Spliced %d new pictures into the playlist", len(id_array))
+            else:
+                # rather than querying and making the whole playlist again for each batch indexed
+                sort_clause = file_selector.get_sort_clause()
+                new_ids = playlist.Playlist(self.__image_cache.query_cache(where_clause, sort_clause)).get_ids()
+                positions = self.__sorted_positions(new_ids, sort_clause)
+                self.__file_index += int(np.count_nonzero(positions < self.__file_index))
+                self.__playlist.insert(positions, new_ids)
+                self.__logger.info("Spliced %d new pictures into the playlist", len(new_ids))
+        if inserted or deleted:
+            # the saved copy is brought up to date at the next start anyway, so while files are
+            # being indexed it's only written now and then
+            if time.time() >= self.__next_splice_save_tm:
+                self.__save_playlist()
+                self.__next_splice_save_tm = time.time() + Model.SPLICE_SAVE_INTERVAL
+            else:
+                self.__image_cache.set_setting('playlist_token', None) # playlist_index doesn't fit the saved copy now
+
+    def __sorted_positions(self, new_ids, sort_clause):
+        # slot each of new_ids, in sorted order, goes before. A binary search of the slots that haven't
+        # been removed, only the files compared with have their sort columns fetched
+        ids = self.__playlist.get_ids()
+        first_ids = np.where(ids[:, 0] != 0, ids[:, 0], ids[:, 1])
+        live = np.flatnonzero(first_ids)
+        keys = self.__image_cache.query_sort_keys(new_ids[:, 0].tolist(), sort_clause)
+
+        def key_of(file_id):
+            if file_id not in keys:
+                keys.update(self.__image_cache.query_sort_keys([file_id], sort_clause))
+            return keys.get(file_id) # None if it's not in the db any more
+
+        positions = np.full(len(new_ids), len(ids), dtype=np.int64)
+        low = 0 # the new ids are in order so each goes after the one before
+        for n, file_id in enumerate(new_ids[:, 0].tolist()):
+            new_key = key_of(file_id)
+            if new_key is None:
+                continue # at the end
+            high = len(live)
+            while low < high:
+                middle = (low + high) // 2
+                key = key_of(int(first_ids[live[middle]]))
+                if key is not None and new_key < key:
+                    high = middle
+                else:
+                    low = middle + 1
+            if low < len(live):
+                positions[n] = live[low]
+        return positions
+
+    def __swap_playlist(self, new_playlist):
+        # carry on from the current picture's place in new_playlist or the same index if it's not there
+        index = None
+        if self.__current_pics[0] is not None:
+            index = new_playlist.index_of(self.__current_pics[0].file_id)
+        self.__file_index = index + 1 if index is not None else min(self.__file_index, len(new_playlist))
+        self.__playlist = new_playlist
+
+    def __shuffled_playlist(self, id_array, seed, recent_tm):
+        return self.__make_playlist(*playlist.shuffle_ids(id_array, seed, recent_tm))
+
+    def __make_playlist(self, file_ids, is_portrait):
+        if self.get_model_config()['portrait_pairs']:
+            return playlist.Playlist(image_cache.pair_portraits(list(zip(file_ids.tolist(), is_portrait.tolist()))))
+        return playlist.Playlist.from_ids(file_ids)
+
+    def __save_playlist(self, background=True):
+        # written by another thread as it can be several MB for a big library, the token ties
+        # the playlist_index setting, which is saved for each slide, to this copy of the playlist
+        if self.__playlist_signature is None or self.__playlist.slot_count == 0 or self.__sampled:
+            return # nothing to save or a sampled playlist, which is short and picked again at the end
+        # a copy of the ids as remove() and splicing change the playlist while it's being written
+        args = (self.__playlist.get_ids(), self.__file_index, self.__playlist_signature)
+        if background:
+            threading.Thread(target=self.__write_playlist, args=args, daemon=True).start()
+        else:
+            self.__write_playlist(*args)
+
+    def __write_playlist(self, ids, index, signature):
+        with self.__save_lock:
+            token = "{:.6f}".format(time.time())
+            try:
+                playlist.Playlist.from_ids(ids).save(self.__playlist_file, index=index, signature=signature, token=token)
+                self.__image_cache.set_setting('playlist_token', token)
+            except OSError as e:
+                self.__logger.warning("Can't save playlist to %s: %s", self.__playlist_file, e)
+
+    def __resume_playlist(self):
+        # on the first load use the playlist saved by the last run, if it was made with the same
+        # selection, rather than waiting for the query. It's brought up to date with the db by
+        # another thread once the image cache has been through the files on disk
+        if self.__playlist_resume_checked:
+            return False
+        self.__playlist_resume_checked = True
+        try:
+            saved_playlist, info = playlist.Playlist.load(self.__playlist_file)
+        except (OSError, KeyError, ValueError) as e:
+            self.__logger.info("No saved playlist to resume: %s", e)
+            return False
+        file_selector = FileSelectorFactory.get(self)
+        signature = file_selector.get_signature()
+        if file_selector.sample_count > 0:
+            return False
+        if info.get('signature') != signature or saved_playlist.slot_count == 0:
+            self.__logger.info("Saved playlist was made with a different selection")
+            return False
+        index = info.get('index', 0)
+        if self.__image_cache.get_setting('playlist_token') == info.get('token'):
+            index = self.__image_cache.get_setting('playlist_index', index) # shown more since it was saved
+        self.__playlist = saved_playlist
+        self.__file_index = min(index, len(saved_playlist))
+        self.__playlist_signature = signature
+        self.__playlist_generation += 1
+        self.__change_count = None # until it's reconciled
         self.__num_run_through = 0
         self.__reload_files = False
+        self.__logger.info("Resumed saved playlist of %d pictures at %d", saved_playlist.pic_count, self.__file_index)
+        where_clause = file_selector.get_where_clause()
+        sort_clause = None if self.shuffle else file_selector.get_sort_clause()
+        threading.Thread(target=self.__reconcile_playlist, daemon=True,
+                         args=(saved_playlist.get_ids(), self.__playlist_generation, where_clause,
+                               sort_clause, file_selector.get_recent_tm())).start()
+        return True
+
+    def __reconcile_playlist(self, saved_ids, generation, where_clause, sort_clause, recent_tm):
+        # wait for the image cache to pick up files added or removed while picframe wasn't running
+        while self.__image_cache.pass_count == 0:
+            time.sleep(1.0)
+        change_count = self.__image_cache.change_count
+        if sort_clause is not None:
+            kept_playlist = playlist.Playlist(self.__image_cache.query_cache(where_clause, sort_clause))
+            new_ids = np.zeros((0, 2), dtype=np.int64)
+        else:
+            # keep the saved order for the files still selected, new files are shuffled in
+            # after the current one when the playlist is swapped
+            id_array = playlist.make_id_array(self.__image_cache.query_ids(where_clause))
+            saved_ids[~np.isin(saved_ids, id_array[:, 0])] = 0
+            kept_playlist = playlist.Playlist.from_ids(saved_ids[saved_ids.any(axis=1)])
+            is_new = ~np.isin(id_array[:, 0], saved_ids)
+            new_ids = self.__shuffled_playlist(id_array[is_new], random.getrandbits(32), recent_tm).get_ids()
+        self.__logger.info("Saved playlist reconciled, %d pictures kept, %d new", kept_playlist.pic_count, len(new_ids))
+        self.__reconciled_playlist = (generation, change_count, kept_playlist, new_ids)
+
+    def __swap_reconciled_playlist(self):
+        generation, change_count, kept_playlist, new_ids = self.__reconciled_playlist
+        self.__reconciled_playlist = None
+        if generation != self.__playlist_generation:
+            return # the playlist has been made again since
+        self.__swap_playlist(kept_playlist)
+        self.__playlist.insert(np.full(len(new_ids), self.__file_index), new_ids)
+        self.__change_count = change_count
+        self.__save_playlist()
 
 
 class FileSelector(abc.ABC):
+    sample_count = 0 # pictures in each playlist if picked by WeightedSampler, 0 for all the selected pictures
+
     def __init__(self, model: Model) -> None:
         self.model = model
         super().__init__()
 
     def get_where_clause(self) -> str:
-        where_list = [f"fname LIKE '{self.model.get_picture_dir()}/%'"]
+        where_list = [image_cache.ImageCache.get_folder_where_clause(self.model.get_picture_dir())]
         where_list.extend(self._get_where_list())
         return " AND ".join(where_list) if len(where_list) > 0 else "1"
 
 
-    def get_sort_clause(self) -> str:
-        sort_list = []
+    def get_recent_tm(self):
+        # files modified after this are played first
         recent_n = self.model.get_model_config()["recent_n"]
-        if recent_n > 0:
-            sort_list.append("last_modified > {:.0f}".format(time.time() - 3600 * 24 * recent_n))
+        return time.time() - 3600 * 24 * recent_n if recent_n > 0 else None
 
-        if self.model.shuffle:
-            sort_list.append("RANDOM()")
-        else:
-            sort_list.extend(self._get_sort_list())
+    def get_signature(self) -> str:
+        # everything apart from the files in the db that the playlist depends on, so a saved one can be checked
+        model_config = self.model.get_model_config()
+        return repr((self.get_where_clause(), self.model.shuffle, model_config['portrait_pairs'], model_config['recent_n'],
+                     [] if self.model.shuffle else self._get_sort_list()))
+
+    def get_sort_clause(self) -> str:
+        # used when not shuffling, Model shuffles in memory using get_recent_tm()
+        sort_list = []
+        recent_tm = self.get_recent_tm()
+        if recent_tm is not None:
+            sort_list.append("last_modified > {:.0f} DESC".format(recent_tm)) # recent files first, as when shuffled
+        sort_list.extend(self._get_sort_list())
 
         return ",".join(sort_list)
 
@@ -450,11 +769,10 @@ class DefaultFileSelector(FileSelector):
     def _get_sort_list(self) -> str:
         sort_list = []
 
-        if self.model.__col_names is None:
-            self.model.__col_names = self.model.__image_cache.get_column_names() # do this once
-        for col in self.model.__sort_cols.split(","):
+        col_names = self.model.get_column_names()
+        for col in self.model.get_sort_cols().split(","):
             colsplit = col.split()
-            if colsplit[0] in self.model.__col_names and (len(colsplit) == 1 or colsplit[1].upper() in ("ASC", "DESC")):
+            if colsplit[0] in col_names and (len(colsplit) == 1 or colsplit[1].upper() in ("ASC", "DESC")):
                 sort_list.append(col)
         sort_list.append("fname ASC") # always finally sort on this in case nothing else to sort on or sort_cols is ""
         
@@ -467,14 +785,45 @@ class SameMonthFileSelector(FileSelector):
         self.month = datetime.now().month
 
     def _get_where_list(self) -> str:
-        return [f"STRFTIME('%m', DATETIME(exif_datetime, 'unixepoch')) = '{self.month:02}'"]
+        return [f"month = {self.month}"]
 
     
     def _get_sort_list(self) -> str:
-        return [""]
+        return ["exif_datetime ASC", "fname ASC"]
+
+
+class OnThisDayFileSelector(FileSelector):
+    # pictures taken within on_this_day days of today's date in any year
+    def __init__(self, model: Model) -> None:
+        super().__init__(model)
+        today = datetime.now()
+        self.day = image_cache.calendar_day(today.month, today.day)
+        self.days = model.get_model_config()['on_this_day']
+
+    def _get_where_list(self) -> str:
+        return [image_cache.ImageCache.get_calendar_where_clause(self.day, self.days)]
+
+    def _get_sort_list(self) -> str:
+        return ["exif_datetime ASC", "fname ASC"]
+
+
+class WeightedFileSelector(DefaultFileSelector):
+    # the same pictures as DefaultFileSelector but picked a few at a time, favouring the ones not shown for
+    # a while, shown less often or rated higher, see sampler.WeightedSampler
+    sample_count = 20
+
+    def _get_sort_list(self) -> str:
+        return [] # not sorted
+
 
 class FileSelectorFactory:
     def get(model: Model) -> FileSelector:
+        if model.get_model_config()['selection'] == 'weighted':
+            return WeightedFileSelector(model)
+
+        if model.get_model_config()['on_this_day'] >= 0:
+            return OnThisDayFileSelector(model)
+
         # On the first week of the month, use files from the same month
         if model.same_month_photos or datetime.now().day < 8:
             return SameMonthFileSelector(model)
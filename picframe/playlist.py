@@ -0,0 +1,145 @@
+import os
+import numpy as np
+
+
+class Playlist:
+    """The file ids to show, in order. Each slot holds one id or two for a portrait pair.
+
+    The ids are held in an (n, 2) numpy array with 0 in the second column where there is
+    no pair, rather than a list of tuples, which takes about a third of the memory. Removing
+    an id zeroes it in place so positions don't move. Ids are found through a sorted copy of
+    the ids with their positions, which is also compact, and the number of slots and
+    pictures left are kept up to date as ids are removed.
+    """
+
+    def __init__(self, rows=()):
+        # rows as returned by ImageCache.query_cache, i.e. [(id1,), (id2, id3), ...]
+        n = len(rows)
+        self.__ids = np.zeros((n, 2), dtype=np.int64) # file_id is an sqlite rowid so never 0
+        if n > 0:
+            self.__ids[:, 0] = np.fromiter((row[0] for row in rows), dtype=np.int64, count=n)
+            self.__ids[:, 1] = np.fromiter((row[1] if len(row) > 1 else 0 for row in rows), dtype=np.int64, count=n)
+        self.__make_index()
+
+    @classmethod
+    def from_ids(cls, file_ids):
+        # from an array of ids, one picture per slot, or an (n, 2) array as returned by get_ids()
+        # so there is no need to make a tuple for each
+        playlist = cls()
+        file_ids = np.asarray(file_ids, dtype=np.int64)
+        if file_ids.ndim == 2:
+            playlist.__ids = file_ids.reshape(-1, 2).copy()
+        else:
+            playlist.__ids = np.zeros((len(file_ids), 2), dtype=np.int64)
+            playlist.__ids[:, 0] = file_ids
+        playlist.__make_index()
+        return playlist
+
+    def __make_index(self):
+        flat_ids = self.__ids.ravel()
+        order = np.argsort(flat_ids, kind='stable')
+        order = order[flat_ids[order] != 0]
+        self.__sorted_ids = flat_ids[order]
+        self.__sorted_positions = order # position in the flattened array, i.e. slot * 2 + column
+        self.__slot_count = int(np.count_nonzero(self.__ids.any(axis=1)))
+        self.__pic_count = len(order)
+
+    def get_ids(self):
+        # copy of the (n, 2) array of ids, 0 where removed or no pair
+        return self.__ids.copy()
+
+    def save(self, file_name, **info):
+        """Write the ids and any info (numbers or strings) to file_name, via a temporary file
+        so there is never a half written snapshot"""
+        tmp_name = file_name + '.tmp'
+        with open(tmp_name, 'wb') as f:
+            np.savez(f, ids=self.__ids, **info)
+        os.replace(tmp_name, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        """Returns the playlist and a dict of the info saved with it. Raises OSError if
+        the file can't be read and KeyError or ValueError if it isn't a playlist"""
+        with np.load(file_name, allow_pickle=False) as data:
+            info = {key: data[key].item() for key in data.files if key != 'ids'}
+            return cls.from_ids(data['ids']), info
+
+    def __len__(self):
+        # number of positions including any emptied by remove(), so it's the range of valid indices
+        return len(self.__ids)
+
+    def __getitem__(self, index):
+        # tuple of the ids at index or None if they have all been removed
+        first, second = self.__ids[index]
+        ids = tuple(int(file_id) for file_id in (first, second) if file_id != 0)
+        return ids if ids else None
+
+    @property
+    def slot_count(self):
+        return self.__slot_count
+
+    @property
+    def pic_count(self):
+        return self.__pic_count
+
+    def index_of(self, file_id):
+        # slot holding file_id or None
+        flat_ids = self.__ids.ravel()
+        i = np.searchsorted(self.__sorted_ids, file_id)
+        while i < len(self.__sorted_ids) and self.__sorted_ids[i] == file_id:
+            position = self.__sorted_positions[i]
+            if flat_ids[position] == file_id: # not removed
+                return int(position) // 2
+            i += 1
+        return None
+
+    def remove(self, file_id):
+        index = self.index_of(file_id)
+        if index is None:
+            return False
+        row = self.__ids[index]
+        row[row == file_id] = 0
+        self.__pic_count -= 1
+        if not row.any():
+            self.__slot_count -= 1
+        return True
+
+    def insert(self, positions, file_ids):
+        """Put the slots of file_ids, an (n, 2) array as from get_ids(), before the slots at positions
+        (np.insert). Slots after them move along so indices from before are only good up to the
+        first position"""
+        self.__ids = np.insert(self.__ids, np.asarray(positions, dtype=np.int64), np.asarray(file_ids, dtype=np.int64), axis=0)
+        self.__make_index()
+
+    def step_back(self, index, count):
+        # index of the slot count places before index counting only slots that haven't been
+        # removed, wrapping round at the start
+        n = len(self.__ids)
+        if self.__slot_count == 0:
+            return 0
+        while count > 0:
+            index = (index - 1) % n
+            if self.__ids[index].any():
+                count -= 1
+        return index
+
+
+def make_id_array(rows):
+    """rows of (file_id, is_portrait, last_modified) as returned by ImageCache.query_ids.
+    Returns an (n, 3) array of them in file_id order, compact enough to keep for reshuffling"""
+    id_array = np.array(rows, dtype=np.float64).reshape(-1, 3) # file ids are exact as floats up to 2**53
+    return id_array[np.argsort(id_array[:, 0], kind='stable')]
+
+
+def shuffle_ids(id_array, seed, recent_tm=None):
+    """Returns arrays of file_id and is_portrait from id_array (see make_id_array) in an
+    order fixed by seed. Files modified after recent_tm come first then the rest, each part
+    shuffled (numpy's shuffle is Fisher-Yates)"""
+    rng = np.random.default_rng(seed)
+    is_recent = id_array[:, 2] > (recent_tm if recent_tm is not None else np.inf)
+    parts = []
+    for part in (np.flatnonzero(is_recent), np.flatnonzero(~is_recent)):
+        rng.shuffle(part)
+        parts.append(part)
+    order = np.concatenate(parts)
+    return id_array[order, 0].astype(np.int64), id_array[order, 1].astype(np.int64)
@@ -0,0 +1,107 @@
+import os
+import hashlib
+import logging
+import threading
+from PIL import Image
+
+RAW_HEADER = "{} {} {}\n" # mode width height
+
+
+class RenderCache:
+    """On-disk cache of fully prepared (decoded, orientated, matted, blurred) images at
+    display size, so a photo coming round again only needs to be read back.
+
+    RGB images are stored as low compression jpegs, anything with an alpha channel as raw
+    bytes. When the total size goes over max_size the least recently used files are removed.
+    """
+
+    def __init__(self, cache_dir, max_size, jpeg_quality=90):
+        self.__logger = logging.getLogger("render_cache.RenderCache")
+        self.__cache_dir = os.path.expanduser(cache_dir)
+        self.__max_size = max_size # bytes
+        self.__jpeg_quality = jpeg_quality
+        self.__lock = threading.Lock()
+        self.__entries = {} # file name -> (size, last used) kept in sync with the folder
+        self.__total_size = 0
+        os.makedirs(self.__cache_dir, exist_ok=True)
+        for entry in os.scandir(self.__cache_dir):
+            if entry.name.endswith('.tmp'): # left over from a crash while writing
+                os.remove(entry.path)
+            elif entry.is_file():
+                stat = entry.stat()
+                self.__entries[entry.name] = (stat.st_size, stat.st_mtime)
+                self.__total_size += stat.st_size
+        self.__evict()
+
+    @staticmethod
+    def make_key(*parts):
+        # anything that changes the prepared image (file id, modified time, display size, settings)
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def get(self, key):
+        for name in (key + '.jpg', key + '.raw'):
+            with self.__lock:
+                if name not in self.__entries:
+                    continue
+            path = os.path.join(self.__cache_dir, name)
+            try:
+                if name.endswith('.jpg'):
+                    image = Image.open(path)
+                    image.load()
+                else:
+                    with open(path, 'rb') as fh:
+                        mode, width, height = fh.readline().decode().split()
+                        image = Image.frombytes(mode, (int(width), int(height)), fh.read())
+                os.utime(path) # mtime is used as the last used time, survives restarts
+            except Exception as e:
+                self.__logger.warning("Can't read cached image %s -> %s", name, e)
+                self.__remove(name)
+                return None
+            with self.__lock:
+                if name in self.__entries:
+                    self.__entries[name] = (self.__entries[name][0], os.path.getmtime(path))
+            return image
+        return None
+
+    def put(self, key, image):
+        name = key + ('.jpg' if image.mode == 'RGB' else '.raw')
+        path = os.path.join(self.__cache_dir, name)
+        tmp_path = path + '.tmp'
+        try:
+            if image.mode == 'RGB':
+                image.save(tmp_path, 'JPEG', quality=self.__jpeg_quality, subsampling=0)
+            else:
+                with open(tmp_path, 'wb') as fh:
+                    fh.write(RAW_HEADER.format(image.mode, image.width, image.height).encode())
+                    fh.write(image.tobytes())
+            os.replace(tmp_path, path) # so a half written file is never read
+        except Exception as e:
+            self.__logger.warning("Can't write cached image %s -> %s", name, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self.__lock:
+            self.__total_size -= self.__entries.get(name, (0, 0))[0]
+            stat = os.stat(path)
+            self.__entries[name] = (stat.st_size, stat.st_mtime)
+            self.__total_size += stat.st_size
+        self.__evict()
+
+    def __remove(self, name):
+        with self.__lock:
+            size, _ = self.__entries.pop(name, (0, 0))
+            self.__total_size -= size
+        try:
+            os.remove(os.path.join(self.__cache_dir, name))
+        except OSError:
+            pass
+
+    def __evict(self):
+        with self.__lock:
+            if self.__total_size <= self.__max_size:
+                return
+            by_age = sorted(self.__entries.items(), key=lambda item: item[1][1])
+        for name, _ in by_age:
+            self.__remove(name)
+            if self.__total_size <= self.__max_size:
+                break
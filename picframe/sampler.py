@@ -0,0 +1,158 @@
+import time
+from collections import deque
+import numpy as np
+
+
+class FenwickTree:
+    """Prefix sums of an array of weights with O(log n) update and search, so an index can be
+    picked with probability proportional to its weight and weights changed without rebuilding"""
+
+    def __init__(self, weights):
+        self.__weights = np.array(weights, dtype=np.float64)
+        n = len(self.__weights)
+        # tree[i] is the sum of weights[i - lowbit(i):i], made from the cumulative sum rather than n updates
+        cum_sum = np.concatenate(([0.0], np.cumsum(self.__weights)))
+        i = np.arange(1, n + 1)
+        self.__tree = np.zeros(n + 1, dtype=np.float64)
+        self.__tree[1:] = cum_sum[i] - cum_sum[i - (i & -i)]
+        self.__top_bit = 1 << (n.bit_length() - 1) if n > 0 else 0
+
+    def __len__(self):
+        return len(self.__weights)
+
+    def __getitem__(self, index):
+        return float(self.__weights[index])
+
+    @property
+    def total(self):
+        total = 0.0
+        i = len(self.__weights)
+        while i > 0:
+            total += self.__tree[i]
+            i &= i - 1
+        return float(total)
+
+    def update(self, index, weight):
+        delta = weight - self.__weights[index]
+        if delta == 0.0:
+            return
+        self.__weights[index] = weight
+        i = index + 1
+        n = len(self.__weights)
+        while i <= n:
+            self.__tree[i] += delta
+            i += i & -i
+
+    def find(self, value):
+        # index whose span of the running total contains value, 0 <= value < total
+        position = 0
+        bit = self.__top_bit
+        n = len(self.__weights)
+        while bit > 0:
+            next_position = position + bit
+            if next_position <= n and self.__tree[next_position] <= value:
+                position = next_position
+                value -= self.__tree[next_position]
+            bit >>= 1
+        return min(position, n - 1)
+
+
+class WeightedSampler:
+    """Picks file ids at random weighted by how long since each was shown, how often it has been
+    shown and its rating. The weight of a file is
+
+        staleness * (1 + rating_weight * rating) / (1 + displayed_count) ** count_power
+
+    where staleness goes from 0 just after the file is picked back up to 1 over stale_time, in
+    STALE_STEPS steps so only the files picked within stale_time are updated, and only when they
+    go up a step. Weights are kept in a FenwickTree so each pick and each change is O(log n)
+    """
+    STALE_STEPS = 8
+
+    def __init__(self, rows, stale_time=604800.0, rating_weight=0.5, count_power=0.5, now=None, seed=None):
+        # rows of (file_id, is_portrait, displayed_count, last_displayed, rating) as returned by
+        # ImageCache.query_display_stats
+        now = time.time() if now is None else now
+        data = np.array(rows, dtype=np.float64).reshape(-1, 5)
+        data = data[np.argsort(data[:, 0], kind='stable')]
+        self.__file_ids = data[:, 0].astype(np.int64)
+        self.__is_portrait = data[:, 1].astype(np.int64)
+        self.__counts = data[:, 2].copy()
+        self.__last = data[:, 3].copy() # last time shown or picked
+        self.__rating_factor = 1.0 + rating_weight * np.nan_to_num(data[:, 4]) # NULL rating is nan
+        self.__stale_time = stale_time
+        self.__count_power = count_power
+        self.__levels = self.__stale_level(now - self.__last)
+        base = self.__rating_factor / (1.0 + self.__counts) ** count_power
+        self.__tree = FenwickTree(self.__levels / WeightedSampler.STALE_STEPS * base)
+        # (index, pick number) of files still coming back to full weight, oldest first. A file picked again
+        # is appended again rather than removed (O(n) in a deque), its older entry no longer matches
+        # __pick_numbers so is skipped and dropped lazily
+        self.__picks = 0
+        self.__pick_numbers = np.zeros(len(self.__file_ids), dtype=np.int64)
+        recent = np.flatnonzero(self.__levels < WeightedSampler.STALE_STEPS)
+        self.__recent = deque((index, 0) for index in recent[np.argsort(self.__last[recent], kind='stable')].tolist())
+        self.__rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return len(self.__file_ids)
+
+    def __stale_level(self, age):
+        if self.__stale_time <= 0:
+            return np.full(np.shape(age), WeightedSampler.STALE_STEPS, dtype=np.int64)
+        levels = np.floor(np.asarray(age) / self.__stale_time * WeightedSampler.STALE_STEPS)
+        return np.clip(levels, 0, WeightedSampler.STALE_STEPS).astype(np.int64)
+
+    def __weight(self, index):
+        base = self.__rating_factor[index] / (1.0 + self.__counts[index]) ** self.__count_power
+        return float(self.__levels[index]) / WeightedSampler.STALE_STEPS * base
+
+    def __refresh(self, now):
+        # move files picked within stale_time up to their current staleness step
+        if not self.__recent:
+            return
+        entries = np.array(self.__recent, dtype=np.int64).reshape(-1, 2)
+        recent = entries[self.__pick_numbers[entries[:, 0]] == entries[:, 1], 0] # the latest entry for each file
+        levels = self.__stale_level(now - self.__last[recent])
+        changed = levels != self.__levels[recent]
+        self.__levels[recent] = levels
+        for index in recent[changed].tolist():
+            self.__tree.update(index, self.__weight(index))
+        # still in order of when they were picked as they're all getting older together
+        recent = recent[levels < WeightedSampler.STALE_STEPS]
+        self.__recent = deque(zip(recent.tolist(), self.__pick_numbers[recent].tolist()))
+
+    def sample(self, count, now=None):
+        """Returns arrays of up to count file ids and their is_portrait (0, 1 or -1 if not known),
+        none repeated. Each is then at 0 weight until it starts to come back after stale_time / STALE_STEPS"""
+        now = time.time() if now is None else now
+        self.__refresh(now)
+        picked = []
+        for _ in range(min(count, len(self.__file_ids))):
+            total = self.__tree.total
+            if total > 0.0:
+                index = self.__tree.find(self.__rng.random() * total)
+                if self.__tree[index] <= 0.0: # rounding at the end of the range, the total is only approximately the sum
+                    continue
+            else:
+                # everything shown lately, so the one shown longest ago
+                while self.__recent and self.__pick_numbers[self.__recent[0][0]] != self.__recent[0][1]:
+                    self.__recent.popleft() # picked again since
+                if not self.__recent:
+                    break
+                index = self.__recent[0][0]
+            self.__picks += 1
+            self.__pick_numbers[index] = self.__picks
+            self.__recent.append((index, self.__picks))
+            self.__last[index] = now
+            self.__levels[index] = 0
+            self.__tree.update(index, 0.0)
+            picked.append(index)
+        return self.__file_ids[picked], self.__is_portrait[picked]
+
+    def displayed(self, file_id):
+        # count a display, the file's weight stays 0 until its staleness starts to rise again
+        index = np.searchsorted(self.__file_ids, file_id)
+        if index < len(self.__file_ids) and self.__file_ids[index] == file_id:
+            self.__counts[index] += 1
+            self.__tree.update(index, self.__weight(index))
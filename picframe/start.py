@@ -3,16 +3,50 @@ import logging
 import sys
 import argparse
 import os
-import ssl
 import locale
-from distutils.dir_util import copy_tree
+import time
+import importlib
+from contextlib import contextmanager
 
-from picframe import model, viewer_display, controller, interface_kbd, interface_http, __version__
+from picframe import __version__
+# the other picframe modules are imported in main() as each part is set up, so nothing heavy
+# (pi3d, numpy, PIL etc) is loaded for --version or --initialize or for parts that are turned off
 
 PICFRAME_DATA_DIR = 'picframe_data'
 DEFAULT_CONFIGFILE = f"~/{PICFRAME_DATA_DIR}/config/configuration.yaml"
 
+class StartupProfile:
+    """Times each import and setting up of the parts of picframe, reported by --profile-startup"""
+
+    def __init__(self):
+        self.__start_tm = time.perf_counter()
+        self.__steps = [] # (name, seconds, other packages loaded)
+
+    @contextmanager
+    def step(self, name):
+        modules = set(sys.modules)
+        tm = time.perf_counter()
+        try:
+            yield
+        finally:
+            packages = {module.split('.')[0] for module in set(sys.modules) - modules}
+            packages = {package for package in packages if not package.startswith('_') and package != 'picframe'
+                        and package not in getattr(sys, 'stdlib_module_names', ())} # python 3.10 on
+            self.__steps.append((name, time.perf_counter() - tm, sorted(packages)))
+
+    def import_module(self, name):
+        with self.step('import ' + name):
+            return importlib.import_module('picframe.' + name)
+
+    def report(self):
+        print("\nStartup profile ms:")
+        for name, tm, packages in self.__steps:
+            print("{:8.1f}  {:26s} {}".format(tm * 1000, name, ', '.join(packages)))
+        print("{:8.1f}  total".format((time.perf_counter() - self.__start_tm) * 1000))
+
+
 def copy_files(pkgdir, dest, target):
+    from distutils.dir_util import copy_tree # slow to import so only when needed
     try:
         fullpath = os.path.join(pkgdir,  target)
         destination = os.path.join(dest,  PICFRAME_DATA_DIR)
@@ -63,7 +97,8 @@ def create_config(root):
             file.write(filedata)
 
         with open (run_start, "w") as file: # TODO work-around for RPi4
-            file.write("from picframe import start\nstart.main()\n")
+            # guard needed as index_pool "process" workers import the main module
+            file.write("from picframe import start\nif __name__ == '__main__':\n    start.main()\n")
     except:
         raise
 
@@ -95,6 +130,8 @@ def main():
     group.add_argument("-v", "--version", help="print version information",
                         action="store_true")
     group.add_argument("configfile", nargs='?', help="/path/to/configuration.yaml", default=DEFAULT_CONFIGFILE)
+    parser.add_argument("--profile-startup", help="print the time taken to import and set up each part before the slideshow starts",
+                        action="store_true")
     args = parser.parse_args()
     if args.initialize:
         if os.geteuid() == 0:
@@ -129,34 +166,48 @@ def main():
         check_packages(['pyheif'])
         return
     else:
-        m = model.Model(datetime.now().day <= 7, args.configfile)
-
-    v = viewer_display.ViewerDisplay(m.get_viewer_config())
-    c = controller.Controller(m, v)
-    c.start()
+        profile = StartupProfile()
+        model = profile.import_module('model')
+        with profile.step('Model'):
+            m = model.Model(datetime.now().day <= 7, args.configfile)
+
+    viewer_display = profile.import_module('viewer_display')
+    with profile.step('ViewerDisplay'):
+        v = viewer_display.ViewerDisplay(m.get_viewer_config())
+    controller = profile.import_module('controller')
+    with profile.step('Controller'):
+        c = controller.Controller(m, v)
+    with profile.step('Controller.start'):
+        c.start()
 
     if m.get_model_config()['use_kbd']:
-        interface_kbd.InterfaceKbd(c) # TODO make kbd failsafe
+        interface_kbd = profile.import_module('interface_kbd')
+        with profile.step('InterfaceKbd'):
+            interface_kbd.InterfaceKbd(c) # TODO make kbd failsafe
 
     mqtt_config = m.get_mqtt_config()
     if mqtt_config['use_mqtt']:
-        if mqtt_config['type'] == 'shelly':
-            from picframe import interface_mqtt_shelly as int_mqtt
-        else:
-            from picframe import interface_mqtt as int_mqtt
-        mqtt = int_mqtt.InterfaceMQTT(c, mqtt_config)        
-        mqtt.start()
+        int_mqtt = profile.import_module('interface_mqtt_shelly' if mqtt_config['type'] == 'shelly' else 'interface_mqtt')
+        with profile.step('InterfaceMQTT'):
+            mqtt = int_mqtt.InterfaceMQTT(c, mqtt_config)
+            mqtt.start()
 
     http_config = m.get_http_config()
     model_config = m.get_model_config()
     if http_config['use_http']:
-        server = interface_http.InterfaceHttp(c, http_config['path'], model_config['pic_dir'], model_config['no_files_img'], http_config['port'])
-        if http_config['use_ssl']:
-            server.socket = ssl.wrap_socket(
-                server.socket,
-                keyfile = http_config['keyfile'],
-                certfile = http_config['certfile'],
-                server_side=True)
+        interface_http = profile.import_module('interface_http')
+        with profile.step('InterfaceHttp'):
+            server = interface_http.InterfaceHttp(c, http_config['path'], model_config['pic_dir'], model_config['no_files_img'],
+                                                  http_config['port'], http_config['image_size'])
+            if http_config['use_ssl']:
+                import ssl
+                server.socket = ssl.wrap_socket(
+                    server.socket,
+                    keyfile = http_config['keyfile'],
+                    certfile = http_config['certfile'],
+                    server_side=True)
+    if args.profile_startup:
+        profile.report()
     c.loop()
     if mqtt_config['use_mqtt']:
         mqtt.stop()
@@ -3,17 +3,14 @@ import pi3d
 #from pi3d.Texture import MAX_SIZE
 import math
 import time
-import subprocess
 import logging
 import os
 import numpy as np
+import concurrent.futures
 from PIL import Image, ImageFilter, ImageFile
-from picframe import mat_image, get_image_meta
+from picframe import get_image_meta, render_cache, display_power
 from datetime import datetime
 
-# supported display modes for display switch
-dpms_mode = ("unsupported", "pi", "x_dpms")
-
 # utility functions with no dependency on ViewerDisplay properties
 def txt_to_bit(txt):
     txt_map = {"title":1, "caption":2, "name":4, "date":8, "location":16, "folder":32}
@@ -95,50 +92,26 @@ class ViewerDisplay:
         self.__clock_justify = config['clock_justify']
         self.__clock_text_sz = config['clock_text_sz']
         self.__clock_format = config['clock_format']
+        # images for the next few slides are prepared on a worker thread, keyed by file names
+        self.__prefetch_count = int(config['prefetch_count'])
+        self.__prefetch_executor = None
+        if self.__prefetch_count > 0:
+            self.__prefetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.__prefetched = {}
+        self.__display_power = display_power.DisplayPower(config['display_power_refresh'])
+        self.__render_cache = None
+        if config['render_cache_size'] > 0:
+            self.__render_cache = render_cache.RenderCache(config['render_cache_dir'],
+                                                           config['render_cache_size'] * 1024 * 1024)
         ImageFile.LOAD_TRUNCATED_IMAGES = True # occasional damaged file hangs app
 
     @property
     def display_is_on(self):
-        try: # vcgencmd only applies to raspberry pi
-            state = str(subprocess.check_output(["vcgencmd", "display_power"]))
-            if (state.find("display_power=1") != -1):
-                return True
-            else:
-                return False
-        except Exception as e:
-            self.__logger.debug("Display ON/OFF is vcgencmd, but an error occurred")
-            self.__logger.debug("Cause: %s", e)
-            try: # try xset on linux, DPMS has to be enabled
-                output = subprocess.check_output(["xset" , "-display", ":0", "-q"])
-                if output.find(b'Monitor is On') != -1:
-                    return True
-                else:
-                    return False
-            except Exception as e:
-                self.__logger.debug("Display ON/OFF is X with dpms enabled, but an error occurred")
-                self.__logger.debug("Cause: %s", e)
-                self.__logger.warning("Display ON/OFF is not supported for this platform.")
-        return True
+        return self.__display_power.is_on # cached, so cheap enough to call every frame
 
     @display_is_on.setter
     def display_is_on(self, on_off):
-        try: # vcgencmd only applies to raspberry pi
-            if on_off == True:
-                subprocess.call(["vcgencmd", "display_power", "1"])
-            else:
-                subprocess.call(["vcgencmd", "display_power", "0"])
-        except Exception as e:
-            self.__logger.debug("Display ON/OFF is vcgencmd, but an error occured")
-            self.__logger.debug("Cause: %s", e)
-            try: # try xset on linux, DPMS has to be enabled
-                if on_off == True:
-                    subprocess.call(["xset" , "-display", ":0", "dpms", "force", "on"])
-                else:
-                    subprocess.call(["xset" , "-display", ":0", "dpms", "force", "off"])
-            except Exception as e:
-                self.__logger.debug("Display ON/OFF is xset via dpms, but an error occured")
-                self.__logger.debug("Cause: %s", e)
-                self.__logger.warning("Display ON/OFF is not supported for this platform.")
+        self.__display_power.is_on = on_off
 
     def set_show_text(self, txt_key=None, val="ON"):
         if txt_key is None:
@@ -180,7 +153,8 @@ class ViewerDisplay:
         except: # ignore exceptions, error handling is done in following function
             pass
         self.__mat_images, self.__mat_images_tol = self.__get_mat_image_control_values(val)
-        
+        self.__clear_prefetched() # already prepared with the old setting
+
     def get_matting_images(self):
         if self.__mat_images and self.__mat_images_tol > 0:
             return self.__mat_images_tol
@@ -189,6 +163,35 @@ class ViewerDisplay:
         else:
             return 1
 
+    @property
+    def prefetch_count(self):
+        return self.__prefetch_count
+
+    def prefetch(self, pics_list):
+        """Start preparing images for the given list of pics tuples (as returned by
+        Model.get_next_file) on the worker thread. Anything prepared earlier and not in
+        the list is dropped."""
+        if self.__prefetch_executor is None or self.__display is None:
+            return
+        size = (self.__display.width, self.__display.height)
+        wanted = {}
+        for pics in pics_list[:self.__prefetch_count]:
+            key = self.__prefetch_key(pics)
+            future = self.__prefetched.pop(key, None)
+            if future is None:
+                future = self.__prefetch_executor.submit(self.__prepare_image, pics, size)
+            wanted[key] = future
+        self.__clear_prefetched()
+        self.__prefetched = wanted
+
+    def __prefetch_key(self, pics):
+        return tuple(pic.fname if pic is not None else None for pic in pics)
+
+    def __clear_prefetched(self):
+        for future in self.__prefetched.values():
+            future.cancel()
+        self.__prefetched = {}
+
     @property
     def clock_is_on(self):
         return self.__show_clock
@@ -233,6 +236,15 @@ class ViewerDisplay:
         return im
 
 
+    def __decode_size(self, pic, size):
+        # size needed from the decoder, i.e. before __orientate_image turns the image round
+        if size is None:
+            return None
+        ext = os.path.splitext(pic.fname)[1].lower()
+        if ext not in ('.heif','.heic') and pic.orientation in (5, 6, 7, 8):
+            return (size[1], size[0])
+        return size
+
     def __get_mat_image_control_values(self, mat_images_value):
         on = True
         val = 0.01
@@ -261,8 +273,48 @@ class ViewerDisplay:
 
 
     def __tex_load(self, pics, size=None):
+        # only the texture creation needs to happen on the render thread
+        future = self.__prefetched.pop(self.__prefetch_key(pics), None)
+        if future is None and self.__prefetch_executor is not None:
+            # not prefetched (i.e. back pressed) but still run on the worker as it owns the matter
+            self.__clear_prefetched()
+            future = self.__prefetch_executor.submit(self.__prepare_image, pics, size)
+        im = future.result() if future is not None else self.__prepare_image(pics, size)
+        if im is None:
+            return None
+        try:
+            tex = pi3d.Texture(im, blend=True, m_repeat=True, free_after_load=True)
+            #tex = pi3d.Texture(im, blend=True, m_repeat=True, automatic_resize=config.AUTO_RESIZE,
+            #                    mipmap=config.AUTO_RESIZE, free_after_load=True) # poss try this if still some artifacts with full resolution
+        except Exception as e:
+            self.__logger.warning("Can't create tex from file: \"%s\" or \"%s\"", pics[0].fname, pics[1])
+            self.__logger.warning("Cause: %s", e)
+            tex = None
+        return tex
+
+    def __prepare_image(self, pics, size):
+        # everything up to the texture. Runs on the prefetch thread
+        key = None
+        if self.__render_cache is not None and pics[0] is not None and pics[0].file_id: # not no_files_img
+            key = render_cache.RenderCache.make_key(
+                        [(pic.file_id, pic.last_modified) for pic in pics if pic is not None], size,
+                        self.__mat_images, self.__mat_images_tol, self.__mat_type, self.__outer_mat_color,
+                        self.__inner_mat_color, self.__outer_mat_border, self.__inner_mat_border,
+                        self.__outer_mat_use_texture, self.__inner_mat_use_texture, self.__blur_edges,
+                        self.__blur_amount, self.__blur_zoom, self.__edge_alpha)
+            im = self.__render_cache.get(key)
+            if im is not None:
+                return im
+        im = self.__compose_image(pics, size)
+        if key is not None and im is not None:
+            self.__render_cache.put(key, im)
+        return im
+
+    def __compose_image(self, pics, size):
+        # decode, orientate, mat and blur
         try:
             if self.__mat_images and self.__matter == None:
+                from picframe import mat_image # imported here as ninepatch is only needed for mats
                 self.__matter = mat_image.MatImage(
                     display_size = (self.__display.width , self.__display.height),
                     resource_folder=self.__mat_resource_folder,
@@ -276,14 +328,14 @@ class ViewerDisplay:
 
             # Load the image(s) and correct their orientation as necessary
             if pics[0]:
-                im = get_image_meta.GetImageMeta.get_image_object(pics[0].fname)
+                im = get_image_meta.GetImageMeta.get_image_object(pics[0].fname, self.__decode_size(pics[0], size))
                 if im is None:
                     return None
                 if pics[0].orientation != 1:
                     im = self.__orientate_image(im, pics[0])
 
             if pics[1]:
-                im2 = get_image_meta.GetImageMeta.get_image_object(pics[1].fname)
+                im2 = get_image_meta.GetImageMeta.get_image_object(pics[1].fname, self.__decode_size(pics[1], size))
                 if im2 is None:
                     return None
                 if pics[1].orientation != 1:
@@ -336,15 +388,12 @@ class ViewerDisplay:
                     im_b.paste(im, box=(round(0.5 * (im_b.size[0] - im.size[0])),
                                         round(0.5 * (im_b.size[1] - im.size[1]))))
                     im = im_b # have to do this as paste applies in place
-            tex = pi3d.Texture(im, blend=True, m_repeat=True, free_after_load=True)
-            #tex = pi3d.Texture(im, blend=True, m_repeat=True, automatic_resize=config.AUTO_RESIZE,
-            #                    mipmap=config.AUTO_RESIZE, free_after_load=True) # poss try this if still some artifacts with full resolution
         except Exception as e:
-            self.__logger.warning("Can't create tex from file: \"%s\" or \"%s\"", pics[0].fname, pics[1])
+            self.__logger.warning("Can't prepare image from file: \"%s\" or \"%s\"", pics[0].fname, pics[1])
             self.__logger.warning("Cause: %s", e)
-            tex = None
+            im = None
             #raise # only re-raise errors here while debugging
-        return tex
+        return im
 
     def __make_text(self, pic, paused, side=0, pair=False):
         # if side 0 and pair False then this is a full width text and put into
@@ -538,4 +587,7 @@ class ViewerDisplay:
         return (loop_running, False) # now returns tuple with skip image flag added
 
     def slideshow_stop(self):
+        if self.__prefetch_executor is not None:
+            self.__clear_prefetched()
+            self.__prefetch_executor.shutdown(wait=True)
         self.__display.destroy()
\ No newline at end of file
@@ -0,0 +1,38 @@
+"""Times tags and location filters on a synthetic db, comparing the LIKE '%word%' the controller
+used to make for each word with the full text index lookup from ImageCache.get_text_where_clause.
+Run from the repo root:
+
+    python -m test.bench_filter [rows ...]
+"""
+import sqlite3
+
+from test.bench_util import run, make_cache, insert_rows, timed
+
+TAGS = ["holiday", "beach", "mountains", "family", "birthday", "christmas", "garden", "wedding",
+        "school", "football", "concert", "museum", "snow", "sunset", "dog", "cat"]
+PLACES = ["London", "Paris", "New York", "Berlin", "Rome", "Madrid", "Lisbon", "Vienna"]
+LOCATIONS = 500
+FILTERS = (("tags", "sunset"), ("tags", "holiday,beach"), ("location", "new york"), ("location", "Street 17,"))
+
+
+def bench(rows, tmp_dir):
+    cache, pic_dir, db_file = make_cache(tmp_dir)
+    with sqlite3.connect(db_file) as db: # before the meta so the triggers index the descriptions
+        db.executemany("INSERT INTO location(latitude, longitude, description) VALUES(?, 0.0, ?)",
+                       ((i, "{} Street {}, {}".format(i, i % 50, PLACES[i % len(PLACES)])) for i in range(LOCATIONS)))
+    db.close()
+    # through the triggers, so this also shows what keeping the index up to date costs
+    insert_tm = insert_rows(db_file, [pic_dir], rows, ("tags", "latitude", "longitude"),
+                            ((i, ",".join(TAGS[(i * k) % len(TAGS)] for k in (1, 3, 7)), i % LOCATIONS, 0.0)
+                             for i in range(1, rows + 1)))
+    print("{:>8d} rows meta inserted in {:.1f} s".format(rows, insert_tm))
+    for field, phrase in FILTERS:
+        for name, where_clause in (("LIKE", "{} LIKE '%{}%'".format(field, phrase)),
+                                   ("fts", cache.get_text_where_clause(field, phrase))):
+            elapsed, result = timed(lambda: cache.query_ids(where_clause))
+            print("{:>8d} rows {:8s} {:14s} {:5s} {:8.1f} ms ({} matched)".format(
+                rows, field, phrase, name, elapsed * 1000, len(result)))
+
+
+if __name__ == "__main__":
+    run(bench, [100000, 1000000])
@@ -0,0 +1,52 @@
+"""Compares the single pass GetImageMeta with the previous three pass reading
+(exifread, iptcinfo3 and PIL each opening the file). Run from the repo root:
+
+    python -m test.bench_get_image_meta [image_dir] [repeats]
+"""
+import os
+import sys
+import logging
+import exifread
+from PIL import Image
+from iptcinfo3 import IPTCInfo
+
+from picframe.get_image_meta import GetImageMeta
+from test.bench_util import timed
+
+
+def legacy_read(fname):
+    # what GetImageMeta used to do: three opens and a full decode for the size
+    with open(fname, 'rb') as fh:
+        tags = exifread.process_file(fh, details=False)
+    try:
+        with open(fname, 'rb') as fh:
+            iptc = IPTCInfo(fh, force=True, out_charset='utf-8')
+            tags['IPTC Keywords'] = iptc['keywords']
+    except Exception:
+        pass
+    try:
+        image = GetImageMeta.get_image_object(fname)
+        size = image.size
+    except Exception:
+        size = (0, 0)
+    return tags, size
+
+
+def single_pass_read(fname):
+    meta = GetImageMeta(fname)
+    return meta.has_exif(), meta.get_size()
+
+
+def main():
+    logging.disable(logging.WARNING)
+    image_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), 'images')
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    files = [os.path.join(image_dir, f) for f in sorted(os.listdir(image_dir))
+                if os.path.splitext(f)[1].lower() in ('.jpg', '.jpeg', '.png', '.heif', '.heic')]
+    for name, reader in (('legacy three pass', legacy_read), ('single pass', single_pass_read)):
+        elapsed, _ = timed(lambda: [reader(fname) for fname in files], repeats)
+        print("{:20s} {:8.1f} files/sec".format(name, len(files) / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Times writing new files into the ImageCache db, comparing the old per file insert that
+looked the file_id up through the all_data view with the batched insert using lastrowid.
+Each size is the number of rows already in the db before the timed files are added.
+Run from the repo root:
+
+    python -m test.bench_insert [rows ...]
+"""
+import os
+import sqlite3
+
+from picframe.image_cache import ImageCache, get_exif_info
+from test.bench_util import run, make_cache, insert_rows, timed
+
+FILES_PER_FOLDER = 100
+NEW_FILES = 500
+BATCH_SIZE = ImageCache.INSERT_BATCH_SIZE
+
+
+def new_files(pic_dir, tag, meta):
+    return [("{}/new_{}_{}/img{}.jpg".format(pic_dir, tag, i // FILES_PER_FOLDER, i), 0.0, meta)
+            for i in range(NEW_FILES)]
+
+
+def old_insert(db_file, batch):
+    # the statements as they were before the file_id was taken from lastrowid
+    db = sqlite3.connect(db_file)
+    file_insert = "INSERT OR REPLACE INTO file(folder_id, basename, extension, last_modified) VALUES((SELECT folder_id from folder where name = ?), ?, ?, ?)"
+    folder_insert = "INSERT OR IGNORE INTO folder(name) VALUES(?)"
+    folder_update = "UPDATE folder SET missing = 0 where name = ?"
+    for i, (file, mod_tm, meta) in enumerate(batch):
+        dir, file_only = os.path.split(file)
+        base, extension = os.path.splitext(file_only)
+        db.execute(folder_insert, (dir,))
+        db.execute(folder_update, (dir,))
+        db.execute(file_insert, (dir, base, extension.lstrip("."), mod_tm))
+        meta_insert = 'INSERT OR REPLACE INTO meta(file_id, {0}) VALUES((SELECT file_id from all_data where fname = ?), {1})'.format(
+            ', '.join(meta.keys()), ', '.join('?' * len(meta)))
+        db.execute(meta_insert, [file] + list(meta.values()))
+        if (i + 1) % BATCH_SIZE == 0:
+            db.commit()
+    db.commit()
+    db.close()
+
+
+def new_insert(cache, batch):
+    for i in range(0, len(batch), BATCH_SIZE):
+        cache._ImageCache__insert_files(batch[i:i + BATCH_SIZE])
+
+
+def bench(rows, tmp_dir):
+    meta = get_exif_info("test/images/AlleExif.JPG")
+    cache, pic_dir, db_file = make_cache(tmp_dir)
+    folders = ["{}/event{}".format(pic_dir, i) for i in range(1, max(rows // FILES_PER_FOLDER, 1) + 1)]
+    insert_rows(db_file, folders, rows, ("width", "height"), ((i, 4000, 3000) for i in range(1, rows + 1)))
+    for name, insert in (("all_data lookup", lambda batch: old_insert(db_file, batch)),
+                         ("batched lastrowid", lambda batch: new_insert(cache, batch))):
+        batch = new_files(pic_dir, name.split()[0], meta)
+        elapsed, _ = timed(lambda: insert(batch), repeats=1) # the files are only new once
+        print("{:>8d} rows {:18s} {:9.0f} files/s".format(rows, name, len(batch) / elapsed))
+
+
+if __name__ == "__main__":
+    run(bench, [1000, 10000, 50000])
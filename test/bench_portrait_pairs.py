@@ -0,0 +1,55 @@
+"""Times ImageCache.query_cache with portrait_pairs on a synthetic db, comparing the old
+two SELECTs and list.pop(0) pairing with the single pass, and checks both give the same
+playlist. Run from the repo root:
+
+    python -m test.bench_portrait_pairs [rows ...]
+"""
+import random
+import sqlite3
+
+from test.bench_util import run, make_cache, insert_rows, timed
+
+FILES_PER_FOLDER = 100
+
+
+def old_query(db_file, where_clause, sort_clause):
+    # query_cache as it was, with two SELECTs and pop(0) from the portrait list
+    cursor = sqlite3.connect(db_file).cursor()
+    sql = """SELECT CASE WHEN is_portrait = 0 THEN file_id ELSE -1 END
+                FROM all_data WHERE {0} ORDER BY {1}""".format(where_clause, sort_clause)
+    full_list = cursor.execute(sql).fetchall()
+    sql = """SELECT file_id FROM all_data WHERE ({0}) AND is_portrait = 1 ORDER BY {1}""".format(where_clause, sort_clause)
+    pair_list = cursor.execute(sql).fetchall()
+    newlist = []
+    skip_portrait_slot = False
+    for i in range(len(full_list)):
+        if full_list[i][0] != -1:
+            newlist.append(full_list[i])
+        elif skip_portrait_slot:
+            skip_portrait_slot = False
+            continue
+        elif pair_list:
+            elem = pair_list.pop(0)
+            if pair_list:
+                elem += pair_list.pop(0)
+                skip_portrait_slot = True
+            newlist.append(elem)
+    return newlist
+
+
+def bench(rows, tmp_dir):
+    cache, pic_dir, db_file = make_cache(tmp_dir, portrait_pairs=True)
+    folders = ["{}/event{}".format(pic_dir, i) for i in range(1, max(rows // FILES_PER_FOLDER, 1) + 1)]
+    random.seed(rows)
+    # about half portraits, and the odd file without meta data, as the old query treated those as portrait slots
+    insert_rows(db_file, folders, rows, ("width", "height", "exif_datetime"),
+                ((i, 4000, random.choice((3000, 5000)), i) for i in range(1, rows + 1) if i % 1000 != 7))
+    for sort_clause in ("exif_datetime ASC", "fname ASC"):
+        old_tm, old_list = timed(lambda: old_query(db_file, "1", sort_clause), repeats=1)
+        new_tm, new_list = timed(lambda: cache.query_cache("1", sort_clause), repeats=1)
+        print("{:>8d} rows {:18s} two SELECTs {:8.0f} ms, single pass {:6.0f} ms, {}".format(
+            rows, sort_clause, old_tm * 1000, new_tm * 1000, "same" if old_list == new_list else "DIFFERENT"))
+
+
+if __name__ == "__main__":
+    run(bench, [10000, 100000, 400000])
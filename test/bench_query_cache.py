@@ -0,0 +1,28 @@
+"""Times ImageCache.query_cache for a subdirectory filter on a synthetic db, comparing the
+old LIKE on the computed fname with the indexed folder_name range. Run from the repo root:
+
+    python -m test.bench_query_cache [rows ...]
+"""
+from picframe.image_cache import ImageCache
+from test.bench_util import run, make_cache, insert_rows, timed
+
+FILES_PER_FOLDER = 100
+TOP_FOLDERS = 20
+
+
+def bench(rows, tmp_dir):
+    cache, pic_dir, db_file = make_cache(tmp_dir)
+    folders = ["{}/year{}/event{}".format(pic_dir, i % TOP_FOLDERS, i) for i in range(1, rows // FILES_PER_FOLDER + 1)]
+    insert_rows(db_file, folders, rows, ("width", "height", "exif_datetime"),
+                ((i, 4000, 3000, i) for i in range(1, rows + 1)))
+    sub_dir = "{}/year3".format(pic_dir)
+    for name, where_clause in (("fname LIKE", "fname LIKE '{}/%'".format(sub_dir)),
+                               ("folder_name range", ImageCache.get_folder_where_clause(sub_dir))):
+        for sort_clause in ("exif_datetime ASC", "fname ASC"):
+            elapsed, result = timed(lambda: cache.query_cache(where_clause, sort_clause))
+            print("{:>8d} rows {:18s} {:18s} {:7.1f} ms ({} matched)".format(
+                rows, name, sort_clause, elapsed * 1000, len(result)))
+
+
+if __name__ == "__main__":
+    run(bench, [100000, 1000000])
@@ -0,0 +1,60 @@
+"""Shared set up for the bench_*.py scripts, which time the old and new ways of doing
+something on a synthetic db. Not a test module so pytest doesn't collect it.
+"""
+import os
+import sys
+import time
+import logging
+import sqlite3
+import tempfile
+
+from picframe.image_cache import ImageCache
+
+
+def run(bench, default_sizes):
+    """Calls bench(rows, tmp_dir) for each number of rows given on the command line, or
+    default_sizes, each with a new temporary folder"""
+    logging.disable(logging.WARNING)
+    sizes = [int(n) for n in sys.argv[1:]] or default_sizes
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bench(rows, tmp_dir)
+
+
+def make_cache(tmp_dir, **kwargs):
+    """An ImageCache with the current schema in tmp_dir, ready to be filled through
+    insert_rows. Returns (cache, pic_dir, db_file)"""
+    pic_dir = os.path.join(tmp_dir, 'pics')
+    os.mkdir(pic_dir)
+    db_file = os.path.join(tmp_dir, 'bench.db3')
+    cache = ImageCache(pic_dir, False, db_file, None, continuous_update=False, **kwargs)
+    cache._loop_thread.join() # one pass over the empty folder creates the schema
+    return cache, pic_dir, db_file
+
+
+def insert_rows(db_file, folders, rows, meta_columns, meta_rows):
+    """Adds the folders, rows files img1 to img<rows> spread over them and meta_rows, tuples
+    of file_id then the meta_columns. Returns the seconds taken by the meta insert, which
+    includes keeping the indexes and triggers up to date"""
+    db = sqlite3.connect(db_file)
+    db.executemany("INSERT INTO folder(folder_id, name) VALUES(?, ?)", enumerate(folders, 1))
+    db.executemany("INSERT INTO file(file_id, folder_id, basename, extension) VALUES(?, ?, ?, 'jpg')",
+                   ((i, i % len(folders) + 1, "img{}".format(i)) for i in range(1, rows + 1)))
+    start = time.perf_counter()
+    db.executemany("INSERT INTO meta(file_id, {}) VALUES(?, {})".format(
+                        ", ".join(meta_columns), ", ".join("?" * len(meta_columns))), meta_rows)
+    db.commit()
+    elapsed = time.perf_counter() - start
+    db.close()
+    return elapsed
+
+
+def timed(func, repeats=3):
+    """Returns the best time in seconds of repeats calls of func and its last result"""
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
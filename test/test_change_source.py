@@ -0,0 +1,47 @@
+import os
+import pytest
+
+from picframe.change_source import get_change_source, InotifyChangeSource, PollingChangeSource
+
+
+def test_polling_always_walks(tmp_path):
+    (tmp_path / "a").mkdir()
+    source = PollingChangeSource(str(tmp_path), False)
+    folders, full_walk = source.get_changed_folders()
+    assert full_walk == True
+    assert sorted(folders) == [str(tmp_path), str(tmp_path / "a")]
+    folders, full_walk = source.get_changed_folders()
+    assert full_walk == True
+    assert len(folders) == 2
+
+def test_unknown_kind(tmp_path):
+    assert isinstance(get_change_source(str(tmp_path), False, 'poll'), PollingChangeSource)
+    with pytest.raises(ValueError):
+        get_change_source(str(tmp_path), False, 'polling')
+
+def test_inotify_reports_only_changed_folders(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    source = get_change_source(str(tmp_path), False, 'inotify')
+    if not isinstance(source, InotifyChangeSource):
+        pytest.skip("inotify not available on this platform")
+    try:
+        folders, full_walk = source.get_changed_folders()
+        assert full_walk == True
+        assert len(folders) == 3
+
+        assert source.get_changed_folders() == ([], False)
+
+        (tmp_path / "a" / "pic.jpg").write_bytes(b"x")
+        (tmp_path / "b" / "new").mkdir()
+        (tmp_path / "b" / "new" / "pic.jpg").write_bytes(b"x")
+        folders, full_walk = source.get_changed_folders()
+        assert full_walk == False
+        assert sorted(folders) == [str(tmp_path / "a"), str(tmp_path / "b"), str(tmp_path / "b" / "new")]
+
+        source.request_full_walk()
+        folders, full_walk = source.get_changed_folders()
+        assert full_walk == True
+        assert len(folders) == 4
+    finally:
+        source.close()
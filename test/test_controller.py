@@ -0,0 +1,28 @@
+from picframe.controller import Controller
+
+
+class FakeModel:
+    def __init__(self):
+        self.where_clauses = {}
+
+    def get_text_where_clause(self, field, phrase):
+        return "{}~{}".format(field, phrase)
+
+    def set_where_clause(self, key, value=None):
+        self.where_clauses[key] = value
+
+    def force_reload(self):
+        pass
+
+
+def test_tags_filter():
+    model = FakeModel()
+    controller = Controller(model, None)
+    controller.tags_filter = "holiday beach OR (sun AND NOT dog)"
+    assert model.where_clauses['tags_filter'] == "(tags~holiday beach OR ( tags~sun AND NOT tags~dog ))"
+    controller.tags_filter = "(sunset)"
+    assert model.where_clauses['tags_filter'] == "(( tags~sunset ))"
+    controller.tags_filter = "family"
+    assert model.where_clauses['tags_filter'] == "(tags~family)"
+    controller.tags_filter = "cat OR AND dog"
+    assert model.where_clauses['tags_filter'] is None
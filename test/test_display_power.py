@@ -0,0 +1,64 @@
+import subprocess
+
+import pytest
+
+from picframe.display_power import DisplayPower
+
+
+@pytest.fixture
+def platform(monkeypatch):
+    """Fakes vcgencmd and xset, each either missing or working, and the drm connectors in sysfs"""
+    calls = []
+    tools = {'vcgencmd': False, 'xset': False}
+    drm = {'state': True}
+
+    def run(args):
+        calls.append(args[0])
+        if not tools[args[0]]:
+            raise FileNotFoundError(args[0])
+
+    def check_output(args, **kwargs):
+        run(args)
+        return b'display_power=1' if args[0] == 'vcgencmd' else b'Monitor is On'
+
+    def check_call(args, **kwargs):
+        run(args)
+        return 0
+
+    monkeypatch.setattr(subprocess, 'check_output', check_output)
+    monkeypatch.setattr(subprocess, 'check_call', check_call)
+    monkeypatch.setattr(DisplayPower, '_DisplayPower__read_drm', lambda self: drm['state'])
+    return calls, tools, drm
+
+
+@pytest.mark.parametrize('tool', ['vcgencmd', 'xset'])
+def test_drm_read_switched_by_tool(platform, tool):
+    calls, tools, drm = platform
+    tools[tool] = True
+    display = DisplayPower(refresh_tm=0.0)
+    assert display.is_on
+    display.is_on = False
+    assert calls[-1] == tool # a KMS pi without X still switches with vcgencmd
+    del calls[:]
+    drm['state'] = False
+    assert not display.is_on
+    assert calls == [] # read from sysfs, no process started
+
+
+def test_drm_read_not_switchable(platform):
+    calls, tools, drm = platform
+    display = DisplayPower(refresh_tm=0.0)
+    display.is_on = False
+    assert calls == ['vcgencmd', 'xset'] # only looking for a method
+    drm['state'] = True
+    assert display.is_on # the write couldn't happen so the state is the real one
+
+
+def test_failed_write_keeps_state(platform):
+    calls, tools, drm = platform
+    tools['xset'] = True
+    display = DisplayPower()
+    assert display.is_on
+    tools['xset'] = False # X went away
+    display.is_on = False
+    assert display.is_on # the write failed so the cached state is still the real one
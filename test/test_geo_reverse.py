@@ -0,0 +1,155 @@
+import time
+
+from picframe import geo_reverse
+from picframe.geo_reverse import GeoReverse, OfflineGeoReverse
+
+
+def wait_for_addresses(geo, count, timeout=5.0):
+    found = []
+    end_tm = time.time() + timeout
+    while len(set(found)) < count and time.time() < end_tm:
+        found.extend(geo.get_addresses())
+        time.sleep(0.01)
+    return found
+
+
+def test_request_address_is_rate_limited(monkeypatch):
+    monkeypatch.setattr(geo_reverse, 'MIN_INTERVAL', 0.2)
+    geo = GeoReverse("test@example.com")
+    calls = []
+    def lookup(lat, lon):
+        calls.append(time.time())
+        return "" if lat == 0.0 else "place {}".format(lat)
+    monkeypatch.setattr(geo, 'lookup', lookup)
+
+    start = time.time()
+    for lat in (1.0, 2.0, 0.0, 1.0):
+        geo.request_address(lat, 10.0)
+    assert time.time() - start < 0.1 # doesn't wait for the lookups
+    found = wait_for_addresses(geo, 3)
+    # the repeated request is either ignored or answered from the cache, depending on timing
+    assert sorted(set(found)) == [(0.0, 10.0, ""), (1.0, 10.0, "place 1.0"), (2.0, 10.0, "place 2.0")]
+    assert len(calls) == 3
+    assert min(b - a for a, b in zip(calls, calls[1:])) >= 0.19
+
+    geo.request_address(0.0, 10.0) # no address is a result too, so not asked again
+    time.sleep(0.3)
+    assert len(calls) == 3
+
+
+def test_request_address_retries_then_gives_up(monkeypatch):
+    monkeypatch.setattr(geo_reverse, 'MIN_INTERVAL', 0.0)
+    monkeypatch.setattr(geo_reverse, 'RETRY_TM', 0.05)
+    monkeypatch.setattr(geo_reverse, 'MAX_RETRIES', 2)
+    geo = GeoReverse("test@example.com")
+    calls = []
+    def lookup(lat, lon):
+        calls.append(time.time())
+        raise OSError("no network")
+    monkeypatch.setattr(geo, 'lookup', lookup)
+
+    geo.request_address(1.0, 2.0)
+    time.sleep(0.5)
+    assert len(calls) == 3 # first attempt and two retries
+    assert calls[2] - calls[1] > calls[1] - calls[0] # backing off
+    geo.request_address(1.0, 2.0) # given up on for FAILED_TM
+    time.sleep(0.1)
+    assert len(calls) == 3
+    assert geo.get_addresses() == []
+
+
+def test_request_address_one_lookup_per_cell(monkeypatch):
+    monkeypatch.setattr(geo_reverse, 'MIN_INTERVAL', 0.0)
+    geo = GeoReverse("test@example.com", cell_size=0.01)
+    calls = []
+    def lookup(lat, lon):
+        calls.append((lat, lon))
+        time.sleep(0.05)
+        return "town"
+    monkeypatch.setattr(geo, 'lookup', lookup)
+
+    geo.set_cells([(5000, 1000, "from last time")])
+    geo.request_address(50.0011, 10.0022)
+    assert geo.get_addresses() == [(50.0011, 10.0022, "from last time")]
+
+    for lat, lon in ((51.0011, 10.0022), (51.0055, 10.0066), (51.0099, 10.0011), (51.0111, 10.0011)):
+        geo.request_address(lat, lon)
+    found = wait_for_addresses(geo, 4)
+    assert len(found) == 4
+    assert calls == [(51.0011, 10.0022), (51.0111, 10.0011)] # the next three were in the first cell
+    assert sorted(geo.get_new_cells()) == [(5100, 1000, "town"), (5101, 1000, "town")]
+
+
+def test_background_requests_wait(monkeypatch):
+    monkeypatch.setattr(geo_reverse, 'MIN_INTERVAL', 0.02)
+    geo = GeoReverse("test@example.com", cell_size=0.01)
+    calls = []
+    def lookup(lat, lon):
+        calls.append(lat)
+        return "place"
+    monkeypatch.setattr(geo, 'lookup', lookup)
+
+    for i in range(10):
+        geo.request_address(float(i), 0.0, background=True)
+    geo.request_address(20.0, 0.0)
+    geo.request_address(9.0, 0.0) # already queued in the background, moved forward
+    assert len(wait_for_addresses(geo, 11)) == 11
+    assert calls.index(20.0) <= 1 and calls.index(9.0) <= 2
+    assert sorted(calls) == [float(i) for i in range(10)] + [20.0]
+    assert geo.queued_count == 0
+
+
+def place_line(geonameid, name, lat, lon, code, country, admin1):
+    fields = [str(geonameid), name, name, '', str(lat), str(lon), 'P', code, country, '', admin1, '', '', '', '1000']
+    return '\t'.join(fields) + '\n'
+
+
+def test_offline_nearest_place(tmp_path):
+    (tmp_path / "cities.txt").write_text(
+        place_line(1, "Dubai", 25.07725, 55.30927, 'PPLA', 'AE', '03') +
+        place_line(2, "Sharjah", 25.33737, 55.41206, 'PPLA', 'AE', '06') +
+        place_line(3, "Deira", 25.27, 55.32, 'PPLX', 'AE', '03') +
+        place_line(4, "Suva", -18.14161, 178.44149, 'PPLC', 'FJ', 'C') +
+        place_line(5, "Levuka", -17.68, -179.6, 'PPLA', 'FJ', 'E'), encoding='utf-8')
+    (tmp_path / "admin1CodesASCII.txt").write_text("AE.03\tDubai\tDubai\t292224\n", encoding='utf-8')
+    (tmp_path / "countryInfo.txt").write_text("#ISO\tISO3\tISO-Numeric\tfips\tCountry\nAE\tARE\t784\tAE\tUnited Arab Emirates\n",
+                                              encoding='utf-8')
+    key_list = [['tourism', 'amenity', 'isolated_dwelling'], ['suburb', 'village'], ['city', 'county'],
+                ['region', 'state', 'province'], ['country']]
+    geo = OfflineGeoReverse(str(tmp_path / "cities.txt"), key_list=key_list)
+    assert geo.get_address(25.197269, 55.274359) == "Deira, Dubai, United Arab Emirates" # AlleExif.JPG
+    assert geo.get_address(25.3, 55.4) == "Sharjah, 06, United Arab Emirates" # no admin1 name so the code
+    assert geo.get_address(-17.9, 179.9) == "Levuka, E, FJ" # nearest is across the 180 meridian
+    assert geo.get_address(-40.0, -130.0) == "" # middle of the pacific
+
+    geo.request_address(25.3, 55.4)
+    assert geo.get_addresses() == [(25.3, 55.4, "Sharjah, 06, United Arab Emirates")]
+
+
+def test_uncollected_results_capped(tmp_path, monkeypatch):
+    monkeypatch.setattr(geo_reverse, 'MAX_RESULTS', 3)
+    (tmp_path / "cities.txt").write_text(place_line(1, "Suva", -18.14161, 178.44149, 'PPLC', 'FJ', 'C'), encoding='utf-8')
+    geo = OfflineGeoReverse(str(tmp_path / "cities.txt"), key_list=[['city']])
+    for i in range(5):
+        geo.request_address(-18.0 - i / 100.0, 178.4)
+    assert [lat for lat, _, _ in geo.get_addresses()] == [-18.02, -18.03, -18.04] # the oldest dropped
+    geo.request_address(-18.0, 178.4)
+    assert geo.get_addresses() == [(-18.0, 178.4, "Suva")]
+
+
+def test_offline_far_from_anywhere(tmp_path):
+    (tmp_path / "cities.txt").write_text(place_line(1, "Tromso", 69.6496, 18.957, 'PPLA', 'NO', '19'), encoding='utf-8')
+    geo = OfflineGeoReverse(str(tmp_path / "cities.txt"), key_list=[['city'], ['country']])
+
+    class CountingGrid(dict):
+        lookups = 0
+
+        def get(self, *args):
+            CountingGrid.lookups += 1
+            return super().get(*args)
+
+    geo._OfflineGeoReverse__grid = CountingGrid(geo._OfflineGeoReverse__grid)
+    assert geo.get_address(69.65, 21.0) == "Tromso, NO" # 80 km east, 24 cells at this latitude
+    CountingGrid.lookups = 0
+    assert geo.get_address(88.0, 0.0) == "" # near the pole with nothing within MAX_DISTANCE
+    assert CountingGrid.lookups <= (2 * geo_reverse.MAX_RINGS + 1) ** 2 # rather than 500 rings or so
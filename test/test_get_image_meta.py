@@ -147,4 +147,12 @@ def test_exifs_heic():
         assert caption == None
 
     except:
-        pytest.fail("Unexpected exception")
\ No newline at end of file
+        pytest.fail("Unexpected exception")
+
+def test_get_image_size():
+    try:
+        assert GetImageMeta.get_image_size("test/images/AlleExif.JPG") == (1920, 1200)
+        # read from the ispe and irot boxes, i.e. same as the decoded (rotated) image
+        assert GetImageMeta.get_image_size("test/images/test3.HEIC") == (3024, 4032)
+    except:
+        pytest.fail("Unexpected exception")
@@ -0,0 +1,307 @@
+import os
+import time
+import random
+import shutil
+import sqlite3
+import threading
+import concurrent.futures
+
+import pytest
+
+from picframe.image_cache import ImageCache, calendar_day
+
+BATCH_SIZE = ImageCache.INSERT_BATCH_SIZE
+
+
+def make_cache(tmp_path, **kwargs):
+    pic_dir = tmp_path / 'pics'
+    pic_dir.mkdir(parents=True)
+    db_file = str(tmp_path / 'test.db3')
+    cache = ImageCache(str(pic_dir), False, db_file, None, continuous_update=False, **kwargs)
+    cache._loop_thread.join() # one pass over the empty folder, after this the test thread is the only writer
+    return cache, str(pic_dir), db_file
+
+
+def make_batch(pic_dir, n):
+    return [("{}/folder{}/img{}.jpg".format(pic_dir, n % 7, n * BATCH_SIZE + i), float(n),
+             {'width': 4000, 'height': 3000 if i % 3 else 5000}) for i in range(BATCH_SIZE)]
+
+
+def test_reads_while_writing(tmp_path):
+    cache, pic_dir, db_file = make_cache(tmp_path, portrait_pairs=True)
+    batches = 40
+    errors = []
+    writing = threading.Event()
+    writing.set()
+
+    def read():
+        try:
+            last_count = 0
+            while writing.is_set():
+                count = len(cache.query_ids("1"))
+                # each batch is one transaction so a reader never sees part of one
+                assert count % BATCH_SIZE == 0 and count >= last_count
+                last_count = count
+                if count > 0:
+                    row = cache.get_file_info(random.randint(1, count), displayed=False)
+                    assert row is not None and row['width'] == 4000
+                cache.query_cache("1", "fname ASC")
+                cache.get_setting('playlist_index')
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        for n in range(batches):
+            cache._ImageCache__insert_files(make_batch(pic_dir, n))
+    finally:
+        writing.clear()
+        for reader in readers:
+            reader.join()
+    assert errors == []
+    assert len(cache.query_ids("1")) == batches * BATCH_SIZE
+    assert cache.get_file_info(1)['fname'] == "{}/folder0/img0.jpg".format(pic_dir)
+
+
+def test_db_pragmas(tmp_path):
+    cache, _, db_file = make_cache(tmp_path)
+    assert sqlite3.connect(db_file).execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    del cache
+    cache, _, db_file = make_cache(tmp_path / 'delete', db_pragmas={'journal_mode': 'DELETE', 'cache_size': '1; DROP'})
+    assert sqlite3.connect(db_file).execute("PRAGMA journal_mode").fetchone()[0] == 'delete'
+    assert cache.query_ids("1") == []
+
+
+def test_change_feed(tmp_path, monkeypatch):
+    cache, pic_dir, _ = make_cache(tmp_path)
+    start = cache.change_count
+    assert cache.get_changes(start) == (start, [], [])
+    cache._ImageCache__insert_files(make_batch(pic_dir, 0))
+    cache._ImageCache__insert_files(make_batch(pic_dir, 1)[:3])
+    count, inserted, deleted = cache.get_changes(start)
+    assert count == start + 2 and len(inserted) == BATCH_SIZE + 3 and deleted == []
+    assert cache.get_changes(start + 1) == (count, inserted[BATCH_SIZE:], [])
+    # a modified file gets a new file_id
+    cache._ImageCache__insert_files(make_batch(pic_dir, 1)[:1])
+    assert cache.get_changes(count) == (count + 1, [max(inserted) + 1], [inserted[BATCH_SIZE]])
+
+    monkeypatch.setattr(ImageCache, 'CHANGE_FEED_SIZE', 10)
+    cache._ImageCache__insert_files(make_batch(pic_dir, 2)[:5])
+    assert cache.get_changes(start) is None # only the last change is kept now
+    assert len(cache.get_changes(count + 1)[1]) == 5
+
+
+def test_text_index(tmp_path):
+    cache, pic_dir, db_file = make_cache(tmp_path)
+    assert cache.has_text_index
+    tags = ["Holiday,Beach", "holiday,Mountains", "work", None]
+    cache._ImageCache__insert_files([("{}/img{}.jpg".format(pic_dir, i), 1.0,
+                                      {'tags': tag, 'latitude': 51.5, 'longitude': -0.1 * (i % 2)})
+                                     for i, tag in enumerate(tags)])
+
+    def matched(field, phrase):
+        fts = cache.query_ids(cache.get_text_where_clause(field, phrase))
+        assert fts == cache.query_ids("{} LIKE '%{}%'".format(field, phrase)) # same as the old filter
+        return sorted(file_id for file_id, _, _ in fts)
+
+    assert matched('tags', 'holi') == [1, 2]
+    assert matched('tags', 'ay,Bea') == [1]
+    assert matched('tags', 'wo') == [3] # too short for the index so LIKE
+    assert cache.get_text_where_clause('tags', "o'") == "tags LIKE '%o''%'"
+    assert matched('location', 'London') == []
+    # the geocoder writes locations later, and replaces them
+    db = cache._ImageCache__db
+
+    def write(sql):
+        db.execute(sql)
+        db.commit()
+
+    write("INSERT OR REPLACE INTO location (latitude, longitude, description) VALUES (51.5, 0.0, 'London, UK')")
+    assert matched('location', 'london') == [1, 3]
+    write("INSERT OR REPLACE INTO location (latitude, longitude, description) VALUES (51.5, 0.0, 'City of London')")
+    assert matched('location', 'city of') == [1, 3]
+    write("UPDATE meta SET tags = 'office', longitude = -0.1 WHERE file_id = 3")
+    assert matched('tags', 'work') == [] and matched('location', 'london') == [1]
+    write("DELETE FROM file WHERE file_id = 1")
+    assert matched('tags', 'holiday') == [2]
+    # made again from the tables for a db without the triggers
+    db.execute("DROP TRIGGER Meta_Fts_Insert_Trigger")
+    db.execute("DELETE FROM meta_fts")
+    db.commit()
+    cache.stop()
+    cache = ImageCache(pic_dir, False, db_file, None, continuous_update=False)
+    cache._loop_thread.join()
+    assert cache.query_ids(cache.get_text_where_clause('tags', 'holiday')) == [(2, 0, 1.0)]
+
+
+def test_calendar_columns(tmp_path):
+    cache, pic_dir, db_file = make_cache(tmp_path)
+    dates = [(2019, 12, 30), (2020, 1, 2), (2020, 2, 29), (2021, 3, 1), (2022, 12, 31), (2023, 6, 15)]
+    cache._ImageCache__insert_files([("{}/img{}.jpg".format(pic_dir, i), 1.0,
+                                      {'exif_datetime': time.mktime((y, m, d, 12, 0, 0, 0, 0, -1))})
+                                     for i, (y, m, d) in enumerate(dates)])
+    cache.stop()
+    # back to a db from before the calendar columns
+    db = sqlite3.connect(db_file)
+    for column in ('month', 'day_of_year'):
+        db.execute("DROP INDEX meta_{}".format(column))
+    for column in ('year', 'month', 'day_of_year'):
+        db.execute("ALTER TABLE meta DROP COLUMN {}".format(column))
+    db.execute("UPDATE db_info SET schema_version = 4")
+    db.commit()
+    db.close()
+    cache = ImageCache(pic_dir, False, db_file, None, continuous_update=False)
+    cache._loop_thread.join()
+    rows = sorted(cache.query_cache("1", "file_id ASC"))
+    assert [tuple(cache.get_file_info(file_id, displayed=False)[c] for c in ('year', 'month', 'day_of_year'))
+            for file_id, in rows] == [(y, m, calendar_day(m, d)) for y, m, d in dates]
+
+    def taken_near(month, day, days):
+        where_clause = ImageCache.get_calendar_where_clause(calendar_day(month, day), days)
+        return sorted(dates[file_id - 1] for file_id, _, _ in cache.query_ids(where_clause))
+
+    assert taken_near(12, 31, 2) == [(2019, 12, 30), (2020, 1, 2), (2022, 12, 31)] # across the new year
+    assert taken_near(1, 1, 1) == [(2020, 1, 2), (2022, 12, 31)]
+    assert taken_near(2, 29, 1) == [(2020, 2, 29), (2021, 3, 1)] # 29 Feb has its own day every year
+    assert taken_near(3, 1, 0) == [(2021, 3, 1)]
+    assert len(taken_near(6, 1, 200)) == len(dates)
+    assert len(cache.query_ids("month = 12")) == 2
+
+
+@pytest.mark.parametrize('change_source_type', ['poll', 'inotify'])
+def test_purge(tmp_path, monkeypatch, change_source_type):
+    cache, pic_dir, _ = make_cache(tmp_path, change_source_type=change_source_type)
+    files = ['a/x.jpg', 'a/y.jpg', 'a/b/z.jpg', 'c/d/w.jpg']
+    for file in files:
+        os.makedirs(os.path.dirname(os.path.join(pic_dir, file)), exist_ok=True)
+        open(os.path.join(pic_dir, file), 'wb').close()
+    cache._ImageCache__insert_files([(os.path.join(pic_dir, file), 1.0, {'width': 1}) for file in files])
+    get_modified_folders = cache._ImageCache__get_modified_folders
+    purge = cache._ImageCache__purge_missing_files_and_folders
+    cache._ImageCache__update_folder_info(get_modified_folders())
+    purge()
+
+    def on_disk():
+        # through the loop's connection as purge doesn't commit
+        return sorted(os.path.relpath(row[0], pic_dir) for row in cache._ImageCache__db.execute("SELECT fname FROM all_data"))
+
+    # nothing has changed so nothing is looked at
+    get_modified_folders()
+    monkeypatch.setattr(os, 'scandir', None)
+    monkeypatch.setattr(os.path, 'isdir', None)
+    purge()
+    monkeypatch.undo()
+
+    cache._ImageCache__db.execute("UPDATE folder SET last_modified = 0") # as if the scan was a while ago
+    os.remove(os.path.join(pic_dir, 'a/y.jpg'))
+    shutil.rmtree(os.path.join(pic_dir, 'c'))
+    get_modified_folders()
+    purge()
+    assert on_disk() == ['a/b/z.jpg', 'a/x.jpg', 'a/y.jpg'] # c/d is missing, the files stay until purged
+    cache.purge_files()
+    purge()
+    assert on_disk() == ['a/b/z.jpg', 'a/x.jpg']
+    assert cache._ImageCache__db.execute("SELECT COUNT(*) FROM folder WHERE name LIKE '%/c/d'").fetchone()[0] == 0
+
+
+def test_stop_while_indexing(tmp_path, monkeypatch):
+    cache, pic_dir, _ = make_cache(tmp_path)
+    reading = threading.Event()
+
+    def slow_read(file):
+        reading.set()
+        time.sleep(0.05)
+        return file, 1.0, {'width': 1}
+
+    monkeypatch.setattr('picframe.image_cache.read_file_meta', slow_read)
+    cache._ImageCache__modified_files = ["{}/img{}.jpg".format(pic_dir, i) for i in range(10000)] # ~10 minutes
+    cache._continuous_update = True
+    cache.start()
+    assert reading.wait(5.0)
+    start = time.time()
+    cache.stop()
+    assert not cache._loop_thread.is_alive() and time.time() - start < 5.0
+    assert cache._ImageCache__modified_files # left for the next start
+
+
+@pytest.mark.parametrize('index_workers', [1, 2])
+def test_file_gone_before_read(tmp_path, monkeypatch, index_workers):
+    cache, pic_dir, db_file = make_cache(tmp_path, index_workers=index_workers)
+
+    def read(file):
+        if file.endswith('img3.jpg'):
+            raise FileNotFoundError(file)
+        return file, 1.0, {'width': 1}
+
+    monkeypatch.setattr('picframe.image_cache.read_file_meta', read)
+    cache._ImageCache__modified_files = ["{}/img{}.jpg".format(pic_dir, i) for i in range(6)]
+    cache._ImageCache__keep_looping = True # as inside the running loop
+    if index_workers > 1: # the pool only exists while the loop thread is running
+        cache._ImageCache__executor = concurrent.futures.ThreadPoolExecutor(max_workers=index_workers)
+    cache._ImageCache__insert_modified_files()
+    # the rest of the batch still goes in
+    assert cache._ImageCache__db.execute("SELECT COUNT(*) FROM file").fetchone()[0] == 5
+
+
+def test_restart_with_pool(tmp_path, monkeypatch):
+    cache, pic_dir, _ = make_cache(tmp_path, index_workers=2)
+    monkeypatch.setattr('picframe.image_cache.read_file_meta', lambda file: (file, 1.0, {'width': 1}))
+    for i in range(3):
+        open("{}/img{}.jpg".format(pic_dir, i), 'wb').close()
+    cache.start() # as Model does to reload, after the first loop has ended
+    cache._loop_thread.join()
+    assert cache._ImageCache__db.execute("SELECT COUNT(*) FROM file").fetchone()[0] == 3
+
+
+class FakeGeoReverse:
+    cell_size = None
+    queued_count = 0
+
+    def __init__(self):
+        self.found = []
+
+    def request_address(self, lat, lon, background=False):
+        self.found.append((lat, lon, "place"))
+
+    def get_addresses(self):
+        found, self.found = self.found, []
+        return found
+
+    def get_new_cells(self):
+        return []
+
+
+def test_locations_stored_without_update_cache(tmp_path):
+    pic_dir = tmp_path / 'pics'
+    pic_dir.mkdir()
+    geo = FakeGeoReverse()
+    cache = ImageCache(str(pic_dir), False, str(tmp_path / 'test.db3'), geo, continuous_update=False)
+    deadline = time.time() + 10.0
+    while cache.pass_count == 0 and time.time() < deadline:
+        time.sleep(0.05)
+    time.sleep(2.5) # after the pass over the disk has finished, when the loop used to end
+    geo.request_address(51.5, -0.1) # as if found for a picture shown since
+
+    def stored():
+        return cache._ImageCache__read_db().execute("SELECT description FROM location").fetchall()
+
+    while not stored() and time.time() < deadline:
+        time.sleep(0.05)
+    assert [row['description'] for row in stored()] == ["place"]
+    assert geo.found == []
+    cache.stop()
+    assert not cache._loop_thread.is_alive()
+
+
+def test_sort_keys_match_order_by(tmp_path):
+    cache, pic_dir, _ = make_cache(tmp_path)
+    rng = random.Random(4)
+    cache._ImageCache__insert_files([("{}/img{}.jpg".format(pic_dir, i), float(rng.randint(0, 3)),
+                                      {'tags': rng.choice([None, "beach", "Beach", "café", ""]),
+                                       'rating': rng.choice([None, 1, 5]), 'exif_datetime': rng.random()})
+                                     for i in range(200)])
+    for sort_clause in ("tags DESC,rating ASC,exif_datetime,fname ASC", "last_modified > 1,rating DESC,fname DESC"):
+        keys = cache.query_sort_keys(range(1, 201), sort_clause)
+        assert sorted(keys, key=keys.get) == [file_id for file_id, in cache.query_cache("1", sort_clause)]
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+
+import yaml
+import pytest
+
+from picframe import model
+
+
+def make_model(tmp_path, **model_config):
+    pic_dir = tmp_path / 'pics'
+    pic_dir.mkdir()
+    config = {'viewer': {}, 'mqtt': {}, 'http': {},
+              'model': {'pic_dir': str(pic_dir), 'db_file': str(tmp_path / 'test.db3'), 'update_cache': False,
+                        'load_geoloc': False, 'recent_n': 0, **model_config}}
+    (tmp_path / 'configuration.yaml').write_text(yaml.safe_dump(config))
+    (tmp_path / 'log_config.json').write_text(json.dumps({'version': 1}))
+    frame = model.Model(False, str(tmp_path / 'configuration.yaml'))
+    cache = frame._Model__image_cache
+    cache._loop_thread.join() # one pass over the empty folder, then files are added by the test
+    return frame, cache, str(pic_dir)
+
+
+def add_files(cache, pic_dir, names, sizes=None, mod_tm=None):
+    # empty files, the model only checks they exist, with the meta as if read from them
+    now = time.time()
+    mod_tm = now if mod_tm is None else mod_tm
+    taken = time.localtime(now)
+    batch = []
+    for name, (width, height) in zip(names, sizes or [(400, 300)] * len(names)):
+        file = "{}/{}.jpg".format(pic_dir, name)
+        open(file, 'wb').close()
+        os.utime(file, (mod_tm, mod_tm)) # as the cache loop may scan the folder again
+        batch.append((file, mod_tm, {'width': width, 'height': height, 'exif_datetime': now, 'month': taken.tm_mon,
+                                  'day_of_year': model.image_cache.calendar_day(taken.tm_mon, taken.tm_mday)}))
+    cache._ImageCache__insert_files(batch)
+
+
+def test_shuffle_portrait_pairs(tmp_path):
+    frame, cache, pic_dir = make_model(tmp_path, shuffle=True, portrait_pairs=True)
+    add_files(cache, pic_dir, ["img{}".format(i) for i in range(6)], [(400, 300), (300, 400), (300, 400), (400, 300), (300, 400), (300, 400)])
+    shown = []
+    for _ in range(4): # two landscapes and two pairs of portraits
+        pic1, pic2 = frame.get_next_file()
+        shown.append((pic1.file_id, pic2.file_id if pic2 is not None else None))
+    assert frame.get_number_of_files() == 6
+    assert sorted(file_id for pics in shown for file_id in pics if file_id is not None) == list(range(1, 7))
+    assert sorted(pic2 is not None for _, pic2 in shown) == [False, False, True, True]
+    frame.stop()
+
+
+@pytest.mark.parametrize('shuffle', [True, False])
+def test_recent_first(tmp_path, shuffle):
+    frame, cache, pic_dir = make_model(tmp_path, shuffle=shuffle, recent_n=7)
+    add_files(cache, pic_dir, ["a{}".format(i) for i in range(4)], mod_tm=time.time() - 30 * 24 * 3600)
+    add_files(cache, pic_dir, ["z0", "z1"]) # last in name order
+    shown = [os.path.basename(frame.get_next_file()[0].fname)[:-4] for _ in range(6)]
+    assert sorted(shown[:2]) == ["z0", "z1"]
+    if not shuffle:
+        assert shown[2:] == ["a0", "a1", "a2", "a3"]
+    frame.stop()
+
+
+def test_sorted_splice(tmp_path):
+    frame, cache, pic_dir = make_model(tmp_path, shuffle=False, portrait_pairs=False)
+
+    def next_names(count):
+        return [os.path.basename(frame.get_next_file()[0].fname)[:-4] for _ in range(count)]
+
+    add_files(cache, pic_dir, ["b0", "b2", "b4", "b6", "b8"])
+    assert next_names(2) == ["b0", "b2"]
+    add_files(cache, pic_dir, ["b9", "a0", "b1", "b5", "b7"]) # two before the current picture
+    add_files(cache, pic_dir, ["b3"])
+    assert next_names(10) == ["b3", "b4", "b5", "b6", "b7", "b8", "b9", "a0", "b0", "b1"]
+    assert frame.get_number_of_files() == 11
+    frame.stop()
+
+
+def test_save_playlist_snapshot(tmp_path, monkeypatch):
+    frame, cache, pic_dir = make_model(tmp_path, shuffle=True)
+    add_files(cache, pic_dir, ["img{}".format(i) for i in range(4)])
+    frame.get_next_file()
+    ids = frame._Model__playlist.get_ids()
+    writers = []
+
+    class Thread: # run the writer after the playlist has changed
+        def __init__(self, target, args, **kwargs):
+            writers.append((target, args))
+
+        def start(self):
+            pass
+
+    monkeypatch.setattr(model.threading, 'Thread', Thread)
+    frame._Model__save_playlist()
+    frame._Model__playlist.remove(int(ids[1, 0]))
+    target, args = writers[0]
+    target(*args)
+    saved, info = model.playlist.Playlist.load(frame._Model__playlist_file)
+    assert (saved.get_ids() == ids).all() # as it was when saved, not as changed since
+    frame.stop()
+
+
+def test_restart_resumes_saved_playlist(tmp_path):
+    frame, cache, pic_dir = make_model(tmp_path, shuffle=True)
+    add_files(cache, pic_dir, ["img{}".format(i) for i in range(8)])
+    shown = [frame.get_next_file()[0].file_id for _ in range(3)]
+    order = frame._Model__playlist.get_ids()[:, 0].tolist()
+    frame.stop()
+    frame = model.Model(False, str(tmp_path / 'configuration.yaml'))
+    assert [frame.get_next_file()[0].file_id for _ in range(5)] == order[3:]
+    assert order[:3] == shown
+    frame.stop()
@@ -0,0 +1,72 @@
+from picframe.playlist import Playlist, make_id_array, shuffle_ids
+
+
+def test_playlist_remove():
+    playlist = Playlist([(5,), (3, 9), (7,), (1,)])
+    assert len(playlist) == 4
+    assert playlist.slot_count == 4
+    assert playlist.pic_count == 5
+    assert playlist[1] == (3, 9)
+    assert playlist.index_of(9) == 1
+    assert playlist.index_of(2) is None
+
+    assert playlist.remove(3) == True
+    assert playlist[1] == (9,)
+    assert playlist.index_of(9) == 1
+    assert playlist.remove(3) == False
+    assert playlist.remove(9) == True
+    assert playlist[1] is None
+    assert len(playlist) == 4 # positions don't move
+    assert playlist.slot_count == 3
+    assert playlist.pic_count == 3
+
+    # skips removed slots and wraps round
+    assert playlist.step_back(3, 2) == 0
+    assert playlist.step_back(1, 2) == 3
+
+
+def test_empty_playlist():
+    playlist = Playlist([])
+    assert len(playlist) == 0
+    assert playlist.slot_count == 0
+    assert playlist.pic_count == 0
+    assert playlist.index_of(1) is None
+    assert playlist.step_back(0, 2) == 0
+
+
+def test_shuffle_ids():
+    rows = [(file_id, file_id % 2, 1000.0 + file_id) for file_id in range(100, 0, -1)]
+    id_array = make_id_array(rows)
+    file_ids, is_portrait = shuffle_ids(id_array, 1234, 1090.5)
+    assert sorted(file_ids.tolist()) == list(range(1, 101))
+    assert sorted(file_ids[:10].tolist()) == list(range(91, 101)) # recent first
+    assert (is_portrait == file_ids % 2).all()
+    assert file_ids[10:].tolist() != list(range(1, 91))
+    # the same seed gives the same order whatever order the rows came in
+    assert (shuffle_ids(make_id_array(rows[::-1]), 1234, 1090.5)[0] == file_ids).all()
+    assert (shuffle_ids(id_array, 4321, 1090.5)[0] != file_ids).any()
+    assert len(shuffle_ids(make_id_array([]), 1)[0]) == 0
+
+
+def test_playlist_save_load(tmp_path):
+    playlist = Playlist([(5,), (3, 9), (7,), (1,)])
+    playlist.remove(7)
+    file_name = str(tmp_path / "playlist.npz")
+    playlist.save(file_name, index=2, signature="('1', True)")
+    loaded, info = Playlist.load(file_name)
+    assert info == {'index': 2, 'signature': "('1', True)"}
+    assert [loaded[i] for i in range(len(loaded))] == [(5,), (3, 9), None, (1,)]
+    assert loaded.slot_count == 3 # the removed slot is still empty
+    assert loaded.pic_count == 4
+    assert loaded.index_of(1) == 3
+
+
+def test_playlist_insert():
+    playlist = Playlist([(5,), (3, 9), (7,)])
+    playlist.remove(7)
+    playlist.insert([1, 1, 3], [(11, 12), (13, 0), (14, 0)])
+    assert [playlist[i] for i in range(len(playlist))] == [(5,), (11, 12), (13,), (3, 9), None, (14,)]
+    assert playlist.index_of(14) == 5
+    assert playlist.index_of(9) == 3
+    assert playlist.slot_count == 5
+    assert playlist.pic_count == 7
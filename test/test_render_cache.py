@@ -0,0 +1,38 @@
+import os
+import time
+from PIL import Image
+
+from picframe.render_cache import RenderCache
+
+
+def test_round_trip(tmp_path):
+    cache = RenderCache(str(tmp_path), 10 * 1024 * 1024)
+    key = RenderCache.make_key((1, 1234.0), (320, 200), True)
+    assert cache.get(key) is None
+    cache.put(key, Image.new('RGB', (320, 200), (200, 10, 10)))
+    image = cache.get(key)
+    assert image.size == (320, 200)
+    assert image.mode == 'RGB'
+
+    key = RenderCache.make_key((2, 1234.0), (320, 200), True)
+    cache.put(key, Image.new('RGBA', (320, 200), (200, 10, 10, 128))) # alpha kept so stored raw
+    image = cache.get(key)
+    assert image.mode == 'RGBA'
+    assert image.getpixel((0, 0)) == (200, 10, 10, 128)
+
+    # entries are picked up again by a new instance
+    assert RenderCache(str(tmp_path), 10 * 1024 * 1024).get(key) is not None
+
+def test_least_recently_used_evicted(tmp_path):
+    image = Image.new('RGBA', (100, 100)) # 40000 bytes raw
+    cache = RenderCache(str(tmp_path), 100000)
+    for i in range(2):
+        cache.put(str(i), image)
+        time.sleep(0.01)
+    cache.get('0') # now 1 is the oldest
+    time.sleep(0.01)
+    cache.put('2', image)
+    assert cache.get('1') is None
+    assert cache.get('0') is not None
+    assert cache.get('2') is not None
+    assert len(os.listdir(tmp_path)) == 2
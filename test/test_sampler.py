@@ -0,0 +1,51 @@
+import numpy as np
+
+from picframe.sampler import FenwickTree, WeightedSampler
+
+
+def test_fenwick_tree_matches_cumsum():
+    rng = np.random.default_rng(5)
+    weights = rng.random(1000)
+    weights[rng.integers(0, 1000, 100)] = 0.0
+    tree = FenwickTree(weights)
+    for _ in range(200):
+        index = int(rng.integers(0, 1000))
+        weights[index] = rng.random() if rng.random() < 0.7 else 0.0
+        tree.update(index, weights[index])
+    assert abs(tree.total - weights.sum()) < 1e-9
+    cum_sum = np.cumsum(weights)
+    for value in rng.random(500) * weights.sum():
+        expected = int(np.searchsorted(cum_sum, value, side='right'))
+        assert tree.find(value) == expected
+        assert weights[tree.find(value)] > 0.0
+
+
+def test_sampler_rotates_through_everything():
+    now = 1.0e9
+    rows = [(file_id, file_id % 2, 0, 0.0, None) for file_id in range(1, 101)]
+    sampler = WeightedSampler(rows, stale_time=1000.0, now=now)
+    picked = []
+    for i in range(10):
+        file_ids, is_portrait = sampler.sample(10, now=now + i)
+        assert (is_portrait == file_ids % 2).all()
+        picked.extend(file_ids.tolist())
+    assert sorted(picked) == list(range(1, 101)) # nothing again until everything has been shown
+    # all at 0 weight so the one picked longest ago
+    assert sampler.sample(1, now=now + 20)[0].tolist() == picked[:1]
+    # after stale_time everything is back to full weight
+    assert len(set(sampler.sample(100, now=now + 2000)[0].tolist())) == 100
+
+
+def test_sampler_weights():
+    now = 1.0e9
+    rows = [(1, 0, 0, 0.0, 5), (2, 0, 0, 0.0, None), (3, 0, 3, 0.0, None), (4, 0, 0, now - 10.0, None)]
+    # stale_time 0 so every pick is back at full weight for the next, 4 too though it was shown 10 s ago
+    sampler = WeightedSampler(rows, stale_time=0.0, rating_weight=0.5, count_power=1.0, now=now, seed=3)
+    sampler.displayed(2) # now shown once
+    counts = dict.fromkeys(range(1, 5), 0)
+    for _ in range(6000):
+        counts[int(sampler.sample(1, now=now)[0][0])] += 1
+    # weights 3.5 : 0.5 : 0.25 : 1 (stale_time 0 so 4 is back straight away)
+    assert 3.0 < counts[1] / counts[4] < 4.0
+    assert 0.4 < counts[2] / counts[4] < 0.6
+    assert 0.18 < counts[3] / counts[4] < 0.32
@@ -0,0 +1,46 @@
+import sys
+import json
+import subprocess
+
+import pytest
+
+# time allowed for a fresh interpreter to import everything needed before the first picture is
+# shown. Well above what it takes on a desktop so it only fails when something slow is added to
+# the startup path, start.py --profile-startup shows where the time goes
+STARTUP_BUDGET = 3.0
+
+
+def run_python(code):
+    # run code in a new interpreter so nothing is already imported, it prints json on its last line
+    result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True,
+                            universal_newlines=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def imported_after(statement, packages):
+    return run_python("import sys, json\n{}\nprint(json.dumps([p for p in {!r} if p in sys.modules]))".format(
+        statement, packages))
+
+
+def test_start_imports_nothing_heavy():
+    # so --version and --initialize are quick
+    heavy = ['numpy', 'pi3d', 'PIL', 'exifread', 'iptcinfo3', 'ninepatch', 'paho', 'yaml', 'distutils']
+    assert imported_after("from picframe import start", heavy) == []
+
+
+def test_parts_load_only_what_they_need():
+    # exifread and iptcinfo3 load when the image cache reads the first file, urllib.request with the
+    # first online location lookup and ninepatch with the first matted picture
+    later = ['exifread', 'iptcinfo3', 'urllib.request', 'ninepatch', 'paho', 'pi3d']
+    assert imported_after("from picframe import model", later) == []
+    pytest.importorskip('pi3d')
+    assert imported_after("from picframe import viewer_display, controller", later) == ['pi3d']
+
+
+def test_cold_start_budget():
+    pytest.importorskip('pi3d')
+    elapsed = run_python("import time, json\n"
+                         "tm = time.perf_counter()\n"
+                         "from picframe import start, model, viewer_display, controller\n"
+                         "print(json.dumps(time.perf_counter() - tm))")
+    assert elapsed < STARTUP_BUDGET